@@ -278,6 +278,34 @@ def clear(oid, cntrs):
     click.echo(status + '\n')
 
 
+@cli.group()
+def rec():
+    """Manage sairedis.rec recordings"""
+    pass
+
+
+# 'rec minimize' command
+@rec.command()
+@click.argument('fname', metavar='<rec>', required=True, type=str)
+@click.argument('output', metavar='<output>', required=True, type=str)
+@click.option('--stats', metavar='<stats>', type=str, help='Store per round timing stats into JSON file')
+def minimize(fname, output, stats):
+    """Reduce failing recording to the minimal one"""
+
+    click.echo()
+    if not os.path.isfile(fname):
+        click.echo("File {} does not exist\n".format(fname))
+        return False
+
+    sai = SaiNpu(exec_params)
+    lines = sai.minimize_rec(fname, output, stats)
+    if lines is None:
+        click.echo("{} does not fail\n".format(fname))
+        return False
+
+    click.echo("Minimal recording of {} records stored into {}\n".format(len(lines), output))
+
+
 # 'version' subcommand
 @cli.command()
 def version():
@@ -3,7 +3,15 @@ import redis
 import time
 import json
 import os
+import logging
 import pytest
+import threading
+from sai_rec import SaiRecIndex
+from sai_rec import SaiRecMinimizer
+from sai_rec import SaiRecProfile
+from sai_rec import SaiRecState
+from sai_rec import oid_pattern
+from sai_rec import parse_rec_line
 
 
 class SaiObjType(Enum):
@@ -111,8 +119,10 @@ class SaiObjType(Enum):
 
 
 class SaiData:
-    def __init__(self, data):
+    def __init__(self, data, timestamp=None):
         self.data = data
+        # The time.monotonic() time the data was collected at (set for the counters)
+        self.timestamp = timestamp
 
     def raw(self):
         return self.data
@@ -165,6 +175,12 @@ class Sai:
         self.loglevel_db = redis.Redis(host=self.server_ip, port=6379, db=3)
         self.cache = {}
         self.rec2vid = {}
+        self.rec_state = None
+        self.rec_fname = None
+        self.rec_line = None
+        self.restart_timing = {}
+        # Serializes the operations issued from multiple threads (e.g., stats poller)
+        self.lock = threading.RLock()
 
         self.client_mode = not os.path.isfile("/usr/bin/redis-server")
         libsai = os.path.isfile("/usr/lib/libsai.so") or os.path.isfile("/usr/local/lib/libsai.so")
@@ -214,13 +230,42 @@ class Sai:
                 return attr[1]
         return None
 
-    def asser_syncd_running(self, tout=30):
-        for i in range(tout):
-            time.sleep(1)
+    @staticmethod
+    def __poll(cond, tout, interval=0.01, max_interval=0.5):
+        '''
+        Polls the condition with the exponentially growing interval.
+        Returns the time it took the condition to become true or None on timeout.
+        '''
+        start = time.monotonic()
+        deadline = start + tout
+        while not cond():
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+            interval = min(interval * 1.5, max_interval)
+        return time.monotonic() - start
+
+    def __redis_run_id(self):
+        try:
+            return self.r.info("server")["run_id"]
+        except redis.exceptions.ConnectionError:
+            return None
+
+    def __syncd_subscribed(self):
+        try:
             numsub = self.r.execute_command('PUBSUB', 'NUMSUB', 'ASIC_STATE_CHANNEL@1')
-            if numsub[1] >= 1:
-                return
-        assert False, "SyncD has not started yet..."
+        except redis.exceptions.ConnectionError:
+            return False
+        return numsub[1] >= 1
+
+    def asser_syncd_running(self, tout=30):
+        '''
+        Waits for syncd to subscribe to ASIC_STATE_CHANNEL.
+        Returns the time it took.
+        '''
+        elapsed = self.__poll(self.__syncd_subscribed, tout)
+        assert elapsed is not None, "SyncD has not started yet..."
+        return elapsed
 
     def set_loglevel(self, sai_api, loglevel):
         '''
@@ -264,14 +309,122 @@ class Sai:
              restarts syncd through `killall syncd` command.
           5. The supervisord restarts syncd program as per `autorestart`
              option in `supervisord.conf` file.
+          6. This function polls Redis server until the restarted instance
+             responds and then until syncd subscribes to ASIC_STATE_CHANNEL.
+             The time spent in each phase is stored into `restart_timing`.
         '''
+        start = time.monotonic()
         self.r.flushall()
         self.loglevel_db.hmset('syncd:syncd', {'LOGLEVEL':self.loglevel, 'LOGOUTPUT':'SYSLOG'})
+        run_id = self.__redis_run_id()
+        flushed = time.monotonic()
+
         self.r.shutdown()
-        time.sleep(2)
         self.cache = {}
         self.rec2vid = {}
-        self.asser_syncd_running()
+        self.rec_state = None
+
+        # The restarted Redis server has a new run ID. Since it starts with no clients
+        # connected, any ASIC_STATE_CHANNEL subscriber is the restarted syncd.
+        redis_up = self.__poll(lambda: self.__redis_run_id() not in (None, run_id), 30)
+        assert redis_up is not None, "Redis has not restarted yet..."
+        syncd_up = self.asser_syncd_running()
+
+        self.restart_timing = {
+            "flush": round(flushed - start, 3),
+            "redis": round(redis_up, 3),
+            "syncd": round(syncd_up, 3),
+            "total": round(time.monotonic() - start, 3)
+        }
+        logging.info("Restarted syncd in {total}s: flush {flush}s, Redis {redis}s, syncd {syncd}s".format(
+                     **self.restart_timing))
+
+    def snapshot(self):
+        '''
+        Captures the current state of SAI objects: the VIDs known to syncd
+        and the attributes of the objects stored in ASIC_STATE table.
+        '''
+        vids = {vid.decode("utf-8") for vid in self.r.hkeys("VIDTORID")}
+        keys = [key.decode("utf-8") for key in self.r.scan_iter("ASIC_STATE:*", count=1000)]
+
+        pipe = self.r.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+
+        objects = {}
+        for key, attrs in zip(keys, pipe.execute()):
+            objects[key.split(":", 1)[1]] = {
+                attr.decode("utf-8"): value.decode("utf-8") for attr, value in attrs.items() if attr != b"NULL"
+            }
+        return {"vids": vids, "objects": objects}
+
+    def rollback(self, snapshot):
+        '''
+        Rolls SAI objects back to the state captured by snapshot():
+          1. Restores the modified attributes of the snapshot objects;
+          2. Removes the objects created since the snapshot in the reverse
+             dependency order. The independent objects of the same type
+             are removed by the single bulk remove operation.
+
+        Returns False when the snapshot state can not be restored this way,
+        e.g., the snapshot objects were removed or the attributes the snapshot
+        has no values for were set. The full cleanup() is required in this case.
+        '''
+        current = self.snapshot()
+        if not snapshot["vids"].issubset(current["vids"]):
+            return False
+        if not snapshot["objects"].keys() <= current["objects"].keys():
+            return False
+
+        restore = []
+        created = {}
+        for key, attrs in current["objects"].items():
+            if key in snapshot["objects"]:
+                orig_attrs = snapshot["objects"][key]
+                if not attrs.keys() <= orig_attrs.keys():
+                    return False
+                restore += [(key, attr, value) for attr, value in orig_attrs.items() if attrs.get(attr) != value]
+            elif key.split(":", 1)[1] in snapshot["vids"]:
+                # The object that existed before was modified,
+                # but its original attribute values are unknown.
+                return False
+            else:
+                created[key] = attrs
+
+        for key, attr, value in restore:
+            self.set(key, [attr, value])
+
+        refs = {}
+        for key, attrs in created.items():
+            obj_key = key.split(":", 1)[1]
+            oids = set(oid_pattern.findall("|".join(attrs.values())))
+            if obj_key.startswith("{"):
+                oids.update(oid_pattern.findall(obj_key))
+            else:
+                oids.discard(obj_key)
+            refs[key] = oids
+
+        while refs:
+            referenced = set().union(*refs.values())
+            layer = {}
+            for key in refs:
+                obj_type, obj_key = key.split(":", 1)
+                if obj_key not in referenced:
+                    layer.setdefault(obj_type, []).append(obj_key)
+            if not layer:
+                return False
+
+            for obj_type, keys in layer.items():
+                for obj_key in keys:
+                    del refs[obj_type + ":" + obj_key]
+                self.remove_many(obj_type, keys)
+
+        self.cache = {}
+        self.rec2vid = {}
+        self.rec_state = None
+        logging.info("Rolled back: {} attributes restored, {} objects removed".format(
+                     len(restore), len(created)))
+        return True
 
     def alloc_vid(self, obj_type):
         vid = None
@@ -283,6 +436,14 @@ class Sai:
             vid = self.r.incr("VIDCOUNTER")
         return "oid:" + hex((obj_type.value << 48) | vid)
 
+    def alloc_vids(self, obj_type, count):
+        '''
+        Allocates VIDs for multiple objects of the same type by the single INCRBY
+        '''
+        assert obj_type != SaiObjType.SWITCH
+        last = self.r.incrby("VIDCOUNTER", count)
+        return ["oid:" + hex((obj_type.value << 48) | vid) for vid in range(last - count + 1, last + 1)]
+
     @staticmethod
     def vid_to_type(vid):
         obj_type = int(vid[4:], 16) >> 48
@@ -344,6 +505,10 @@ class Sai:
         return json.dumps(attr_value).replace(" ", "")
 
     def operate(self, obj, attrs, op):
+        with self.lock:
+            return self.__operate(obj, attrs, op)
+
+    def __operate(self, obj, attrs, op):
         self.r.delete("GETRESPONSE_KEY_VALUE_OP_QUEUE")
 
         tout = 0.03
@@ -380,6 +545,48 @@ class Sai:
         assert len(status) == 3, "SAI \"{}\" operation failure!".format(op)
         return status
 
+    def operate_many(self, ops):
+        '''
+        Sends multiple operations to syncd in a single Redis pipeline
+        and waits for all the responses at once.
+
+        Parameters:
+            ops (list): The list of (obj, attrs, op) tuples
+
+        Returns:
+            The list of responses in the order of operations.
+            Each response is in the same format as returned by operate().
+        '''
+        if len(ops) == 0:
+            return []
+
+        with self.lock:
+            return self.__operate_many(ops)
+
+    def __operate_many(self, ops):
+        self.r.delete("GETRESPONSE_KEY_VALUE_OP_QUEUE")
+
+        pipe = self.r.pipeline(transaction=False)
+        for obj, attrs, op in ops:
+            pipe.lpush("ASIC_STATE_KEY_VALUE_OP_QUEUE", obj.replace(' ', ''), attrs, op)
+            pipe.publish("ASIC_STATE_CHANNEL@1", "G")
+        pipe.execute()
+
+        status = []
+        attempts = self.attempts * len(ops)
+        while len(status) < 3 * len(ops) and attempts > 0:
+            time.sleep(0.03)
+            attempts -= 1
+            status = self.r.lrange("GETRESPONSE_KEY_VALUE_OP_QUEUE", 0, -1)
+
+        self.r.delete("GETRESPONSE_KEY_VALUE_OP_QUEUE")
+
+        assert len(status) == 3 * len(ops), "SAI operations failure: {} of {} responses received".format(
+                                             len(status) // 3, len(ops))
+
+        # The responses are pushed to the head of the queue, so the latest goes first
+        return [status[idx:idx + 3] for idx in range(len(status) - 3, -1, -3)]
+
     def create(self, obj, attrs, do_assert = True):
         vid = None
         if type(obj) == SaiObjType:
@@ -450,6 +657,68 @@ class Sai:
 
         return status[2], data
 
+    def get_many(self, requests, do_assert = True):
+        '''
+        Retrieves the attributes of multiple objects in a single round trip
+
+        Parameters:
+            requests (list): The list of (obj, attrs) tuples in get() format
+            do_assert (bool): Assert that all the get operations succeeded.
+
+        Usage example:
+            get_many([(vlan_oid, ["SAI_VLAN_ATTR_VLAN_ID", ""]),
+                      (port_oid, ["SAI_PORT_ATTR_SPEED", "", "SAI_PORT_ATTR_MTU", ""])])
+
+        Returns:
+            The list of SaiData when do_assert is True. Otherwise,
+            the list of (status, SaiData) tuples.
+        '''
+        ops = []
+        for obj, attrs in requests:
+            if obj.startswith("oid:"):
+                obj = self.vid_to_type(obj) + ":" + obj
+            assert obj.startswith("SAI_OBJECT_TYPE_")
+            if type(attrs) != str:
+                attrs = json.dumps(attrs)
+            ops.append((obj, attrs, "Sget"))
+
+        result = []
+        for (obj, attrs, _), status in zip(ops, self.operate_many(ops)):
+            status[2] = status[2].decode("utf-8")
+            if do_assert:
+                assert status[2] == 'SAI_STATUS_SUCCESS', f"get({obj}, {attrs}) --> {status}"
+            data = SaiData(status[1].decode("utf-8"))
+            result.append(data if do_assert else (status[2], data))
+        return result
+
+    def set_many(self, requests, do_assert = True):
+        '''
+        Sets the attributes of multiple objects in a single round trip
+
+        Parameters:
+            requests (list): The list of (obj, attr) tuples in set() format
+            do_assert (bool): Assert that all the set operations succeeded.
+
+        Returns:
+            The list of the set operations statuses
+        '''
+        ops = []
+        for obj, attr in requests:
+            if obj.startswith("oid:"):
+                obj = self.vid_to_type(obj) + ":" + obj
+            assert obj.startswith("SAI_OBJECT_TYPE_")
+            if type(attr) != str:
+                attr = json.dumps(attr)
+            ops.append((obj, attr, "Sset"))
+
+        result = []
+        for (obj, attr, _), status in zip(ops, self.operate_many(ops)):
+            status[2] = status[2].decode("utf-8")
+            if do_assert:
+                assert status[2] == 'SAI_STATUS_SUCCESS', f"set({obj}, {attr}) --> {status}"
+            result.append(status[2])
+        return result
+
     def __bulk_attr_serialize(self, attr):
         data = ""
         # Input attributes: [a, v, a, v, ...]
@@ -538,12 +807,59 @@ class Sai:
         status[2] = status[2].decode("utf-8")
 
         if do_assert:
-            print(entry_status)
+            logging.debug(entry_status)
             assert status[2] == 'SAI_STATUS_SUCCESS'
             return status[2], entry_status
 
         return status[2], entry_status
 
+    def create_many(self, obj_type, attrs):
+        '''
+        Creates multiple objects of the same type by the bulk create.
+        The objects the bulk create fails for (e.g., when the bulk operation
+        is not supported for the object type) are created one by one.
+
+        Parameters:
+            obj_type (SaiObjType): The type of objects to be created
+            attrs (list): The list of the lists of objects' attributes
+
+        Returns:
+            The list of created objects VIDs
+        '''
+        if len(attrs) == 0:
+            return []
+        vids = self.alloc_vids(obj_type, len(attrs))
+        if len(attrs) == 1:
+            self.create("SAI_OBJECT_TYPE_" + obj_type.name + ":" + vids[0], attrs[0])
+            return vids
+
+        status, entry_status = self.bulk_create(obj_type, vids, attrs, False)
+        if status != "SAI_STATUS_SUCCESS":
+            for idx, vid in enumerate(vids):
+                if idx >= len(entry_status) or entry_status[idx] != "SAI_STATUS_SUCCESS":
+                    self.create("SAI_OBJECT_TYPE_" + obj_type.name + ":" + vid, attrs[idx])
+        return vids
+
+    def remove_many(self, obj, keys):
+        '''
+        Removes multiple objects of the same type by the bulk remove.
+        The objects the bulk remove fails for are removed one by one.
+
+        Parameters:
+            obj (SaiObjType): The type of objects to be removed
+            keys (list): The list of objects to be removed in bulk_remove() format
+        '''
+        obj_type = "SAI_OBJECT_TYPE_" + obj.name if type(obj) == SaiObjType else obj
+        keys = [key if type(key) == str else json.dumps(key).replace(" ", "") for key in keys]
+        if len(keys) > 1:
+            status, entry_status = self.bulk_remove(obj_type, keys, False)
+            if status == "SAI_STATUS_SUCCESS":
+                return
+            keys = [key for idx, key in enumerate(keys)
+                    if idx >= len(entry_status) or entry_status[idx] != "SAI_STATUS_SUCCESS"]
+        for key in keys:
+            self.remove(obj_type + ":" + key)
+
     def bulk_remove(self, obj, keys, do_assert = True):
         '''
         Bulk remove objects
@@ -599,7 +915,7 @@ class Sai:
         status[2] = status[2].decode("utf-8")
 
         if do_assert:
-            print(entry_status)
+            logging.debug(entry_status)
             assert status[2] == 'SAI_STATUS_SUCCESS'
             return status[2], entry_status
 
@@ -676,7 +992,7 @@ class Sai:
         status[2] = status[2].decode("utf-8")
 
         if do_assert:
-            print(entry_status)
+            logging.debug(entry_status)
             assert status[2] == 'SAI_STATUS_SUCCESS'
             return status[2], entry_status
 
@@ -790,81 +1106,438 @@ class Sai:
             # Allocate new VID and add it to the map
             vid = self.get_vid(obj_type, key_list[1])
             self.rec2vid[key_list[1]] = vid
-        elif action == "g" or action == "s" or action == "S":
+        elif action in ["g", "s", "S", "r", "R"]:
+            # The removed OIDs are dropped from the map by __apply_records()
+            # only once the removal succeeds, so the failed replay can be resumed.
             vid = self.rec2vid[key_list[1]]
-        elif action == "r" or action == "R":
-            vid = self.rec2vid.pop(key_list[1])
 
         return key_list[0] + ":" + vid
 
-    def __update_entry_key_oids(self, key):
-        oids = []
-        new_key = key
-        key_list = key.split("\"")
-        for k in key_list:
-            if "oid:" in k:
-                oids.append(k)
-        for oid in oids:
-            new_oid = self.rec2vid[oid]
-            new_key = new_key.replace(oid, new_oid)
-        return new_key
+    def __rec_oid_to_vid(self, match):
+        oid = match.group(0)
+        if oid == "oid:0x0":
+            return oid
+        return self.rec2vid[oid]
+
+    def __update_oids(self, value):
+        '''
+        Translates all OIDs from sairedis.rec file into VIDs in a single pass.
+        Handles both scalar values ("oid:0x1") and lists ("2:oid:0x1,oid:0x2").
+        '''
+        if "oid:" not in value:
+            return value
+        return oid_pattern.sub(self.__rec_oid_to_vid, value)
+
+    def __update_attrs(self, tokens):
+        # ["attr1=value1", "attr2=value2", ...] -> ["attr1", "value1", "attr2", "value2", ...]
+        attrs = []
+        for token in tokens:
+            attrs += self.__update_oids(token).split('=', 1)
+        return attrs
 
     def __update_key(self, action, key):
         if "{" in key:
-            return self.__update_entry_key_oids(key)
+            return self.__update_oids(key)
         else:
             return self.__update_oid_key(action, key)
 
     def __parse_rec(self, fname):
         '''
-        Non-bulk entry format:
-        data|action|sai-object-type:key|attr1|attr2
-
-        Will be converted into:
-        [["action", "sai-object-type:key", "attr1", "attr2"]]
-
-        Bulk entry format:
-        data|action|sai-object-type||key1|attr1|attr2||...||key-n|attr1|attr2
-
-        Will be converted into:
-        [["action", "sai-object-type"], ["key", "attr1", "attr2"], ..., [key-n", "attr1", "attr2"]]
+        Parses sairedis.rec file. See parse_rec_line() for the records format.
         '''
         cnt = 0
         rec = {}
-        fp = open(fname, 'r')
-        for line in fp:
-            data = []
-            cnt += 1
-            bulk_tokens = line.strip().split("||")
-            for idx, token in enumerate(bulk_tokens):
-                tokens = token.strip().split("|")
-                if idx == 0:
-                    tokens = tokens[1:]
-                data.append(tokens)
-            rec[cnt] = data #if len(data) > 1 else data[0]
+        with open(fname, 'r') as fp:
+            for line in fp:
+                cnt += 1
+                rec[cnt] = parse_rec_line(line)
         return rec
 
-    def apply_rec(self, fname):
+    def __bulk_rec_key(self, rec):
+        '''
+        Returns (object type, created OID, referenced OIDs) for the records
+        that can be merged into the bulk operation or None otherwise.
+        '''
+        if rec[0] != 'c' and rec[0] != 'r':
+            return None
+        if rec[1].startswith("SAI_OBJECT_TYPE_SWITCH:"):
+            return None
+
+        obj_type, key = rec[1].split(":", 1)
+        refs = set(oid_pattern.findall("|".join(rec[2:])))
+        if key.startswith("{"):
+            refs.update(oid_pattern.findall(key))
+            key = None
+        return obj_type, key, refs
+
+    def __bulk_rec_flush(self, run, bulk_records):
+        if len(run) == 1:
+            bulk_records[run[0][0]] = [run[0][1]]
+            return 0
+
+        # record = [["action", "sai-object-type"], ["key", "attr1", "attr2"], ..., [key-n", "attr1", "attr2"]]
+        action = run[0][1][0]
+        record = [[action.upper(), run[0][1][1].split(":", 1)[0]]]
+        for _, rec in run:
+            record.append([rec[1].split(":", 1)[1]] + rec[2:])
+        bulk_records[run[0][0]] = record
+        return len(run) - 1
+
+    def __bulk_rec(self, records):
+        '''
+        Merges the runs of consecutive create ('c') or remove ('r') records
+        of the same SAI object type into the bulk ('C' or 'R') records.
+
+        The run is interrupted as soon as the record refers to the OID
+        that is created within the same run, so the order of dependent
+        objects creation is preserved.
+
+        Returns the tuple with the new records and the number of the saved
+        round trips to syncd.
+        '''
+        saved = 0
+        bulk_records = {}
+        run = []
+        run_type = None
+        run_oids = set()
+
+        for cnt, record in records.items():
+            rec = record[0]
+            bulk_key = self.__bulk_rec_key(rec) if len(record) == 1 else None
+
+            if bulk_key is not None:
+                obj_type, key, refs = bulk_key
+                if run and run_type == (rec[0], obj_type) and run_oids.isdisjoint(refs):
+                    run.append((cnt, rec))
+                else:
+                    if run:
+                        saved += self.__bulk_rec_flush(run, bulk_records)
+                    run = [(cnt, rec)]
+                    run_type = (rec[0], obj_type)
+                    run_oids = set()
+                if rec[0] == 'c' and key is not None:
+                    run_oids.add(key)
+                continue
+
+            if run:
+                saved += self.__bulk_rec_flush(run, bulk_records)
+                run = []
+            bulk_records[cnt] = record
+
+        if run:
+            saved += self.__bulk_rec_flush(run, bulk_records)
+
+        return bulk_records, saved
+
+    def __apply_rec_delta(self, state, bulk=False, profile=None):
+        '''
+        Turns the SAI objects of previously applied sairedis.rec file
+        into the SAI objects of the target one without the full cleanup.
+
+        Returns False when the target state can not be reached incrementally.
+        '''
+        plan = self.rec_state.diff(state)
+        if plan is None:
+            return False
+
+        removes, early_sets, creates, late_sets = plan
+        curr = self.rec_state
+        self.rec_state = None
+
+        # Map the target recording OIDs of the preserved objects to the existing VIDs
+        rec2vid = {}
+        for canon, obj in state.objects.items():
+            if obj["oid"] is not None and canon in curr.objects:
+                rec2vid[obj["oid"]] = curr.rec2vid[curr.objects[canon]["oid"]]
+        self.rec2vid = rec2vid
+        self.cache = {}
+
+        records = {}
+        for canon, attr in early_sets:
+            records[len(records) + 1] = [state.set_record(canon, attr)]
+        self.__apply_records(records)
+
+        for canon in removes:
+            self.remove(curr.dut_key(canon))
+
+        records = {}
+        for canon in creates:
+            records[len(records) + 1] = [state.create_record(canon)]
+        for canon, attr in late_sets:
+            records[len(records) + 1] = [state.set_record(canon, attr)]
+        if bulk:
+            records, _ = self.__bulk_rec(records)
+
+        prof = SaiRecProfile(SaiRecProfile.count(records)) if profile else None
+        try:
+            self.__apply_records(records, prof)
+        finally:
+            if prof is not None:
+                prof.save(profile)
+
+        self.rec_state = state.bind(self.rec2vid)
+        logging.info("Applied the delta: {} objects removed, {} created, {} attributes set".format(
+                     len(removes), len(creates), len(early_sets) + len(late_sets)))
+        return True
+
+    def apply_rec(self, fname, bulk=False, profile=None, delta=False, checkpoint=None):
+        '''
+        Replays sairedis.rec file
+
+        Parameters:
+            fname (str): The path to sairedis.rec file
+            bulk (bool): Merge the runs of consecutive independent create
+                    and remove records of the same object type into
+                    the bulk create/remove operations.
+            profile (str): The path to JSON file to store the replay timing
+                    profile into. When specified, the replay progress
+                    with the throughput and ETA is logged periodically.
+            delta (bool): When the previous sairedis.rec file was applied,
+                    only remove, set and create the objects that differ
+                    between the previous and the target recordings instead
+                    of the full cleanup and replay. Falls back to the full
+                    replay when the delta can not be applied.
+            checkpoint (str): The path to JSON file to store the replay state
+                    into on failure, so the replay can be resumed from
+                    the failed record with resume_rec()
+
+        Returns:
+            True when the recording was applied incrementally (see delta),
+            False when it was replayed from scratch
+        '''
+        self.rec_fname = fname
+        return self.__apply_rec_records(self.__parse_rec(fname), bulk, profile, delta, checkpoint)
+
+    def __apply_rec_records(self, records, bulk=False, profile=None, delta=False, checkpoint=None):
+        if delta and self.rec_state is not None:
+            if self.__apply_rec_delta(SaiRecState(records), bulk, profile):
+                return True
+            logging.info("Unable to apply {} incrementally, doing the full replay".format(self.rec_fname))
+
         # Since it's expected that sairedis.rec file contains a full configuration,
         # we must flush both Redis and NPU state before we start.
         self.cleanup()
 
+        state = SaiRecState(records)
+        try:
+            self.__replay(records, bulk, profile, checkpoint)
+        except Exception:
+            if not bulk:
+                # All the records preceding the failed one are applied,
+                # so the next delta replay can start from them.
+                prefix = {cnt: rec for cnt, rec in records.items() if cnt < self.rec_line}
+                self.rec_state = SaiRecState(prefix).bind(self.rec2vid)
+            raise
+        self.rec_state = state.bind(self.rec2vid)
+        logging.debug("Current SAI objects: {}".format(self.rec2vid))
+        return False
+
+    def __replay(self, records, bulk=False, profile=None, checkpoint=None):
+        total = len(records)
+        if bulk:
+            records, saved = self.__bulk_rec(records)
+            logging.info("Merged {} records into {} operations, saved {} round trips".format(
+                         total, len(records), saved))
+
+        prof = SaiRecProfile(SaiRecProfile.count(records)) if profile else None
+        try:
+            self.__apply_records(records, prof)
+        except Exception:
+            if checkpoint is not None:
+                self.save_rec_checkpoint(checkpoint)
+            raise
+        finally:
+            if prof is not None:
+                logging.info(prof.progress())
+                prof.save(profile)
+
+    def save_rec_checkpoint(self, fname):
+        '''
+        Stores the state of the failed sairedis.rec file replay into JSON file,
+        so the replay can be resumed from the failed record with resume_rec().
+        '''
+        data = {
+            "rec": self.rec_fname,
+            "line": self.rec_line,
+            "rec2vid": self.rec2vid,
+            "cache": self.cache
+        }
+        with open(fname, "w") as f:
+            json.dump(data, f)
+
+    def resume_rec(self, checkpoint, bulk=False, profile=None):
+        '''
+        Resumes sairedis.rec file replay from the checkpoint stored by save_rec_checkpoint()
+        without the cleanup of the current SAI objects.
+        '''
+        with open(checkpoint, "r") as f:
+            data = json.load(f)
+
+        index = SaiRecIndex(data["rec"])
+        line = data["line"]
+        # The OIDs retrieved by 'g' record are not preserved, so it must be replayed again
+        if line > 1 and index.record(line)[0][0] == 'G':
+            line -= 1
+
+        self.rec_fname = data["rec"]
+        self.rec2vid = data["rec2vid"]
+        self.cache = data["cache"]
+        self.rec_state = None
+
+        self.__replay(index.records(line), bulk, profile)
+        self.rec_state = SaiRecState(index.records()).bind(self.rec2vid)
+
+    def __rec_fails_at(self, records, line):
+        '''
+        Replays the records and checks whether the replay fails at the given line
+        '''
+        tail = [line - 1, line] if records[line][0][0] == 'G' else [line]
+        prefix = {cnt: rec for cnt, rec in records.items() if cnt not in tail}
+        try:
+            self.__apply_rec_records(prefix, delta=True)
+        except Exception as e:
+            logging.debug("Failed before #{}: {}".format(line, repr(e)))
+            return False
+
+        try:
+            self.__apply_records({cnt: records[cnt] for cnt in tail})
+        except Exception as e:
+            logging.debug("Failed at #{}: {}".format(line, repr(e)))
+            return True
+
+        self.rec_state = SaiRecState(records).bind(self.rec2vid)
+        return False
+
+    def minimize_rec(self, fname, output, stats=None):
+        '''
+        Reduces the failing sairedis.rec file to the minimal recording
+        that still fails at the same record.
+
+        The candidate recordings are replayed incrementally on top of
+        the previously replayed one (see apply_rec() delta parameter).
+
+        Parameters:
+            fname (str): The path to the failing sairedis.rec file
+            output (str): The path to store the minimal sairedis.rec file to
+            stats (str): The path to JSON file to store the timing stats
+                    of every minimization round into
+
+        Returns:
+            The line numbers of the original recording the minimal one
+            consists of or None when the recording does not fail.
+        '''
+        index = SaiRecIndex(fname)
+        try:
+            self.apply_rec(fname)
+            logging.info("{} is replayed successfully, nothing to minimize".format(fname))
+            return None
+        except Exception as e:
+            line = self.rec_line
+            logging.info("Minimizing {} failing at #{}: {}".format(fname, line, repr(e)))
+
+        minimizer = SaiRecMinimizer(index.records(1, line + 1),
+                                    lambda records: self.__rec_fails_at(records, line))
+        lines = minimizer.run()
+
+        with open(output, "w") as f:
+            for cnt in lines:
+                f.write(index.line(cnt) + "\n")
+        if stats is not None:
+            with open(stats, "w") as f:
+                json.dump(minimizer.stats, f, indent=4)
+
+        logging.info("Minimized {} records to {} in {} rounds".format(
+                     line, len(lines), len(minimizer.stats)))
+        return lines
+
+    def __rec_prefix_fails(self, index, stop):
+        '''
+        Replays the records [1, stop] from scratch in the bulk mode.
+        Returns the error description on failure, otherwise None.
+        '''
+        self.cleanup()
+        self.rec_fname = index.fname
+        try:
+            self.__replay(index.records(1, stop + 1), bulk=True)
+        except Exception as e:
+            logging.debug("Failed with #{} included: {}".format(stop, repr(e)))
+            return repr(e)
+        return None
+
+    def bisect_rec(self, fname, checkpoint=None):
+        '''
+        Finds the first failing record of sairedis.rec file.
+
+        The recording is replayed in the bulk mode first. On failure, the records
+        merged into the failed bulk operation are bisected: the shortest prefix of
+        the recording that still fails in the bulk mode is searched for, taking
+        log2(N) replays for N records merged. Finally, the known good prefix is
+        replayed in the bulk mode again, and the failing record is replayed alone
+        to confirm it fails outside of the bulk operation as well.
+
+        Parameters:
+            fname (str): The path to sairedis.rec file
+            checkpoint (str): The path to JSON file to store the replay state
+                    right before the failing record to, so the replay can be
+                    resumed with resume_rec()
+
+        Returns:
+            None when the recording is replayed successfully. Otherwise,
+            the tuple with the failing record line number, the record itself
+            and the error description.
+        '''
+        index = SaiRecIndex(fname)
+        try:
+            self.apply_rec(fname, bulk=True)
+            return None
+        except Exception as e:
+            line = self.rec_line
+            error = repr(e)
+        logging.info("Replay failed at #{} in the bulk mode: {}".format(line, error))
+
+        # The failed operation spans the records up to the next operation.
+        # The records [1, lo) are known to pass, the records [1, hi] to fail.
+        ops = sorted(self.__bulk_rec(index.records())[0])
+        pos = ops.index(line)
+        lo = line
+        hi = ops[pos + 1] - 1 if pos + 1 < len(ops) else len(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_error = self.__rec_prefix_fails(index, mid)
+            if mid_error is None:
+                lo = mid + 1
+            else:
+                hi = mid
+                error = mid_error
+        failed = lo
+        logging.info("Bisected the failure to #{}".format(failed))
+
+        # The OIDs retrieved by 'g' record are required by 'G' one,
+        # so the preceding 'g' record is replayed along with it.
+        line = failed
+        if line > 1 and index.record(line)[0][0] == 'G':
+            line -= 1
+
+        self.cleanup()
+        self.rec_fname = fname
+        self.__replay(index.records(1, line), bulk=True)
+        try:
+            self.__replay(index.records(line, failed + 1), checkpoint=checkpoint)
+        except Exception as e:
+            return self.rec_line, index.line(self.rec_line), repr(e)
+
+        logging.warning("The record #{} fails in the bulk mode only".format(failed))
+        return failed, index.line(failed), error
+
+    def __apply_records(self, records, prof=None):
         oids = []
-        records = self.__parse_rec(fname)
         for cnt, record in records.items():
-            print("#{}: {}".format(cnt, record))
+            logging.debug("#{}: {}".format(cnt, record))
+            self.rec_line = cnt
+            start = time.monotonic()
             rec = record[0]
             if rec[0] == 'c':
-                attrs = []
-                if len(rec) > 2:
-                    for attr in rec[2:]:
-                        attrs += attr.split('=')
-
-                # Update OIDs in the attributes
-                for idx in range(1, len(attrs), 2):
-                    if "oid:" in attrs[idx]:
-                        attrs[idx] = self.rec2vid[attrs[idx]]
-
+                attrs = self.__update_attrs(rec[2:])
                 self.create(self.__update_key(rec[0], rec[1]), attrs)
 
             elif rec[0] == 'C':
@@ -873,14 +1546,7 @@ class Sai:
                 bulk_attrs = []
                 for idx, entry in enumerate(record[1:]):
                     # New bulk entry
-                    attrs = []
-                    for attr in entry[1:]:
-                        attrs += attr.split('=')
-
-                    # Update OIDs in the attributes
-                    for i in range(1, len(attrs), 2):
-                        if "oid:" in attrs[i] and attrs[i] != "oid:0x0":
-                            attrs[i] = self.rec2vid[attrs[i]]
+                    attrs = self.__update_attrs(entry[1:])
 
                     # Convert into "sai-object-type:key"
                     key = record[0][1] + ":" + record[idx + 1][0]
@@ -897,10 +1563,7 @@ class Sai:
                 self.bulk_create(record[0][1], bulk_keys, bulk_attrs)
 
             elif rec[0] == 's':
-                data = rec[2].split('=')
-                if "oid:" in data[1]:
-                    data[1] = self.rec2vid[data[1]]
-
+                data = self.__update_attrs(rec[2:3])
                 self.set(self.__update_key(rec[0], rec[1]), data)
 
             elif rec[0] == 'S':
@@ -908,9 +1571,7 @@ class Sai:
                 bulk_keys = []
                 bulk_attrs = []
                 for idx, entry in enumerate(record[1:]):
-                    attr = entry[1].split('=')
-                    if "oid:" in attr[1] and attrs[i] != "oid:0x0":
-                        attr[1] = self.rec2vid[attr[1]]
+                    attr = self.__update_attrs(entry[1:2])
 
                     # Convert into "sai-object-type:key"
                     key = record[0][1] + ":" + record[idx + 1][0]
@@ -928,6 +1589,8 @@ class Sai:
 
             elif rec[0] == 'r':
                 self.remove(self.__update_key(rec[0], rec[1]))
+                if "{" not in rec[1]:
+                    del self.rec2vid[rec[1].split(":", 1)[1]]
 
             elif rec[0] == 'R':
                 # record = [["action", "sai-object-type"], ["key"], ..., [key-n"]]
@@ -945,6 +1608,9 @@ class Sai:
                     bulk_keys.append(key)
 
                 self.bulk_remove(record[0][1], bulk_keys)
+                for entry in record[1:]:
+                    if not entry[0].startswith("{"):
+                        del self.rec2vid[entry[0]]
 
             elif rec[0] == 'g':
                 attrs = []
@@ -981,9 +1647,10 @@ class Sai:
                     self.rec2vid[oid] = oids[idx]
                 oids = []
             else:
-                print("Iggnored line {}: {}".format(cnt, rec))
+                logging.warning("Ignored line {}: {}".format(cnt, rec))
 
-        print("Current SAI objects: {}".format(self.rec2vid))
+            if prof is not None:
+                prof.add(cnt, record, time.monotonic() - start)
 
     def assert_status_success(self, status, skip_not_supported=True, skip_not_implemented=True):
         if skip_not_supported:
@@ -1,21 +1,464 @@
 import ptf
 import ptf.dataplane
+import ptf.ptfutils
 from ptf import config
+from ptf.pcap_writer import PcapWriter
+import ctypes
 import os
+import queue
+import socket
+import struct
+import threading
 import unittest
 import copy
+import itertools
+import logging
+import time
+from sai_traffic import SaiTrafficGenerator
+
+
+class SaiPcapWriter:
+    '''
+    Writes the captured packets into pcap file in the background thread.
+
+    It is a drop-in replacement of PTF PcapWriter for DataPlane.pcap_writer.
+    The packets are passed to the writer thread through the bounded queue,
+    so the dataplane RX/TX path never blocks on the disk. When the queue is full,
+    the new packets are dropped and counted. The file can be rotated by size or time:
+    <name>.pcap, <name>.1.pcap, <name>.2.pcap, etc.
+
+    When writing fails (e.g., the disk is full), the error is logged and stored
+    in the error attribute, and the rest of the packets are dropped.
+    '''
+
+    # The time in seconds to wait for the queued packets to be written on close()
+    close_timeout = 10
+
+    def __init__(self, filename, queue_size=10000, max_bytes=None, max_seconds=None, max_files=None):
+        '''
+        Parameters:
+            filename (str): The pcap file name
+            queue_size (int): The maximum number of packets waiting to be written
+            max_bytes (int): Rotate the file when it exceeds this size
+            max_seconds (float): Rotate the file when it is open for this time
+            max_files (int): The number of the files to keep. The oldest files are removed.
+        '''
+        self.base, self.ext = os.path.splitext(filename)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.max_files = max_files
+        # The pcap files being kept, the last one is being written
+        self.files = []
+        self.rotations = 0
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.__open()
+        self.thread = threading.Thread(target=self.__run, name="SaiPcapWriter", daemon=True)
+        self.thread.start()
+
+    def __open(self):
+        if self.rotations == 0:
+            filename = self.base + self.ext
+        else:
+            filename = "{}.{}{}".format(self.base, self.rotations, self.ext)
+        self.writer = PcapWriter(filename)
+        self.opened = time.monotonic()
+        self.files.append(filename)
+        if self.max_files is not None and len(self.files) > self.max_files:
+            os.remove(self.files.pop(0))
+
+    def __maybe_rotate(self):
+        # NOTE: The time based rotation happens on the first packet after the time is expired
+        if (self.max_bytes is not None and self.writer.stream.tell() >= self.max_bytes) or \
+           (self.max_seconds is not None and time.monotonic() - self.opened >= self.max_seconds):
+            self.writer.close()
+            self.rotations += 1
+            self.__open()
+
+    def write(self, data, timestamp=None, device=None, port=None):
+        if self.error is not None:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait((data, time.time() if timestamp is None else timestamp, device, port))
+        except queue.Full:
+            self.dropped += 1
+
+    def __run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                while item is not None:
+                    self.writer.write(*item)
+                    self.written += 1
+                    self.__maybe_rotate()
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if item is None:
+                    break
+                self.writer.flush()
+        except Exception as e:
+            self.error = e
+            logging.error("Capturing packets into {} failed: {}".format(self.files[-1], repr(e)))
+        finally:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+
+    def close(self):
+        '''
+        Writes the queued packets and closes the file
+        '''
+        if self.thread is None:
+            return
+        # Do not wait for the room in the queue once the writer thread failed
+        deadline = time.monotonic() + self.close_timeout
+        while self.thread.is_alive() and time.monotonic() < deadline:
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join(max(0, deadline - time.monotonic()))
+        if self.thread.is_alive():
+            logging.warning("The packets capture into {} is stuck".format(self.files[-1]))
+        self.thread = None
+        if self.error is not None:
+            # The packets left in the queue by the failed writer are not captured
+            self.dropped += self.queue.qsize()
+        if self.dropped > 0:
+            reason = "the writer failed" if self.error is not None else "the writer queue was full"
+            logging.warning("{} packets were not captured into {} since {}".format(
+                            self.dropped, self.files[-1], reason))
+
+
+class SaiRxFilter:
+    '''
+    Drops the unwanted packets before they are queued by PTF dataplane.
+
+    The filter is the list of rules. Each rule is the list of (offset, bytes)
+    tuples that must all match for the packet to be dropped. The filter is compiled
+    into the classic BPF program and attached to the port's AF_PACKET socket,
+    so the kernel drops the packets. For other ports (e.g., nanomsg), the packets
+    are dropped after they are received by comparing their byte prefixes.
+
+    NOTE: The kernel filter sees the packets with VLAN tag stripped
+    if the tag is offloaded by the interface.
+    '''
+
+    # The packets sent by the kernel to the test interfaces
+    NOISE = [
+        # LLDP
+        [(12, b"\x88\xcc")],
+        # IPv6 ND, RS and other ICMPv6 sent to the multicast MAC
+        [(0, b"\x33\x33"), (12, b"\x86\xdd"), (20, b"\x3a")],
+        # IPv6 MLD with the hop-by-hop options header
+        [(0, b"\x33\x33"), (12, b"\x86\xdd"), (20, b"\x00")],
+    ]
+
+    SO_ATTACH_FILTER = 26
+    SO_DETACH_FILTER = 27
+
+    def __init__(self, rules):
+        if rules == "noise":
+            rules = self.NOISE
+        self.rules = [[(offset, bytes(value)) for offset, value in rule] for rule in rules]
+
+    def match(self, pkt):
+        '''
+        Returns True if the packet must be dropped
+        '''
+        for rule in self.rules:
+            for offset, value in rule:
+                if pkt[offset:offset + len(value)] != value:
+                    break
+            else:
+                return True
+        return False
+
+    def bpf(self):
+        '''
+        Returns the list of (code, jt, jf, k) classic BPF instructions
+        '''
+        insns = []
+        for rule in self.rules:
+            # Split the values into 4, 2 and 1 byte loads
+            loads = []
+            for offset, value in rule:
+                while len(value) > 0:
+                    size = 4 if len(value) >= 4 else 2 if len(value) >= 2 else 1
+                    loads.append((offset, size, int.from_bytes(value[:size], "big")))
+                    offset += size
+                    value = value[size:]
+            length = max([offset + size for offset, size, _ in loads], default=0)
+            rule_len = 2 + 2 * len(loads) + 1
+
+            # Skip the rule if the packet is too short not to abort the program
+            insns.append((0x80, 0, 0, 0))                        # ld len
+            insns.append((0x35, 0, rule_len - 2, length))        # jge #length
+            for i, (offset, size, k) in enumerate(loads):
+                code = {4: 0x20, 2: 0x28, 1: 0x30}[size]
+                insns.append((code, 0, 0, offset))               # ld/ldh/ldb [offset]
+                insns.append((0x15, 0, rule_len - 2 * i - 4, k)) # jeq #k, next rule
+            insns.append((0x06, 0, 0, 0))                        # ret #0 (drop)
+        insns.append((0x06, 0, 0, 0x40000))                      # ret #0x40000 (accept)
+        return insns
+
+    def attach(self, port):
+        '''
+        Attaches the filter to PTF dataplane port
+        '''
+        self.detach(port)
+        sock = getattr(port, "socket", None)
+        if sock is not None and sock.family == getattr(socket, "AF_PACKET", None):
+            insns = self.bpf()
+            prog = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *insn) for insn in insns))
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, self.SO_ATTACH_FILTER,
+                                struct.pack("HL", len(insns), ctypes.addressof(prog)))
+                # The kernel copies the program, but keep it for the reference
+                port.sai_rx_filter = (self, prog)
+                return
+            except OSError as e:
+                logging.warning("Failed to attach BPF filter to {}: {}".format(port.interface_name, e))
+
+        source = port.get_packet_source()
+        if not hasattr(source, "sai_rx_filters"):
+            source.sai_rx_filters = {}
+            recv = source.recv
+
+            def filtered_recv():
+                pkt = recv()
+                if pkt is not None:
+                    rx_filter = source.sai_rx_filters.get((pkt[0], pkt[1]))
+                    if rx_filter is not None and rx_filter.match(pkt[2]):
+                        return None
+                return pkt
+            source.recv = filtered_recv
+        source.sai_rx_filters[(port._device_number, port._port_number)] = self
+
+    @staticmethod
+    def detach(port):
+        '''
+        Detaches the filter, if any, from PTF dataplane port
+        '''
+        if getattr(port, "sai_rx_filter", None) is not None:
+            port.socket.setsockopt(socket.SOL_SOCKET, SaiRxFilter.SO_DETACH_FILTER, 0)
+            port.sai_rx_filter = None
+        source = port.get_packet_source()
+        if hasattr(source, "sai_rx_filters"):
+            source.sai_rx_filters.pop((port._device_number, port._port_number), None)
+
+
+class SaiFlowVerifier:
+    '''
+    Verifies that many expected packets are received in a single pass.
+
+    The expected packets are indexed by the hash of their masked bytes,
+    so each received packet is matched in O(1) regardless of the number of flows.
+    All the dataplane queues are drained at once, and the packets are matched
+    outside of the dataplane lock.
+
+    Usage example:
+        verifier = dataplane.flow_verifier()
+        for pkt, exp_pkt in flows:
+            verifier.expect(exp_pkt, [1, 2, 3, 4])    # e.g., any of ECMP members
+        dataplane.send_burst(0, [pkt for pkt, _ in flows])
+        result = verifier.verify()
+    '''
+
+    # The minimal Ethernet frame size without FCS
+    min_frame_size = 60
+
+    def __init__(self, dataplane):
+        self.dataplane = dataplane
+        # (mask, size, ignore extra bytes) to {masked value: [flow indices]}
+        self.index = {}
+        # [remaining count, (device, port) tuples] per expected flow
+        self.flows = []
+        self.expected = 0
+        self.qlen = dataplane.dataplane.qlen
+
+    @staticmethod
+    def __port_id(port_id):
+        return (0, int(port_id)) if type(port_id) != tuple else port_id
+
+    def expect(self, pkt, ports, count=1):
+        '''
+        Adds the expected packet
+
+        Parameters:
+            pkt (Packet or Mask): The expected packet or PTF Mask
+            ports (list): The ports the packet may be received on. Either port number on
+                    device 0 or (device, port) tuple. Any of the ports matches.
+            count (int): The number of the packet copies expected
+        '''
+        if hasattr(pkt, "exp_pkt") and hasattr(pkt, "mask"):
+            data = bytes(pkt.exp_pkt)[:pkt.size]
+            mask = int.from_bytes(bytes(pkt.mask[:pkt.size]), "big")
+            group = (mask, pkt.size, pkt.ignore_extra_bytes)
+        else:
+            data = bytes(pkt)
+            mask = (1 << (8 * len(data))) - 1
+            # The packet shorter than the minimal Ethernet frame is received padded,
+            # so only its own bytes are compared as ptf.dataplane.match_exp_pkt() does
+            group = (mask, len(data), len(data) < self.min_frame_size)
+
+        value = int.from_bytes(data, "big") & mask
+        self.index.setdefault(group, {}).setdefault(value, []).append(len(self.flows))
+        self.flows.append([count, {self.__port_id(port_id) for port_id in ports}])
+        self.expected += count
+
+        # Do not let the dataplane drop the expected packets before they are verified
+        if self.dataplane.dataplane.qlen < self.expected:
+            self.dataplane.dataplane.set_qlen(self.expected)
+
+    def __match(self, port_id, pkt):
+        for (mask, size, ignore_extra_bytes), values in self.index.items():
+            if len(pkt) < size or (len(pkt) != size and not ignore_extra_bytes):
+                continue
+            flows = values.get(int.from_bytes(pkt[:size], "big") & mask)
+            if flows is None:
+                continue
+            for i, idx in enumerate(flows):
+                flow = self.flows[idx]
+                if port_id in flow[1]:
+                    flow[0] -= 1
+                    if flow[0] == 0:
+                        del flows[i]
+                    return True
+        return False
+
+    def verify(self, timeout=None, do_assert=True):
+        '''
+        Consumes the received packets until all the expected packets are received
+        or the timeout expires. Then, waits for the negative timeout for unexpected packets.
+
+        Parameters:
+            timeout (float): The time to wait for the expected packets in seconds.
+                    PTF default timeout by default.
+            do_assert (bool): Assert that there are no missing and unexpected packets.
+
+        Returns:
+            The dictionary with "matched", "missing" and "unexpected" packet
+            counts per (device, port). The missing packets of the flows
+            expected on multiple ports are counted per tuple of the ports.
+        '''
+        dp = self.dataplane.dataplane
+        if timeout is None:
+            timeout = ptf.ptfutils.default_timeout
+        deadline = time.monotonic() + timeout
+        remaining = sum(flow[0] for flow in self.flows)
+        matched = {}
+        unexpected = {}
+
+        try:
+            while True:
+                now = time.monotonic()
+                if remaining == 0 and deadline > now + ptf.ptfutils.default_negative_timeout:
+                    deadline = now + ptf.ptfutils.default_negative_timeout
+                if now >= deadline:
+                    break
+
+                received = []
+                with dp.cvar:
+                    for port_id, pkts in dp.packet_queues.items():
+                        if len(pkts) > 0:
+                            received.append((port_id, pkts[:]))
+                            del pkts[:]
+                    if len(received) == 0:
+                        dp.cvar.wait(deadline - now)
+                        continue
+
+                for port_id, pkts in received:
+                    for pkt, _ in pkts:
+                        self.dataplane.at_receive(pkt, device_number=port_id[0], port_number=port_id[1])
+                        if self.__match(port_id, pkt):
+                            matched[port_id] = matched.get(port_id, 0) + 1
+                            remaining -= 1
+                        else:
+                            unexpected[port_id] = unexpected.get(port_id, 0) + 1
+        finally:
+            dp.set_qlen(self.qlen)
+
+        missing = {}
+        for count, ports in self.flows:
+            if count > 0:
+                key = next(iter(ports)) if len(ports) == 1 else tuple(sorted(ports))
+                missing[key] = missing.get(key, 0) + count
+
+        result = {"matched": matched, "missing": missing, "unexpected": unexpected}
+        if do_assert:
+            assert len(missing) == 0 and len(unexpected) == 0, \
+                "Flows verification failed: {} missing, {} unexpected packets".format(missing, unexpected)
+        return result
 
 
 class SaiDataPlane(unittest.TestCase):
-    def __init__(self, dataplane=None):
+    def __init__(self, dataplane=None, capture=True, rx_filter=False):
         self.dataplane = dataplane
+        # Whether to capture the test's packets into pcap file
+        self.capture = capture
+        self.paused_pcap_writer = None
+        # The test specific RX filter rules, None to disable the filtering,
+        # or False to use the default "rx_filter" PTF config option
+        self.rx_filter = rx_filter
+
+    @staticmethod
+    def set_rx_filter(dataplane, rules, ports=None):
+        '''
+        Sets the early RX filter of PTF dataplane ports
+
+        Parameters:
+            dataplane (DataPlane): PTF dataplane
+            rules (list): SaiRxFilter rules, "noise" to drop the packets
+                    sent by the kernel, or None to disable the filtering
+            ports (list): The list of (device, port) to set the filter for.
+                    By default, the filter is set for all the ports.
+        '''
+        rx_filter = SaiRxFilter(rules) if rules is not None else None
+        with dataplane.cvar:
+            for port_id, port in dataplane.ports.items():
+                if ports is not None and port_id not in ports:
+                    continue
+                if rx_filter is None:
+                    SaiRxFilter.detach(port)
+                else:
+                    rx_filter.attach(port)
+
+    @staticmethod
+    def start_pcap(dataplane, filename):
+        '''
+        Starts the packets capture of PTF dataplane with SaiPcapWriter
+        configured by "pcap_*" PTF config options
+        '''
+        writer = SaiPcapWriter(filename,
+                               queue_size=config.get("pcap_queue_size", 10000),
+                               max_bytes=config.get("pcap_max_bytes"),
+                               max_seconds=config.get("pcap_max_seconds"),
+                               max_files=config.get("pcap_max_files"))
+        with dataplane.cvar:
+            assert dataplane.pcap_writer is None
+            dataplane.pcap_writer = writer
 
     def setUp(self):
         assert self.dataplane is not None
+        if self.rx_filter is not False:
+            self.set_rx_filter(self.dataplane, self.rx_filter)
         self.dataplane.flush()
-        if config["log_dir"] != None:
+        if not self.capture:
+            # Pause the session wide capture, if any
+            with self.dataplane.cvar:
+                self.paused_pcap_writer = self.dataplane.pcap_writer
+                self.dataplane.pcap_writer = None
+        elif config["log_dir"] != None:
             filename = os.path.join(config["log_dir"], str(self)) + ".pcap"
-            self.dataplane.start_pcap(filename)
+            self.start_pcap(self.dataplane, filename)
 
     def before_send(self, pkt, device_number=0, port_number=-1):
         pass
@@ -25,9 +468,96 @@ class SaiDataPlane(unittest.TestCase):
 
     def tearDown(self):
         assert self.dataplane is not None
-        if config["log_dir"] != None:
+        if self.rx_filter is not False:
+            self.set_rx_filter(self.dataplane, config.get("rx_filter"))
+        if not self.capture:
+            with self.dataplane.cvar:
+                self.dataplane.pcap_writer = self.paused_pcap_writer
+            self.paused_pcap_writer = None
+        elif config["log_dir"] != None:
             self.dataplane.stop_pcap()
 
+    def port_sender(self, port_id):
+        '''
+        Returns the (device, port, send) tuple, where send() sends
+        the serialized packet to the port bypassing PTF dataplane
+        '''
+        device, port = (0, int(port_id)) if type(port_id) != tuple else port_id
+        dp_port = self.dataplane.ports[(device, port)]
+        # Send to the raw socket directly when the port has it (e.g., Linux port)
+        sock = getattr(dp_port, "socket", None)
+        return device, port, sock.send if sock is not None else dp_port.send
+
+    def traffic_generator(self):
+        '''
+        Returns the new traffic generator sending to this dataplane
+        '''
+        return SaiTrafficGenerator(self)
+
+    def flow_verifier(self):
+        '''
+        Returns the new verifier of the packets received from this dataplane
+        '''
+        return SaiFlowVerifier(self)
+
+    def send_burst(self, port_id, pkts, count=None, capture=False):
+        '''
+        Sends the burst of packets to the port as fast as possible
+
+        The packets are serialized once and sent directly through the port's socket
+        bypassing the per-packet processing of ptf.testutils.send_packet().
+
+        Parameters:
+            port_id (int or tuple): The port number on device 0 or (device, port) tuple
+            pkts (Packet or list): The packet or the list of packet variants.
+                    The variants are sent in round-robin order.
+            count (int): The number of packets to send. By default,
+                    each packet variant is sent once.
+            capture (bool): Write the packets into the dataplane pcap file.
+                    Disabled by default since it limits the send rate.
+
+        Returns:
+            The achieved packets per second rate. The failed sends
+            are not counted.
+        '''
+        device, port, send = self.port_sender(port_id)
+        if type(pkts) not in (list, tuple):
+            pkts = [pkts]
+        assert len(pkts) > 0
+        if count is None:
+            count = len(pkts)
+
+        bufs = []
+        for pkt in pkts:
+            buf = bytes(pkt)
+            self.before_send(buf, device_number=device, port_number=port)
+            bufs.append(buf)
+
+        writer = self.dataplane.pcap_writer if capture else None
+        sent = 0
+        errors = 0
+        start = time.perf_counter()
+        for buf in itertools.islice(itertools.cycle(bufs), count):
+            if writer:
+                with self.dataplane.cvar:
+                    writer.write(buf, time.time(), device, port)
+            try:
+                # The short write is the failure to send the packet as well
+                if send(buf) == len(buf):
+                    sent += 1
+                else:
+                    errors += 1
+            except OSError:
+                errors += 1
+        elapsed = time.perf_counter() - start
+
+        self.dataplane.tx_counters[(device, port)] += sent
+        pps = sent / elapsed if elapsed > 0 else float(sent)
+        logging.info("Sent {} packets to device {}, port {} at {:.0f} pps".format(sent, device, port, pps))
+        if errors:
+            logging.warning("Failed to send {} of {} packets to device {}, port {}".format(errors, count, device, port))
+        return pps
+
     @staticmethod
     def getPortMap():
         return config["port_map"]
@@ -50,7 +580,7 @@ class SaiHostifDataPlane(SaiDataPlane):
         self.dataplane = ptf.dataplane.DataPlane(_config)
         if _config["log_dir"] == None:
             filename = os.path.splitext(_config["log_file"])[0] + '.pcap'
-            self.dataplane.start_pcap(filename)
+            self.start_pcap(self.dataplane, filename)
 
         # Add ports to PTF dataplane
         for inum, iname in self.ifaces.items():
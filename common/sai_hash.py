@@ -0,0 +1,300 @@
+from contextlib import ExitStack
+from contextlib import contextmanager
+import json
+import logging
+import time
+from ptf.mask import Mask
+import ptf.packet as scapy
+from sai import SaiObjType
+from sai_traffic import SaiTrafficStream
+
+
+class SaiHashBenchmark:
+    '''
+    Measures how the traffic is distributed across LAG or ECMP group members.
+
+    The flows are generated by sweeping the packet template fields, sent from the
+    ingress port and counted per member port. The distribution is scored by:
+        jain  - Jain's fairness index, 1.0 for the ideal uniform distribution
+                and 1/N when all the flows hash to a single member
+        cv    - the coefficient of variation of the per-member counts
+        chi2  - Pearson's chi-squared statistic against the uniform distribution
+        max_deviation - the maximum relative deviation of a member from the fair share
+
+    The scores require numpy, which is installed with the "hash" extra
+    of the core library.
+
+    Usage example:
+        bench = SaiHashBenchmark(npu, dataplane, ingress=0, members=[1, 2, 3, 4])
+        with bench.lag():
+            result = bench.run(pkt, {"IP.src": 64, "TCP.sport": 16})
+        bench.save("lag_hash.json")
+    '''
+
+    def __init__(self, npu, dataplane, ingress, members, build=None):
+        '''
+        Parameters:
+            npu (SaiNpu): The NPU under test
+            dataplane (SaiDataPlane): The dataplane to send and receive the flows
+            ingress (int): The index of the port to send the flows to
+            members (list): The indexes of the member ports
+            build (str): The SAI build identifier to store in the artifact
+        '''
+        assert ingress not in members and len(members) > 1
+        self.npu = npu
+        self.dataplane = dataplane
+        self.ingress = ingress
+        self.members = list(members)
+        self.build = build
+        self.kind = None
+        self.dst_mac = None
+        self.results = []
+
+    def __remove_bridge_ports(self, idxs, undo):
+        '''
+        Removes the .1Q bridge ports of the ports together with their default VLAN members.
+        The undo step of every removal is registered as soon as it succeeds,
+        so the ports removed before the failure are restored one by one.
+        '''
+        npu = self.npu
+        for idx in idxs:
+            npu.remove_vlan_member(npu.default_vlan_oid, npu.dot1q_bp_oids[idx])
+            undo.callback(self.__restore_vlan_member, idx)
+            npu.remove(npu.dot1q_bp_oids[idx])
+            undo.callback(self.__restore_bridge_port, idx)
+
+    def __restore_bridge_port(self, idx):
+        bp_oid = self.npu.create(SaiObjType.BRIDGE_PORT,
+                                 [
+                                     "SAI_BRIDGE_PORT_ATTR_TYPE", "SAI_BRIDGE_PORT_TYPE_PORT",
+                                     "SAI_BRIDGE_PORT_ATTR_PORT_ID", self.npu.port_oids[idx],
+                                     "SAI_BRIDGE_PORT_ATTR_ADMIN_STATE", "true"
+                                 ])
+        self.npu.dot1q_bp_oids[idx] = bp_oid
+        self.npu.ports.set_bp_oid(idx, bp_oid)
+
+    def __restore_vlan_member(self, idx):
+        self.npu.create_vlan_member(self.npu.default_vlan_oid, self.npu.dot1q_bp_oids[idx],
+                                    "SAI_VLAN_TAGGING_MODE_UNTAGGED")
+        self.npu.set(self.npu.port_oids[idx], ["SAI_PORT_ATTR_PORT_VLAN_ID", self.npu.default_vlan_id])
+
+    @contextmanager
+    def lag(self, dst_mac="00:33:33:33:33:33"):
+        '''
+        Configures the LAG of the member ports in the default VLAN
+        with the static FDB entry of the destination MAC pointing to the LAG.
+        The configuration is removed on exit from the context.
+        '''
+        with ExitStack() as undo:
+            self.__lag_setup(dst_mac, undo)
+            try:
+                yield self
+            finally:
+                self.kind = None
+
+    @contextmanager
+    def ecmp(self, dst_prefix="10.10.0.0/16"):
+        '''
+        Configures the route to the ECMP group with the next hop per member port.
+        The configuration is removed on exit from the context.
+        '''
+        with ExitStack() as undo:
+            self.__ecmp_setup(dst_prefix, undo)
+            try:
+                yield self
+            finally:
+                self.kind = None
+
+    def __lag_setup(self, dst_mac, undo):
+        # Every created object registers its removal right away,
+        # so the partial configuration is unwound on failure.
+        npu = self.npu
+        self.__remove_bridge_ports(self.members, undo)
+
+        lag_oid = npu.create(SaiObjType.LAG, [])
+        undo.callback(npu.remove, lag_oid)
+        for idx in self.members:
+            lag_mbr_oid = npu.create(SaiObjType.LAG_MEMBER,
+                                     [
+                                         "SAI_LAG_MEMBER_ATTR_LAG_ID", lag_oid,
+                                         "SAI_LAG_MEMBER_ATTR_PORT_ID", npu.port_oids[idx]
+                                     ])
+            undo.callback(npu.remove, lag_mbr_oid)
+        lag_bp_oid = npu.create(SaiObjType.BRIDGE_PORT,
+                                [
+                                    "SAI_BRIDGE_PORT_ATTR_TYPE", "SAI_BRIDGE_PORT_TYPE_PORT",
+                                    "SAI_BRIDGE_PORT_ATTR_PORT_ID", lag_oid,
+                                    "SAI_BRIDGE_PORT_ATTR_ADMIN_STATE", "true"
+                                ])
+        undo.callback(npu.remove, lag_bp_oid)
+        vlan_mbr_oid = npu.create_vlan_member(npu.default_vlan_oid, lag_bp_oid, "SAI_VLAN_TAGGING_MODE_UNTAGGED")
+        undo.callback(npu.remove, vlan_mbr_oid)
+        npu.set(lag_oid, ["SAI_LAG_ATTR_PORT_VLAN_ID", npu.default_vlan_id])
+        npu.create_fdb(npu.default_vlan_oid, dst_mac, lag_bp_oid)
+        undo.callback(npu.remove_fdb, npu.default_vlan_oid, dst_mac)
+
+        self.kind = "lag"
+        self.dst_mac = dst_mac
+
+    def __ecmp_setup(self, dst_prefix, undo):
+        npu = self.npu
+        ports = [self.ingress] + self.members
+        self.__remove_bridge_ports(ports, undo)
+
+        rif_oids = []
+        for idx in ports:
+            rif_oid = npu.create(SaiObjType.ROUTER_INTERFACE,
+                                 [
+                                     "SAI_ROUTER_INTERFACE_ATTR_TYPE", "SAI_ROUTER_INTERFACE_TYPE_PORT",
+                                     "SAI_ROUTER_INTERFACE_ATTR_PORT_ID", npu.port_oids[idx],
+                                     "SAI_ROUTER_INTERFACE_ATTR_VIRTUAL_ROUTER_ID", npu.default_vrf_oid
+                                 ])
+            undo.callback(npu.remove, rif_oid)
+            rif_oids.append(rif_oid)
+
+        nhg_oid = npu.create(SaiObjType.NEXT_HOP_GROUP,
+                             ["SAI_NEXT_HOP_GROUP_ATTR_TYPE", "SAI_NEXT_HOP_GROUP_TYPE_ECMP"])
+        undo.callback(npu.remove, nhg_oid)
+        for i, rif_oid in enumerate(rif_oids[1:]):
+            ip = "192.168.{}.1".format(i)
+            nbr_key = 'SAI_OBJECT_TYPE_NEIGHBOR_ENTRY:' + json.dumps(
+                          {
+                              "ip_address": ip,
+                              "rif_id":     rif_oid,
+                              "switch_id":  npu.oid
+                          })
+            npu.create(nbr_key, ["SAI_NEIGHBOR_ENTRY_ATTR_DST_MAC_ADDRESS", "00:44:44:44:44:{:02x}".format(i)])
+            undo.callback(npu.remove, nbr_key)
+            nh_oid = npu.create(SaiObjType.NEXT_HOP,
+                                [
+                                    "SAI_NEXT_HOP_ATTR_TYPE", "SAI_NEXT_HOP_TYPE_IP",
+                                    "SAI_NEXT_HOP_ATTR_IP", ip,
+                                    "SAI_NEXT_HOP_ATTR_ROUTER_INTERFACE_ID", rif_oid
+                                ])
+            undo.callback(npu.remove, nh_oid)
+            nhg_mbr_oid = npu.create(SaiObjType.NEXT_HOP_GROUP_MEMBER,
+                                     [
+                                         "SAI_NEXT_HOP_GROUP_MEMBER_ATTR_NEXT_HOP_GROUP_ID", nhg_oid,
+                                         "SAI_NEXT_HOP_GROUP_MEMBER_ATTR_NEXT_HOP_ID", nh_oid
+                                     ])
+            undo.callback(npu.remove, nhg_mbr_oid)
+        npu.create_route(dst_prefix, npu.default_vrf_oid, nhg_oid)
+        undo.callback(npu.remove_route, dst_prefix, npu.default_vrf_oid)
+
+        self.kind = "ecmp"
+        self.dst_mac = npu.get(npu.oid, ["SAI_SWITCH_ATTR_SRC_MAC_ADDRESS", ""]).value()
+
+    @staticmethod
+    def scores(counts):
+        '''
+        Returns the uniformity scores of the per-member packet counts
+        '''
+        import numpy as np
+
+        counts = np.asarray(counts, dtype=np.float64)
+        total = counts.sum()
+        if total == 0:
+            return {"jain": 0.0, "cv": 0.0, "chi2": 0.0, "max_deviation": 1.0}
+        mean = counts.mean()
+        return {
+            "jain": float(total ** 2 / (len(counts) * np.square(counts).sum())),
+            "cv": float(counts.std() / mean),
+            "chi2": float(np.square(counts - mean).sum() / mean),
+            "max_deviation": float(np.abs(counts - mean).max() / mean),
+        }
+
+    def run(self, pkt, sweep, pps=1000, timeout=None):
+        '''
+        Sends the flows and measures their distribution across the members
+
+        Parameters:
+            pkt (Packet): The packet template. The destination MAC is set to the LAG
+                    FDB entry MAC or to the switch MAC for ECMP.
+            sweep (dict): The template fields to sweep in SaiTrafficStream format.
+                    Each packet variant is a separate flow.
+            pps (int): The rate to send the flows at
+            timeout (float): The time to wait for the flows after they are sent
+
+        Returns:
+            The result dictionary, also stored in the results list
+        '''
+        import numpy as np
+
+        assert self.kind is not None, "Neither LAG nor ECMP is configured"
+        pkt = pkt.copy()
+        pkt[scapy.Ether].dst = self.dst_mac
+
+        verifier = self.dataplane.flow_verifier()
+        member_ids = [(0, idx) for idx in self.members]
+        for buf in SaiTrafficStream.variants(pkt, sweep):
+            exp_pkt = Mask(scapy.Ether(buf))
+            if self.kind == "ecmp":
+                exp_pkt.set_do_not_care_packet(scapy.Ether, "dst")
+                exp_pkt.set_do_not_care_packet(scapy.Ether, "src")
+                exp_pkt.set_do_not_care_packet(scapy.IP, "ttl")
+                exp_pkt.set_do_not_care_packet(scapy.IP, "chksum")
+            verifier.expect(exp_pkt, member_ids)
+        flows = len(verifier.flows)
+
+        gen = self.dataplane.traffic_generator()
+        gen.add_stream(self.ingress, pkt, pps=pps, count=flows, increments=sweep)
+        start = time.monotonic()
+        gen.run()
+        result = verifier.verify(timeout, do_assert=False)
+        elapsed = time.monotonic() - start
+
+        counts = np.array([result["matched"].get(port_id, 0) for port_id in member_ids], dtype=np.int64)
+        missing = sum(result["missing"].values())
+        result = {
+            "kind": self.kind,
+            "members": self.members,
+            "sweep": {field: list(incr) if type(incr) == tuple else incr for field, incr in sweep.items()},
+            "flows": flows,
+            "counts": counts.tolist(),
+            "histogram": (counts / max(counts.sum(), 1)).tolist(),
+            "missing": missing,
+            "unexpected": sum(result["unexpected"].values()),
+            "scores": self.scores(counts),
+            "elapsed": elapsed,
+        }
+        logging.info("{} hash distribution of {} flows: {}, scores {}".format(
+                     self.kind, flows, result["counts"], result["scores"]))
+        self.results.append(result)
+        return result
+
+    def save(self, fname):
+        '''
+        Stores the results as JSON benchmark artifact
+        '''
+        artifact = {
+            "asic": self.npu.name,
+            "target": self.npu.target,
+            "sku": self.npu.sku,
+            "build": self.build,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": self.results,
+        }
+        with open(fname, "w") as f:
+            json.dump(artifact, f, indent=4)
+
+    @staticmethod
+    def compare(baseline, current, tolerance=0.02):
+        '''
+        Compares the results of two benchmark artifacts, e.g., of the different SAI builds
+
+        Returns:
+            The list of (kind, sweep, baseline jain, current jain) tuples of the results
+            with Jain's index regressed by more than the tolerance
+        '''
+        def load(fname):
+            with open(fname) as f:
+                data = json.load(f)
+            return {(r["kind"], json.dumps(r["sweep"], sort_keys=True)): r for r in data["results"]}
+
+        baseline = load(baseline)
+        regressions = []
+        for key, result in load(current).items():
+            if key in baseline and \
+               result["scores"]["jain"] < baseline[key]["scores"]["jain"] - tolerance:
+                regressions.append((key[0], key[1], baseline[key]["scores"]["jain"], result["scores"]["jain"]))
+        return regressions
@@ -1,14 +1,81 @@
 import json
+import logging
 import time
 from sai import Sai
 from sai import SaiData
 from sai import SaiObjType
 from sai_dataplane import SaiDataPlane
 from sai_dataplane import SaiHostifDataPlane
+from sai_shadow import SaiShadowFdb
+from sai_shadow import SaiShadowRoutes
+from sai_stats import SaiStatsTable
+
+
+class SaiPortTable:
+    '''
+    The switch ports lookup table.
+
+    The port is identified by its index in SaiNpu.port_oids, which is PTF
+    dataplane port number as well. The port properties are stored in the lists
+    indexed by the port index, and the reverse dictionaries map the properties
+    back to the port index, so the lookup is O(1) in both directions.
+    '''
+
+    def __init__(self, port_oids, bp_oids, lanes, fp_ports=None):
+        '''
+        Parameters:
+            port_oids (list): The port OIDs
+            bp_oids (list): The .1Q bridge port OID of each port or None
+            lanes (list): The HW lanes of each port
+            fp_ports (list): The front panel port number of each port
+                    as per SKU configuration or None
+        '''
+        assert len(port_oids) == len(bp_oids) == len(lanes)
+        assert fp_ports is None or len(fp_ports) == len(port_oids)
+
+        self.port_oids = list(port_oids)
+        self.bp_oids = list(bp_oids)
+        self.lanes = [tuple(port_lanes) for port_lanes in lanes]
+        self.fp_ports = list(fp_ports) if fp_ports is not None else [None] * len(port_oids)
+
+        self.__by_port_oid = {oid: idx for idx, oid in enumerate(self.port_oids)}
+        self.__by_bp_oid = {oid: idx for idx, oid in enumerate(self.bp_oids) if oid is not None}
+        self.__by_fp_port = {fp: idx for idx, fp in enumerate(self.fp_ports) if fp is not None}
+        self.__by_lane = {lane: idx for idx, port_lanes in enumerate(self.lanes) for lane in port_lanes}
+
+    def __len__(self):
+        return len(self.port_oids)
+
+    def by_port_oid(self, oid):
+        return self.__by_port_oid.get(oid)
+
+    def by_bp_oid(self, oid):
+        return self.__by_bp_oid.get(oid)
+
+    def by_fp_port(self, fp_port):
+        return self.__by_fp_port.get(int(fp_port))
+
+    def by_lane(self, lane):
+        return self.__by_lane.get(int(lane))
+
+    def set_bp_oid(self, idx, oid):
+        '''
+        Updates the .1Q bridge port of the port, e.g., after it was re-created
+        '''
+        self.__by_bp_oid.pop(self.bp_oids[idx], None)
+        self.bp_oids[idx] = oid
+        if oid is not None:
+            self.__by_bp_oid[oid] = idx
 
 
 class SaiNpu(Sai):
 
+    # The default port list size to retrieve in a single round trip
+    port_list_hint = 256
+
+    # The default objects discovered on init() per DUT fingerprint
+    discovery_cache = {}
+
     def __init__(self, exec_params):
         super().__init__(exec_params)
 
@@ -23,6 +90,13 @@ class SaiNpu(Sai):
         self.port_map = None
         self.hostif_map = None
         self.sku_config = None
+        self.baseline = None
+        # (VLAN, bridge port) to VLAN member index
+        self.vlan_members = {}
+        self.vlan_member_keys = {}
+        self.ports = None
+        self.fdb = SaiShadowFdb()
+        self.routes = SaiShadowRoutes()
 
     def init(self, attr):
         # Load SKU configuration if any
@@ -43,51 +117,239 @@ class SaiNpu(Sai):
         self.oid = self.create(SaiObjType.SWITCH, sw_attr)
         self.rec2vid[self.oid] = self.oid
 
-        # Default .1Q bridge
-        self.dot1q_br_oid = self.get(self.oid, ["SAI_SWITCH_ATTR_DEFAULT_1Q_BRIDGE_ID", "oid:0x0"]).oid()
-        assert (self.dot1q_br_oid != "oid:0x0")
+        self.discover()
 
-        # Default VLAN
-        self.default_vlan_oid = self.get(self.oid, ["SAI_SWITCH_ATTR_DEFAULT_VLAN_ID", "oid:0x0"]).oid()
-        assert (self.default_vlan_oid != "oid:0x0")
+        # Update SKU
+        if self.sku_config is not None:
+            self.set_sku_mode(self.sku_config)
 
-        self.default_vlan_id = self.get(self.default_vlan_oid, ["SAI_VLAN_ATTR_VLAN_ID", ""]).to_json()[1]
-        assert (self.default_vlan_id != "0")
+        self.build_port_table()
+
+        # The state to roll back to on reset()
+        self.baseline = (self.snapshot(), self.port_oids.copy(), self.dot1q_bp_oids.copy(), self.ports.bp_oids.copy())
+
+    def __discover_switch(self, port_num):
+        sw_attrs = [
+            "SAI_SWITCH_ATTR_DEFAULT_1Q_BRIDGE_ID",      "oid:0x0",
+            "SAI_SWITCH_ATTR_DEFAULT_VLAN_ID",           "oid:0x0",
+            "SAI_SWITCH_ATTR_DEFAULT_VIRTUAL_ROUTER_ID", "oid:0x0",
+            "SAI_SWITCH_ATTR_NUMBER_OF_ACTIVE_PORTS",    "",
+            "SAI_SWITCH_ATTR_PORT_LIST",                 self.make_list(max(port_num, 1), "oid:0x0")
+        ]
+        status, data = self.get(self.oid, sw_attrs, False)
+        if status == "SAI_STATUS_BUFFER_OVERFLOW":
+            port_num = int(data.to_json()[9].split(":")[0])
+            sw_attrs[-1] = self.make_list(port_num, "oid:0x0")
+            data = self.get(self.oid, sw_attrs)
+        else:
+            assert status == "SAI_STATUS_SUCCESS", f"get({self.oid}, {sw_attrs}) --> {status}"
 
-        # Default VRF
-        self.default_vrf_oid = self.get(self.oid, ["SAI_SWITCH_ATTR_DEFAULT_VIRTUAL_ROUTER_ID", "oid:0x0"]).oid()
-        assert (self.default_vrf_oid != "oid:0x0")
+        port_oids = data.oids(9) if int(data.to_json()[7]) > 0 else []
+        return data.oid(1), data.oid(3), data.oid(5), port_oids
 
-        # Ports
-        port_num = self.get(self.oid, ["SAI_SWITCH_ATTR_NUMBER_OF_ACTIVE_PORTS", ""]).uint32()
-        if port_num > 0:
-            self.port_oids = self.get(self.oid,
-                                     ["SAI_SWITCH_ATTR_PORT_LIST", self.make_list(port_num, "oid:0x0")]).oids()
+    def discover(self):
+        '''
+        Discovers the default SAI objects of the switch.
 
-            # .1Q bridge ports
-            status, data = self.get(self.dot1q_br_oid, ["SAI_BRIDGE_ATTR_PORT_LIST", "1:oid:0x0"], False)
-            bport_num = data.uint32()
-            assert (status == "SAI_STATUS_BUFFER_OVERFLOW")
-            assert (bport_num > 0)
+        The switch level attributes are retrieved by the single multi-attribute get.
+        The default VLAN ID and .1Q bridge ports are retrieved in the next pipelined
+        round trip, unless the switch level attributes match the ones discovered
+        on the same DUT before.
+        '''
+        fingerprint = (self.server_ip, self.name, self.target, self.sku, self.vid_to_rid(self.oid))
+        cached = self.discovery_cache.get(fingerprint)
+
+        port_num = len(cached["port_oids"]) if cached else self.port_list_hint
+        self.dot1q_br_oid, self.default_vlan_oid, self.default_vrf_oid, port_oids = self.__discover_switch(port_num)
+        assert (self.dot1q_br_oid != "oid:0x0")
+        assert (self.default_vlan_oid != "oid:0x0")
+        assert (self.default_vrf_oid != "oid:0x0")
+        self.port_oids = port_oids
+
+        switch = {
+            "dot1q_br_oid": self.dot1q_br_oid,
+            "default_vlan_oid": self.default_vlan_oid,
+            "default_vrf_oid": self.default_vrf_oid,
+            "port_oids": port_oids
+        }
+        if cached is not None and all(cached[key] == value for key, value in switch.items()) and \
+           None not in self.r.hmget("VIDTORID", [self.default_vlan_oid] + cached["dot1q_bp_oids"]):
+            self.default_vlan_id = cached["default_vlan_id"]
+            self.dot1q_bp_oids = cached["dot1q_bp_oids"].copy()
+            return
+
+        requests = [(self.default_vlan_oid, ["SAI_VLAN_ATTR_VLAN_ID", ""])]
+        if len(self.port_oids) > 0:
+            requests.append((self.dot1q_br_oid,
+                             ["SAI_BRIDGE_ATTR_PORT_LIST", self.make_list(len(self.port_oids), "oid:0x0")]))
+        replies = self.get_many(requests, False)
+
+        status, data = replies[0]
+        assert status == "SAI_STATUS_SUCCESS"
+        self.default_vlan_id = data.to_json()[1]
+        assert (self.default_vlan_id != "0")
 
-            self.dot1q_bp_oids = self.get(self.dot1q_br_oid,
-                                         ["SAI_BRIDGE_ATTR_PORT_LIST", self.make_list(bport_num, "oid:0x0")]).oids()
-            assert (bport_num == len(self.dot1q_bp_oids))
+        self.dot1q_bp_oids = []
+        if len(replies) > 1:
+            status, data = replies[1]
+            if status == "SAI_STATUS_BUFFER_OVERFLOW":
+                bport_num = data.uint32()
+                assert (bport_num > 0)
+                data = self.get(self.dot1q_br_oid, ["SAI_BRIDGE_ATTR_PORT_LIST", self.make_list(bport_num, "oid:0x0")])
+            else:
+                assert status == "SAI_STATUS_SUCCESS"
+            self.dot1q_bp_oids = data.oids()
+            assert (len(self.dot1q_bp_oids) > 0)
 
-        # Update SKU
-        if self.sku_config is not None:
-            self.set_sku_mode(self.sku_config)
+        switch["port_oids"] = port_oids.copy()
+        switch["default_vlan_id"] = self.default_vlan_id
+        switch["dot1q_bp_oids"] = self.dot1q_bp_oids.copy()
+        self.discovery_cache[fingerprint] = switch
 
     def cleanup(self):
         super().cleanup()
         self.port_oids.clear()
         self.dot1q_bp_oids.clear()
+        self.baseline = None
+        self.vlan_members.clear()
+        self.vlan_member_keys.clear()
+        self.ports = None
+        self.fdb.clear()
+        self.routes.clear()
+
+    def restore(self):
+        '''
+        Rolls SAI objects back to the state right after init() without
+        syncd restart. Returns False when the full reset is required.
+        '''
+        if self.baseline is None:
+            return False
+
+        snapshot, port_oids, dot1q_bp_oids, port_bp_oids = self.baseline
+        try:
+            if not self.rollback(snapshot):
+                return False
+        except Exception as e:
+            logging.warning("Rollback failed: {}".format(repr(e)))
+            return False
+
+        self.port_oids = port_oids.copy()
+        self.dot1q_bp_oids = dot1q_bp_oids.copy()
+        for idx, bp_oid in enumerate(port_bp_oids):
+            self.ports.set_bp_oid(idx, bp_oid)
+        # The VLAN members re-created by the rollback get the new OIDs,
+        # so the index is rebuilt on the next lookup
+        self.vlan_members.clear()
+        self.vlan_member_keys.clear()
+        self.fdb.clear()
+        self.routes.clear()
+        self.rec2vid[self.oid] = self.oid
+        return True
 
     def reset(self):
+        if self.restore():
+            return
         self.cleanup()
         attr = []
         self.init(attr)
 
+    def __index_vlan_member(self, oid, attrs):
+        if type(attrs) == str:
+            attrs = json.loads(attrs)
+        attrs = dict(zip(attrs[0::2], attrs[1::2]))
+        key = (attrs.get("SAI_VLAN_MEMBER_ATTR_VLAN_ID"), attrs.get("SAI_VLAN_MEMBER_ATTR_BRIDGE_PORT_ID"))
+        if None not in key:
+            self.vlan_members[key] = oid
+            self.vlan_member_keys[oid] = key
+
+    def __unindex_vlan_member(self, oid):
+        key = self.vlan_member_keys.pop(oid, None)
+        if key is not None:
+            self.vlan_members.pop(key, None)
+
+    def create(self, obj, attrs, do_assert = True):
+        result = super().create(obj, attrs, do_assert)
+        status, vid = ("SAI_STATUS_SUCCESS", result) if do_assert else result
+        if status != "SAI_STATUS_SUCCESS":
+            return result
+
+        if obj == SaiObjType.VLAN_MEMBER or (type(obj) == str and obj.startswith("SAI_OBJECT_TYPE_VLAN_MEMBER:")):
+            self.__index_vlan_member(vid if vid is not None else obj.split(":", 1)[1], attrs)
+        elif type(obj) == str and obj.startswith("SAI_OBJECT_TYPE_FDB_ENTRY:"):
+            self.fdb.add_attrs(obj.split(":", 1)[1], attrs)
+        elif type(obj) == str and obj.startswith("SAI_OBJECT_TYPE_ROUTE_ENTRY:"):
+            self.routes.add_attrs(obj.split(":", 1)[1], attrs)
+        return result
+
+    def remove(self, obj, do_assert = True):
+        status = super().remove(obj, do_assert)
+        if status == "SAI_STATUS_SUCCESS":
+            if obj.startswith("SAI_OBJECT_TYPE_FDB_ENTRY:"):
+                self.fdb.remove_key(obj.split(":", 1)[1])
+            elif obj.startswith("SAI_OBJECT_TYPE_ROUTE_ENTRY:"):
+                self.routes.remove_key(obj.split(":", 1)[1])
+            else:
+                self.__unindex_vlan_member(obj.split(":", 1)[1] if obj.startswith("SAI_OBJECT_TYPE_") else obj)
+        return status
+
+    def bulk_create(self, obj, keys, attrs, do_assert = True):
+        status, entry_status = super().bulk_create(obj, keys, attrs, do_assert)
+        for idx, key in enumerate(keys):
+            if idx >= len(entry_status) or entry_status[idx] != "SAI_STATUS_SUCCESS":
+                continue
+            if obj in (SaiObjType.VLAN_MEMBER, "SAI_OBJECT_TYPE_VLAN_MEMBER"):
+                self.__index_vlan_member(key, attrs[idx] if len(attrs) > 1 else attrs[0])
+            elif obj in (SaiObjType.FDB_ENTRY, "SAI_OBJECT_TYPE_FDB_ENTRY"):
+                self.fdb.add_attrs(key, attrs[idx] if len(attrs) > 1 else attrs[0])
+            elif obj in (SaiObjType.ROUTE_ENTRY, "SAI_OBJECT_TYPE_ROUTE_ENTRY"):
+                self.routes.add_attrs(key, attrs[idx] if len(attrs) > 1 else attrs[0])
+        return status, entry_status
+
+    def bulk_remove(self, obj, keys, do_assert = True):
+        status, entry_status = super().bulk_remove(obj, keys, do_assert)
+        for idx, key in enumerate(keys):
+            if idx >= len(entry_status) or entry_status[idx] != "SAI_STATUS_SUCCESS":
+                continue
+            if obj in (SaiObjType.VLAN_MEMBER, "SAI_OBJECT_TYPE_VLAN_MEMBER"):
+                self.__unindex_vlan_member(key)
+            elif obj in (SaiObjType.FDB_ENTRY, "SAI_OBJECT_TYPE_FDB_ENTRY"):
+                self.fdb.remove_key(key)
+            elif obj in (SaiObjType.ROUTE_ENTRY, "SAI_OBJECT_TYPE_ROUTE_ENTRY"):
+                self.routes.remove_key(key)
+        return status, entry_status
+
+    def set(self, obj, attr, do_assert = True):
+        status = super().set(obj, attr, do_assert)
+        if status == "SAI_STATUS_SUCCESS" and obj.startswith("SAI_OBJECT_TYPE_ROUTE_ENTRY:"):
+            self.routes.set_attr(obj.split(":", 1)[1], attr)
+        return status
+
+    def rebuild_vlan_members(self):
+        '''
+        Rebuilds (VLAN, bridge port) to VLAN member index from the DUT
+        in a single round trip
+        '''
+        self.vlan_members.clear()
+        self.vlan_member_keys.clear()
+
+        vlan_mbr_oids = self.get_oids(SaiObjType.VLAN_MEMBER)[SaiObjType.VLAN_MEMBER.name]
+        attrs = ["SAI_VLAN_MEMBER_ATTR_VLAN_ID", "oid:0x0", "SAI_VLAN_MEMBER_ATTR_BRIDGE_PORT_ID", "oid:0x0"]
+        replies = self.get_many([(oid, attrs) for oid in vlan_mbr_oids], False)
+        for oid, (status, data) in zip(vlan_mbr_oids, replies):
+            if status == "SAI_STATUS_SUCCESS":
+                self.__index_vlan_member(oid, data.to_json())
+
+    def get_vlan_member(self, vlan_oid, bp_oid):
+        '''
+        Returns VLAN member OID by VLAN and bridge port or None if there is no such member.
+        The index is rebuilt from the DUT when the member is unknown or stale.
+        '''
+        oid = self.vlan_members.get((vlan_oid, bp_oid))
+        if oid is None or self.vid_to_rid(oid) is None:
+            self.rebuild_vlan_members()
+            oid = self.vlan_members.get((vlan_oid, bp_oid))
+        return oid
+
     def flush_fdb_entries(self, attrs=None):
         """
         To flush all static entries, set SAI_FDB_FLUSH_ATTR_ENTRY_TYPE = SAI_FDB_FLUSH_ENTRY_TYPE_STATIC.
@@ -109,6 +371,7 @@ class SaiNpu(Sai):
         status = self.operate("SAI_OBJECT_TYPE_SWITCH:" + self.oid, attrs, "Sflush")
         assert status[0].decode("utf-8") == 'Sflushresponse'
         assert status[2].decode("utf-8") == 'SAI_STATUS_SUCCESS'
+        self.fdb.flush(attrs)
 
     def clear_stats(self, obj, attrs, do_assert = True):
         if obj.startswith("oid:"):
@@ -127,16 +390,76 @@ class SaiNpu(Sai):
         if type(attrs) != str:
             attrs = json.dumps(attrs)
         status = self.operate(obj, attrs, "Sget_stats")
+        timestamp = time.monotonic()
         status[2] = status[2].decode("utf-8")
         if do_assert:
             assert status[2] == 'SAI_STATUS_SUCCESS'
 
-        data = SaiData(status[1].decode("utf-8"))
+        data = SaiData(status[1].decode("utf-8"), timestamp)
         if do_assert:
             return data
 
         return status[2], data
 
+    def __stats_ops(self, objs, attrs, op):
+        if type(attrs) != str:
+            attrs = json.dumps(attrs)
+        ops = []
+        for obj in objs:
+            if obj.startswith("oid:"):
+                obj = self.vid_to_type(obj) + ":" + obj
+            ops.append((obj, attrs, op))
+        return ops
+
+    def clear_stats_many(self, objs, attrs, do_assert = True):
+        '''
+        Clears the same counters of multiple objects in a single round trip
+
+        Parameters:
+            objs (list): The list of objects in clear_stats() format
+            attrs (list): The counters in clear_stats() format
+            do_assert (bool): Assert that all the operations succeeded.
+
+        Returns:
+            The list of the operations statuses in the order of objects
+        '''
+        result = []
+        for obj, status in zip(objs, self.operate_many(self.__stats_ops(objs, attrs, "Sclear_stats"))):
+            status[2] = status[2].decode("utf-8")
+            if do_assert:
+                assert status[2] == 'SAI_STATUS_SUCCESS', f"clear_stats({obj}) --> {status}"
+            result.append(status[2])
+        return result
+
+    def get_stats_many(self, objs, attrs, do_assert = True):
+        '''
+        Retrieves the same counters of multiple objects in a single round trip
+
+        Parameters:
+            objs (list): The list of objects in get_stats() format
+            attrs (list): The counters in get_stats() format
+            do_assert (bool): Assert that all the operations succeeded.
+
+        Usage example:
+            get_stats_many(queue_oids, ['SAI_QUEUE_STAT_PACKETS', '', 'SAI_QUEUE_STAT_BYTES', ''])
+
+        Returns:
+            SaiStatsTable, the dictionary of the objects to their counters dictionaries.
+            When do_assert is False, the objects the counters
+            failed to be retrieved for are mapped to None.
+        '''
+        responses = self.operate_many(self.__stats_ops(objs, attrs, "Sget_stats"))
+        table = SaiStatsTable(time.monotonic())
+        for obj, status in zip(objs, responses):
+            status[2] = status[2].decode("utf-8")
+            if do_assert:
+                assert status[2] == 'SAI_STATUS_SUCCESS', f"get_stats({obj}) --> {status}"
+            if status[2] != 'SAI_STATUS_SUCCESS':
+                table[obj] = None
+                continue
+            table[obj] = SaiData(status[1].decode("utf-8")).counters()
+        return table
+
     def create_fdb(self, vlan_oid, mac, bp_oid, action = "SAI_PACKET_ACTION_FORWARD"):
         self.create('SAI_OBJECT_TYPE_FDB_ENTRY:' + json.dumps(
                        {
@@ -160,6 +483,43 @@ class SaiNpu(Sai):
                        }),
                     do_assert)
 
+    def ensure_fdb(self, vlan_oid, mac, bp_oid, action = "SAI_PACKET_ACTION_FORWARD"):
+        '''
+        Creates static FDB entry unless the same entry exists as per shadow FDB.
+        The existing entry with the different attributes is re-created.
+
+        Returns True when FDB entry was created.
+        '''
+        entry = self.fdb.get(vlan_oid, mac)
+        if entry == (bp_oid, "SAI_FDB_ENTRY_TYPE_STATIC", action):
+            return False
+        if entry is not None:
+            self.remove_fdb(vlan_oid, mac)
+        self.create_fdb(vlan_oid, mac, bp_oid, action)
+        return True
+
+    def absent_fdb(self, vlan_oid, mac):
+        '''
+        Removes FDB entry if it exists as per shadow FDB.
+
+        Returns True when FDB entry was removed.
+        '''
+        if self.fdb.get(vlan_oid, mac) is None:
+            return False
+        self.remove_fdb(vlan_oid, mac)
+        return True
+
+    def verify_fdb(self):
+        '''
+        Compares shadow FDB with FDB entries in ASIC_STATE table.
+
+        Returns the tuple with the sets of the missing and unexpected (bvid, MAC) keys.
+        Both are empty when DUT is in sync with shadow FDB.
+        '''
+        prefix = "ASIC_STATE:SAI_OBJECT_TYPE_FDB_ENTRY:"
+        keys = [key.decode("utf-8")[len(prefix):] for key in self.r.scan_iter(prefix + "*", count=1000)]
+        return self.fdb.compare(keys)
+
     def create_vlan_member(self, vlan_oid, bp_oid, tagging_mode):
         oid = self.create(SaiObjType.VLAN_MEMBER,
                     [
@@ -172,23 +532,9 @@ class SaiNpu(Sai):
     def remove_vlan_member(self, vlan_oid, bp_oid):
         assert vlan_oid.startswith("oid:")
 
-        vlan_mbr_oids = []
-        status, data = self.get(vlan_oid, ["SAI_VLAN_ATTR_MEMBER_LIST", "1:oid:0x0"], False)
-        if status == "SAI_STATUS_SUCCESS":
-            vlan_mbr_oids = data.oids()
-        elif status == "SAI_STATUS_BUFFER_OVERFLOW":
-            oids = self.make_list(data.uint32(), "oid:0x0")
-            vlan_mbr_oids = self.get(vlan_oid, ["SAI_VLAN_ATTR_MEMBER_LIST", oids]).oids()
-        else:
-            assert status == "SAI_STATUS_SUCCESS"
-
-        for vlan_mbr_oid in vlan_mbr_oids:
-            oid = self.get(vlan_mbr_oid, ["SAI_VLAN_MEMBER_ATTR_BRIDGE_PORT_ID", "oid:0x0"]).oid()
-            if oid == bp_oid:
-                self.remove(vlan_mbr_oid)
-                return
-
-        assert False
+        vlan_mbr_oid = self.get_vlan_member(vlan_oid, bp_oid)
+        assert vlan_mbr_oid is not None, f"No VLAN {vlan_oid} member with bridge port {bp_oid}"
+        self.remove(vlan_mbr_oid)
 
     def create_route(self, dest, vrf_oid, nh_oid=None, opt_attr=None):
         attrs = []
@@ -214,6 +560,64 @@ class SaiNpu(Sai):
                        })
                     )
 
+    def egress_ports(self, vrf_oid, addrs):
+        '''
+        Resolves the ports the addresses are routed to as per shadow routes:
+        route -> next hop or next hop group members -> router interface -> port or LAG members.
+
+        The next hops, router interfaces and LAGs are retrieved from the DUT
+        once per call. The router interfaces other than port ones (e.g., VLAN)
+        are not resolved, since their egress port depends on the neighbor FDB entry.
+
+        Parameters:
+            vrf_oid (str): The virtual router OID
+            addrs (list): The destination IP addresses
+
+        Returns:
+            The dictionary of the address to the sorted list of the dataplane port
+            indexes. The list is empty when the address is dropped, trapped,
+            not routed or can not be resolved.
+        '''
+        cache = {}
+        result = {}
+        for addr in addrs:
+            nh_oid = self.routes.next_hop(vrf_oid, addr)
+            result[addr] = [] if nh_oid is None else sorted(self.__egress_ports(nh_oid, cache))
+        return result
+
+    def __egress_ports(self, oid, cache):
+        ports = cache.get(oid)
+        if ports is not None:
+            return ports
+
+        ports = set()
+        obj_type = self.vid_to_type(oid)
+        if obj_type == "SAI_OBJECT_TYPE_NEXT_HOP_GROUP":
+            for mbr_oid in self.get_list(oid, "SAI_NEXT_HOP_GROUP_ATTR_NEXT_HOP_MEMBER_LIST", "oid:0x0"):
+                if mbr_oid.startswith("oid:"):
+                    nh_oid = self.get(mbr_oid, ["SAI_NEXT_HOP_GROUP_MEMBER_ATTR_NEXT_HOP_ID", "oid:0x0"]).oid()
+                    ports |= self.__egress_ports(nh_oid, cache)
+        elif obj_type == "SAI_OBJECT_TYPE_NEXT_HOP":
+            rif_oid = self.get(oid, ["SAI_NEXT_HOP_ATTR_ROUTER_INTERFACE_ID", "oid:0x0"]).oid()
+            ports = self.__egress_ports(rif_oid, cache)
+        elif obj_type == "SAI_OBJECT_TYPE_ROUTER_INTERFACE":
+            rif_type = self.get(oid, ["SAI_ROUTER_INTERFACE_ATTR_TYPE", ""]).value()
+            if rif_type in ["SAI_ROUTER_INTERFACE_TYPE_PORT", "SAI_ROUTER_INTERFACE_TYPE_SUB_PORT"]:
+                port_oid = self.get(oid, ["SAI_ROUTER_INTERFACE_ATTR_PORT_ID", "oid:0x0"]).oid()
+                ports = self.__egress_ports(port_oid, cache)
+        elif obj_type == "SAI_OBJECT_TYPE_LAG":
+            for mbr_oid in self.get_list(oid, "SAI_LAG_ATTR_PORT_LIST", "oid:0x0"):
+                if mbr_oid.startswith("oid:"):
+                    port_oid = self.get(mbr_oid, ["SAI_LAG_MEMBER_ATTR_PORT_ID", "oid:0x0"]).oid()
+                    ports |= self.__egress_ports(port_oid, cache)
+        elif obj_type == "SAI_OBJECT_TYPE_PORT":
+            idx = self.ports.by_port_oid(oid)
+            if idx is not None:
+                ports.add(idx)
+
+        cache[oid] = ports
+        return ports
+
     def hostif_dataplane_start(self, ifaces):
         self.hostif_map = dict()
 
@@ -248,62 +652,174 @@ class SaiNpu(Sai):
             SaiDataPlane.setPortMap(self.port_map)
             self.port_map = None
 
-    def set_sku_mode(self, sku):
-        # Remove existing ports
-        num_ports = len(self.dot1q_bp_oids)
-        for idx in range(num_ports):
-            self.remove_vlan_member(self.default_vlan_oid, self.dot1q_bp_oids[idx])
-            self.remove(self.dot1q_bp_oids[idx])
-            self.remove(self.port_oids[idx])
-        self.port_oids.clear()
-        self.dot1q_bp_oids.clear()
-
-        # Create ports as per SKU
+    @staticmethod
+    def sku_port_attrs(sku):
+        '''
+        Compiles SKU configuration into the list of port creation attributes
+        ordered by the front panel port number
+        '''
+        port_attrs = []
         for fp_port in sorted(sku["port"], key=int):
-            port_attr = [
-                "SAI_PORT_ATTR_ADMIN_STATE",   "true",
-                "SAI_PORT_ATTR_PORT_VLAN_ID",  self.default_vlan_id,
-            ]
+            port_cfg = sku["port"][fp_port]
 
             # Lanes
-            lanes = sku["port"][fp_port]["lanes"]
+            lanes = port_cfg["lanes"]
             lanes = str(lanes.count(',') + 1) + ":" + lanes
-            port_attr.append("SAI_PORT_ATTR_HW_LANE_LIST")
-            port_attr.append(lanes)
-
-            # Speed
-            speed = sku["port"][fp_port]["speed"] if "speed" in sku["port"][fp_port] else sku["speed"]
-            port_attr.append("SAI_PORT_ATTR_SPEED")
-            port_attr.append(speed)
 
             # Autoneg
-            autoneg = sku["port"][fp_port]["autoneg"] if "autoneg" in sku["port"][fp_port] else sku["autoneg"]
+            autoneg = port_cfg["autoneg"] if "autoneg" in port_cfg else sku["autoneg"]
             autoneg = "true" if autoneg == "on" else "false"
-            port_attr.append("SAI_PORT_ATTR_AUTO_NEG_MODE")
-            port_attr.append(autoneg)
 
             # FEC
-            fec = sku["port"][fp_port]["fec"] if "fec" in sku["port"][fp_port] else sku["fec"]
+            fec = port_cfg["fec"] if "fec" in port_cfg else sku["fec"]
             if fec == "rs":
                 fec = "SAI_PORT_FEC_MODE_RS"
             elif fec == "fc":
                 fec = "SAI_PORT_FEC_MODE_FC"
             else:
                 fec = "SAI_PORT_FEC_MODE_NONE"
-            port_attr.append("SAI_PORT_ATTR_FEC_MODE")
-            port_attr.append(fec)
 
-            port_oid = self.create(SaiObjType.PORT, port_attr)
-            self.port_oids.append(port_oid)
+            port_attrs.append([
+                "SAI_PORT_ATTR_HW_LANE_LIST",  lanes,
+                "SAI_PORT_ATTR_SPEED",         port_cfg["speed"] if "speed" in port_cfg else sku["speed"],
+                "SAI_PORT_ATTR_AUTO_NEG_MODE", autoneg,
+                "SAI_PORT_ATTR_FEC_MODE",      fec
+            ])
+        return port_attrs
+
+    @staticmethod
+    def __lanes(value):
+        return tuple(int(lane) for lane in value.split(":", 1)[1].split(","))
+
+    def __get_ports_config(self, port_attrs=None):
+        '''
+        Reads the SKU related attributes of the current ports and the ports of .1Q bridge ports
+        in a single round trip. Returns None when the ports configuration can not be retrieved.
+        '''
+        if port_attrs is None:
+            port_attrs = [
+                "SAI_PORT_ATTR_SPEED",         "",
+                "SAI_PORT_ATTR_AUTO_NEG_MODE", "",
+                "SAI_PORT_ATTR_FEC_MODE",      "",
+                "SAI_PORT_ATTR_ADMIN_STATE",   "",
+                "SAI_PORT_ATTR_PORT_VLAN_ID",  ""
+            ]
+        port_attrs = ["SAI_PORT_ATTR_HW_LANE_LIST", self.make_list(8, "0")] + port_attrs
+        requests = [(oid, port_attrs) for oid in self.port_oids]
+        requests += [(bp_oid, ["SAI_BRIDGE_PORT_ATTR_PORT_ID", "oid:0x0"]) for bp_oid in self.dot1q_bp_oids]
+        replies = self.get_many(requests, False)
+
+        ports = {}
+        for oid, (status, data) in zip(self.port_oids, replies):
+            if status == "SAI_STATUS_BUFFER_OVERFLOW":
+                attrs = port_attrs.copy()
+                attrs[1] = self.make_list(int(data.to_json()[1].split(":")[0]), "0")
+                status, data = self.get(oid, attrs, False)
+            if status != "SAI_STATUS_SUCCESS":
+                return None
+            values = data.to_json()
+            ports[oid] = dict(zip(values[0::2], values[1::2]))
+
+        bps = {}
+        for bp_oid, (status, data) in zip(self.dot1q_bp_oids, replies[len(self.port_oids):]):
+            if status != "SAI_STATUS_SUCCESS":
+                return None
+            bps[data.oid()] = bp_oid
+        return ports, bps
+
+    def build_port_table(self):
+        '''
+        Builds the ports lookup table in a single round trip
+        '''
+        config = self.__get_ports_config([])
+        assert config is not None, "Unable to retrieve the ports HW lanes"
+        ports, bps = config
+
+        fp_ports = None
+        if self.sku_config is not None:
+            fp_ports = sorted(int(fp_port) for fp_port in self.sku_config["port"])
+        self.ports = SaiPortTable(self.port_oids,
+                                  [bps.get(oid) for oid in self.port_oids],
+                                  [self.__lanes(ports[oid]["SAI_PORT_ATTR_HW_LANE_LIST"]) for oid in self.port_oids],
+                                  fp_ports)
+
+    def set_sku_mode(self, sku):
+        '''
+        Reconfigures the ports as per SKU configuration.
+
+        The ports with the same lanes are preserved and only their speed, FEC,
+        autoneg, admin state and PVID are updated if changed. The rest of ports
+        are removed together with their bridge ports and default VLAN members,
+        and the new ports are created.
+        '''
+        target = []
+        for attrs in self.sku_port_attrs(sku):
+            attrs = [
+                "SAI_PORT_ATTR_ADMIN_STATE",   "true",
+                "SAI_PORT_ATTR_PORT_VLAN_ID",  self.default_vlan_id,
+            ] + attrs
+            target.append(attrs)
+
+        config = self.__get_ports_config()
+        if config is None:
+            # Unable to diff the ports, re-create all of them
+            ports, bps = {}, {}
+            removed_bps = self.dot1q_bp_oids.copy()
+        else:
+            ports, bps = config
+            removed_bps = []
+
+        by_lanes = {self.__lanes(cfg["SAI_PORT_ATTR_HW_LANE_LIST"]): oid for oid, cfg in ports.items()}
+        port_oids = []
+        sets = []
+        for attrs in target:
+            cfg = dict(zip(attrs[0::2], attrs[1::2]))
+            oid = by_lanes.pop(self.__lanes(cfg.pop("SAI_PORT_ATTR_HW_LANE_LIST")), None)
+            port_oids.append(oid)
+            if oid is None:
+                continue
+            for attr, value in cfg.items():
+                if ports[oid].get(attr) != value:
+                    sets.append((oid, [attr, value]))
+
+        # Remove the ports with the lanes that are not in use anymore
+        removed = [oid for oid in self.port_oids if oid not in port_oids]
+        removed_bps += [bps[oid] for oid in removed if oid in bps]
+        if len(removed_bps) > 0:
+            # Refresh the index once rather than on every miss of get_vlan_member()
+            self.rebuild_vlan_members()
+            members = [self.vlan_members.get((self.default_vlan_oid, bp_oid)) for bp_oid in removed_bps]
+            self.remove_many(SaiObjType.VLAN_MEMBER, [oid for oid in members if oid is not None])
+            self.remove_many(SaiObjType.BRIDGE_PORT, removed_bps)
+        self.remove_many(SaiObjType.PORT, removed)
+
+        # Update the preserved ports
+        self.set_many(sets)
+
+        # Create ports as per SKU
+        new_oids = self.create_many(SaiObjType.PORT,
+                                    [attrs for oid, attrs in zip(port_oids, target) if oid is None])
+        created = len(new_oids)
+        new_oids = iter(new_oids)
+        self.port_oids = [oid if oid is not None else next(new_oids) for oid in port_oids]
 
         # Create bridge ports and default VLAN members
-        for port_oid in self.port_oids:
-            bp_oid = self.create(SaiObjType.BRIDGE_PORT,
-                                [
-                                    "SAI_BRIDGE_PORT_ATTR_TYPE", "SAI_BRIDGE_PORT_TYPE_PORT",
-                                    "SAI_BRIDGE_PORT_ATTR_PORT_ID", port_oid,
-                                    #"SAI_BRIDGE_PORT_ATTR_BRIDGE_ID", self.dot1q_br_oid,
-                                    "SAI_BRIDGE_PORT_ATTR_ADMIN_STATE", "true"
-                                ])
-            self.dot1q_bp_oids.append(bp_oid)
-            self.create_vlan_member(self.default_vlan_oid, bp_oid, "SAI_VLAN_TAGGING_MODE_UNTAGGED")
+        new_bps = [oid for oid in self.port_oids if oid not in bps]
+        new_bps = dict(zip(new_bps, self.create_many(SaiObjType.BRIDGE_PORT, [
+            [
+                "SAI_BRIDGE_PORT_ATTR_TYPE", "SAI_BRIDGE_PORT_TYPE_PORT",
+                "SAI_BRIDGE_PORT_ATTR_PORT_ID", port_oid,
+                #"SAI_BRIDGE_PORT_ATTR_BRIDGE_ID", self.dot1q_br_oid,
+                "SAI_BRIDGE_PORT_ATTR_ADMIN_STATE", "true"
+            ] for port_oid in new_bps
+        ])))
+        self.create_many(SaiObjType.VLAN_MEMBER, [
+            [
+                "SAI_VLAN_MEMBER_ATTR_VLAN_ID",           self.default_vlan_oid,
+                "SAI_VLAN_MEMBER_ATTR_BRIDGE_PORT_ID",    bp_oid,
+                "SAI_VLAN_MEMBER_ATTR_VLAN_TAGGING_MODE", "SAI_VLAN_TAGGING_MODE_UNTAGGED"
+            ] for bp_oid in new_bps.values()
+        ])
+        self.dot1q_bp_oids = [bps[oid] if oid in bps else new_bps[oid] for oid in self.port_oids]
+        logging.info("SKU applied: {} ports preserved, {} removed, {} created, {} attributes set".format(
+                     len(self.port_oids) - created, len(removed), created, len(sets)))
@@ -0,0 +1,564 @@
+from array import array
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import time
+
+
+# Matches a single SAI object ID in the serialized key or attribute value
+oid_pattern = re.compile(r"oid:0x[0-9a-fA-F]+")
+
+
+def parse_rec_line(line):
+    '''
+    Non-bulk entry format:
+    data|action|sai-object-type:key|attr1|attr2
+
+    Will be converted into:
+    [["action", "sai-object-type:key", "attr1", "attr2"]]
+
+    Bulk entry format:
+    data|action|sai-object-type||key1|attr1|attr2||...||key-n|attr1|attr2
+
+    Will be converted into:
+    [["action", "sai-object-type"], ["key", "attr1", "attr2"], ..., [key-n", "attr1", "attr2"]]
+    '''
+    data = []
+    bulk_tokens = line.strip().split("||")
+    for idx, token in enumerate(bulk_tokens):
+        tokens = token.strip().split("|")
+        if idx == 0:
+            tokens = tokens[1:]
+        data.append(tokens)
+    return data
+
+
+class SaiRecIndex:
+    '''
+    The line offsets index of sairedis.rec file.
+
+    Allows to read the arbitrary range of records without parsing
+    the whole recording. The index is stored next to the recording
+    into "<fname>.idx" file and is rebuilt once the recording changes.
+    '''
+
+    header = struct.Struct("<QQ")
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.offsets = array('Q')
+
+        st = os.stat(fname)
+        if not self.__load(fname + ".idx", st):
+            self.__build()
+            self.__save(fname + ".idx", st)
+
+    def __load(self, idx_fname, st):
+        try:
+            with open(idx_fname, "rb") as f:
+                size, mtime = self.header.unpack(f.read(self.header.size))
+                if size != st.st_size or mtime != st.st_mtime_ns:
+                    return False
+                self.offsets.frombytes(f.read())
+        except (OSError, struct.error, ValueError):
+            self.offsets = array('Q')
+            return False
+        return True
+
+    def __build(self):
+        offset = 0
+        with open(self.fname, "rb") as f:
+            for line in f:
+                self.offsets.append(offset)
+                offset += len(line)
+
+    def __save(self, idx_fname, st):
+        try:
+            with open(idx_fname, "wb") as f:
+                f.write(self.header.pack(st.st_size, st.st_mtime_ns))
+                f.write(self.offsets.tobytes())
+        except OSError:
+            logging.warning("Unable to store {} index".format(self.fname))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def line(self, lineno):
+        '''
+        Returns the raw line by its number (starting from 1)
+        '''
+        with open(self.fname, "rb") as f:
+            f.seek(self.offsets[lineno - 1])
+            return f.readline().decode("utf-8").rstrip("\n")
+
+    def record(self, lineno):
+        return parse_rec_line(self.line(lineno))
+
+    def records(self, start=1, stop=None):
+        '''
+        Returns the parsed records [start, stop) in apply_rec() format
+        '''
+        stop = len(self.offsets) + 1 if stop is None else min(stop, len(self.offsets) + 1)
+        rec = {}
+        if start >= stop:
+            return rec
+        with open(self.fname, "rb") as f:
+            f.seek(self.offsets[start - 1])
+            for cnt in range(start, stop):
+                rec[cnt] = parse_rec_line(f.readline().decode("utf-8"))
+        return rec
+
+
+class SaiRecProfile:
+    '''
+    Collects the timing profile of sairedis.rec file replay.
+
+    Each replayed record (or bulk record) is accounted with its latency
+    and SAI object type. The progress with the throughput and ETA is logged
+    periodically, and the summary can be stored into JSON file.
+    '''
+
+    def __init__(self, total, interval=5):
+        '''
+        Parameters:
+            total (int): The total number of records to be replayed,
+                    with every object of the bulk record counted (see count())
+            interval (int): The progress logging interval in seconds
+        '''
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.records = []
+        self.obj_types = {}
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    @staticmethod
+    def record_info(record):
+        '''
+        Returns (action, SAI object type, number of records) for the record
+        '''
+        rec = record[0]
+        obj_type = ""
+        if rec[0] != 'G' and len(rec) > 1:
+            obj_type = rec[1].split(":", 1)[0]
+        if rec[0] in ['C', 'S', 'R']:
+            return rec[0], obj_type, len(record) - 1
+        return rec[0], obj_type, 1
+
+    @staticmethod
+    def count(records):
+        '''
+        Returns the number of records in the units of add() progress,
+        i.e., the bulk record is counted as the number of its objects
+        '''
+        return sum(SaiRecProfile.record_info(record)[2] for record in records.values())
+
+    def add(self, cnt, record, duration):
+        action, obj_type, num = self.record_info(record)
+        self.done += num
+        self.records.append((cnt, action, obj_type, num, duration))
+
+        stats = self.obj_types.setdefault(obj_type, [0, 0.0])
+        stats[0] += num
+        stats[1] += duration
+
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            logging.info(self.progress())
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def progress(self):
+        elapsed = self.elapsed()
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        return "Replayed {}/{} records ({:.1f}%), {:.1f} records/s, ETA {:.1f}s".format(
+               self.done, self.total, 100.0 * self.done / max(self.total, 1), rate, eta)
+
+    def summary(self, top=20):
+        elapsed = self.elapsed()
+        slow = sorted(self.records, key=lambda r: r[4], reverse=True)[:top]
+        obj_types = sorted(self.obj_types.items(), key=lambda t: t[1][1], reverse=True)
+        return {
+            "records": self.done,
+            "total": self.total,
+            "operations": len(self.records),
+            "time": elapsed,
+            "throughput": self.done / elapsed if elapsed > 0 else 0,
+            "slow_records": [
+                {
+                    "line": cnt,
+                    "action": action,
+                    "obj_type": obj_type,
+                    "records": num,
+                    "time": duration
+                } for cnt, action, obj_type, num, duration in slow
+            ],
+            "obj_types": {
+                obj_type: {
+                    "records": stats[0],
+                    "time": stats[1],
+                    "avg": stats[1] / stats[0] if stats[0] else 0
+                } for obj_type, stats in obj_types
+            }
+        }
+
+    def save(self, fname, top=20):
+        with open(fname, "w") as f:
+            json.dump(self.summary(top), f, indent=4)
+
+
+class SaiRecState:
+    '''
+    The final state of SAI objects after sairedis.rec file replay.
+
+    SAI objects are identified by the normalized names that do not depend
+    on OID values used in the particular recording:
+      * OID objects - by the object type and the creation attributes;
+      * entries - by the key with the normalized OIDs;
+      * objects discovered through 'g'/'G' records - by the parent object
+        and the attribute they were retrieved through.
+
+    Two states can be compared to find out the minimal set of operations
+    that turn the SAI objects of one recording into another one.
+    '''
+
+    def __init__(self, records):
+        self.objects = {}
+        self.rec2canon = {}
+        self.rec2vid = {}
+        self.removed = set()
+        self.complete = True
+
+        get_key = None
+        for cnt, record in records.items():
+            rec = record[0]
+            if rec[0] == 'c':
+                self.__create(*rec[1].split(":", 1), rec[2:])
+            elif rec[0] == 's':
+                self.__set(*rec[1].split(":", 1), rec[2])
+            elif rec[0] == 'r':
+                self.__remove(*rec[1].split(":", 1))
+            elif rec[0] == 'C':
+                for entry in record[1:]:
+                    self.__create(rec[1], entry[0], entry[1:])
+            elif rec[0] == 'S':
+                for entry in record[1:]:
+                    self.__set(rec[1], entry[0], entry[1])
+            elif rec[0] == 'R':
+                for entry in record[1:]:
+                    self.__remove(rec[1], entry[0])
+            elif rec[0] == 'g':
+                get_key = rec[1]
+            elif rec[0] == 'G' and get_key is not None:
+                self.__discover(*get_key.split(":", 1), rec[2:])
+
+    def __canon_value(self, value):
+        if "oid:" not in value:
+            return value
+        return oid_pattern.sub(lambda m: self.rec2canon.get(m.group(0), m.group(0)), value)
+
+    def __lookup(self, obj_type, key):
+        if key.startswith("{"):
+            canon = obj_type + ":" + self.__canon_value(key)
+        else:
+            canon = self.rec2canon.get(key)
+        if canon is None or canon not in self.objects:
+            # The object was neither created nor discovered by the recording
+            self.complete = False
+            return None
+        if self.objects[canon]["type"] is None:
+            self.objects[canon]["type"] = obj_type
+        return canon
+
+    def __create(self, obj_type, key, tokens):
+        attrs = {}
+        for token in tokens:
+            attr = token.split("=", 1)
+            attrs[attr[0]] = (attr[-1], self.__canon_value(attr[-1]))
+
+        oid = None
+        if key.startswith("{"):
+            canon = obj_type + ":" + self.__canon_value(key)
+        else:
+            oid = key
+            data = json.dumps([obj_type, sorted((a, v[1]) for a, v in attrs.items())])
+            digest = hashlib.sha1(data.encode()).hexdigest()[:16]
+            idx = 0
+            while "{}:{}#{}".format(obj_type, digest, idx) in self.objects:
+                idx += 1
+            canon = "{}:{}#{}".format(obj_type, digest, idx)
+            self.rec2canon[oid] = canon
+
+        self.objects[canon] = {
+            "type": obj_type,
+            "key": key,
+            "oid": oid,
+            "create": tokens,
+            "attrs": attrs,
+            "discovered": False
+        }
+
+    def __set(self, obj_type, key, token):
+        canon = self.__lookup(obj_type, key)
+        if canon is None:
+            return
+        attr = token.split("=", 1)
+        self.objects[canon]["attrs"][attr[0]] = (attr[-1], self.__canon_value(attr[-1]))
+
+    def __remove(self, obj_type, key):
+        canon = self.__lookup(obj_type, key)
+        if canon is None:
+            return
+        obj = self.objects.pop(canon)
+        if obj["discovered"]:
+            self.removed.add(canon)
+
+    def __discover(self, obj_type, key, tokens):
+        parent = self.__lookup(obj_type, key)
+        if parent is None:
+            return
+        for token in tokens:
+            attr, value = token.split("=", 1)
+            oids = oid_pattern.findall(value)
+            for idx, oid in enumerate(oids):
+                if oid == "oid:0x0" or oid in self.rec2canon:
+                    continue
+                canon = "{}/{}".format(parent, attr)
+                if ":oid:" in value:
+                    canon += "[{}]".format(idx)
+                self.rec2canon[oid] = canon
+                self.objects[canon] = {
+                    "type": None,
+                    "key": oid,
+                    "oid": oid,
+                    "create": [],
+                    "attrs": {},
+                    "discovered": True
+                }
+
+    def bind(self, rec2vid):
+        '''
+        Binds the state to VIDs of SAI objects created on DUT
+        '''
+        self.rec2vid = dict(rec2vid)
+        return self
+
+    def dut_key(self, canon):
+        obj = self.objects[canon]
+        if obj["oid"] is not None:
+            return self.rec2vid[obj["oid"]]
+        key = oid_pattern.sub(lambda m: self.rec2vid.get(m.group(0), m.group(0)), obj["key"])
+        return obj["type"] + ":" + key
+
+    def create_record(self, canon):
+        obj = self.objects[canon]
+        return ["c", obj["type"] + ":" + obj["key"]] + obj["create"]
+
+    def set_record(self, canon, attr):
+        obj = self.objects[canon]
+        return ["s", obj["type"] + ":" + obj["key"], attr + "=" + obj["attrs"][attr][0]]
+
+    def diff(self, target):
+        '''
+        Compares the state with the target one.
+
+        Returns the tuple (removes, early_sets, creates, late_sets), where
+        removes is the list of this state objects to be removed (in the order
+        of removal), creates is the list of the target state objects to be
+        created, early_sets and late_sets are the lists of (object, attribute)
+        of the target state to be set before the objects removal and
+        after the objects creation correspondingly.
+
+        Returns None when the target state can not be reached incrementally.
+        E.g., the switch must be re-created, the attribute must be reset
+        to its default value or the default object must be re-created.
+        '''
+        if not self.complete or not target.complete:
+            return None
+        if self.removed - target.removed:
+            return None
+
+        removes = []
+        for canon in reversed(list(self.objects)):
+            obj = self.objects[canon]
+            if canon in target.objects:
+                continue
+            if obj["discovered"] and canon not in target.removed:
+                if obj["attrs"]:
+                    return None
+                continue
+            if obj["type"] == "SAI_OBJECT_TYPE_SWITCH":
+                return None
+            removes.append(canon)
+
+        creates = []
+        for canon, obj in target.objects.items():
+            if canon in self.objects:
+                continue
+            if obj["discovered"] or obj["type"] == "SAI_OBJECT_TYPE_SWITCH":
+                return None
+            creates.append(canon)
+
+        new = set(creates)
+        early_sets = []
+        late_sets = []
+        for canon, obj in target.objects.items():
+            if canon in new:
+                continue
+            attrs = self.objects[canon]["attrs"]
+            if not set(attrs).issubset(obj["attrs"]):
+                return None
+            for attr, value in obj["attrs"].items():
+                if attr in attrs and attrs[attr][1] == value[1]:
+                    continue
+                refs = [target.rec2canon.get(oid) for oid in oid_pattern.findall(value[0])]
+                if new.isdisjoint(refs):
+                    early_sets.append((canon, attr))
+                else:
+                    late_sets.append((canon, attr))
+
+        return removes, early_sets, creates, late_sets
+
+
+class SaiRecMinimizer:
+    '''
+    Reduces sairedis.rec records to the minimal subset that still reproduces
+    the failure with the delta debugging (ddmin) algorithm.
+
+    The records are grouped into units, so 'g' record is never separated from
+    its 'G' response. Every candidate is closed over the OID dependencies:
+    the record is kept only together with the records that create or discover
+    the objects it refers to. The last unit is the failing one and is always kept.
+    '''
+
+    def __init__(self, records, test):
+        '''
+        Parameters:
+            records (dict): The line number to the parsed record mapping
+            test (function): Replays the candidate records and returns
+                    True when the failure is reproduced
+        '''
+        self.records = records
+        self.test = test
+        self.units = []
+        self.deps = []
+        self.results = {}
+        self.stats = []
+        self.tests = 0
+
+        last_def = {}
+        for cnt, record in records.items():
+            if record[0][0] == 'G' and self.units and records[self.units[-1][-1]][0][0] == 'g':
+                unit = len(self.units) - 1
+                self.units[unit].append(cnt)
+            else:
+                unit = len(self.units)
+                self.units.append([cnt])
+                self.deps.append(set())
+
+            defines, uses = self.__refs(record)
+            self.deps[unit].update(last_def[ref] for ref in uses if ref in last_def)
+            self.deps[unit].discard(unit)
+            for ref in defines:
+                last_def[ref] = unit
+
+    @staticmethod
+    def __key_refs(action, key, attrs, defines, uses):
+        obj_key = key.split(":", 1)[1]
+        obj_id = obj_key if obj_key.startswith("oid:") else key
+        if action == 'c':
+            defines.add(obj_id)
+        else:
+            uses.add(obj_id)
+        if obj_key.startswith("{"):
+            uses.update(oid_pattern.findall(obj_key))
+        if action != 'g':
+            uses.update(oid_pattern.findall("|".join(attrs)))
+
+    def __refs(self, record):
+        '''
+        Returns the sets of the object IDs the record defines and refers to
+        '''
+        defines = set()
+        uses = set()
+        rec = record[0]
+        if len(record) > 1:
+            for entry in record[1:]:
+                self.__key_refs(rec[0].lower(), rec[1] + ":" + entry[0], entry[1:], defines, uses)
+        elif rec[0] == 'G':
+            defines.update(oid_pattern.findall("|".join(rec[2:])))
+        elif rec[0] in ('c', 's', 'r', 'g'):
+            self.__key_refs(rec[0], rec[1], rec[2:], defines, uses)
+        defines.discard("oid:0x0")
+        uses.discard("oid:0x0")
+        return defines, uses
+
+    def __closure(self, units):
+        closure = set(units)
+        pending = list(units)
+        while pending:
+            for dep in self.deps[pending.pop()]:
+                if dep not in closure:
+                    closure.add(dep)
+                    pending.append(dep)
+        return closure
+
+    def __test(self, units):
+        key = frozenset(units)
+        if key not in self.results:
+            lines = sorted(cnt for unit in units for cnt in self.units[unit])
+            self.results[key] = self.test({cnt: self.records[cnt] for cnt in lines})
+            self.tests += 1
+        return self.results[key]
+
+    def run(self):
+        '''
+        Returns the sorted line numbers of the minimal failing recording
+        '''
+        required = self.__closure({len(self.units) - 1})
+        current = set(range(len(self.units)))
+        n = 2
+        while True:
+            items = sorted(current - required)
+            if not items:
+                break
+            n = min(n, len(items))
+            chunks = [items[i * len(items) // n:(i + 1) * len(items) // n] for i in range(n)]
+
+            self.tests = 0
+            start = time.monotonic()
+            reduced = None
+            # Try to reduce to a subset first, then to a complement
+            candidates = [self.__closure(required.union(chunk)) for chunk in chunks]
+            candidates += [self.__closure(current.difference(chunk)) for chunk in chunks]
+            for idx, candidate in enumerate(candidates):
+                if len(candidate) < len(current) and self.__test(candidate):
+                    reduced = idx
+                    current = candidate
+                    break
+
+            self.stats.append({
+                "round": len(self.stats) + 1,
+                "granularity": n,
+                "tests": self.tests,
+                "records": sum(len(self.units[unit]) for unit in current),
+                "time": round(time.monotonic() - start, 3)
+            })
+            logging.info("Minimization round {round}: granularity {granularity}, {tests} tests, "
+                         "{records} records left, {time}s".format(**self.stats[-1]))
+
+            if reduced is not None:
+                n = 2 if reduced < len(chunks) else max(n - 1, 2)
+            elif n < len(items):
+                n = min(2 * n, len(items))
+            else:
+                break
+
+        return sorted(cnt for unit in current for cnt in self.units[unit])
@@ -0,0 +1,275 @@
+from array import array
+import ipaddress
+import json
+
+
+class SaiShadowFdb:
+    '''
+    The in-memory copy of FDB entries created through SAI Challenger.
+
+    The entries are keyed by (bvid, MAC address as integer). The value is
+    the tuple with the bridge port, the entry type and the packet action.
+    '''
+
+    def __init__(self):
+        self.entries = {}
+
+    @staticmethod
+    def mac_to_int(mac):
+        return int(mac.replace(":", "").replace("-", ""), 16)
+
+    @staticmethod
+    def int_to_mac(value):
+        mac = "{:012X}".format(value)
+        return ":".join(mac[i:i + 2] for i in range(0, 12, 2))
+
+    @classmethod
+    def key(cls, bvid, mac):
+        return bvid, cls.mac_to_int(mac)
+
+    @classmethod
+    def parse_key(cls, key):
+        '''
+        Returns the shadow key of FDB entry key in SAI Redis format
+        '''
+        if type(key) == str:
+            key = json.loads(key)
+        return cls.key(key["bvid"], key["mac"])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, bvid, mac):
+        return self.entries.get(self.key(bvid, mac))
+
+    def add(self, bvid, mac, bp_oid, entry_type="SAI_FDB_ENTRY_TYPE_STATIC",
+            action="SAI_PACKET_ACTION_FORWARD"):
+        self.entries[self.key(bvid, mac)] = (bp_oid, entry_type, action)
+
+    def add_attrs(self, key, attrs):
+        '''
+        Adds FDB entry by the key and the attributes in SAI Redis format
+        '''
+        if type(attrs) == str:
+            attrs = json.loads(attrs)
+        attrs = dict(zip(attrs[0::2], attrs[1::2]))
+        self.entries[self.parse_key(key)] = (
+            attrs.get("SAI_FDB_ENTRY_ATTR_BRIDGE_PORT_ID", "oid:0x0"),
+            attrs.get("SAI_FDB_ENTRY_ATTR_TYPE", "SAI_FDB_ENTRY_TYPE_STATIC"),
+            attrs.get("SAI_FDB_ENTRY_ATTR_PACKET_ACTION", "SAI_PACKET_ACTION_FORWARD")
+        )
+
+    def remove(self, bvid, mac):
+        return self.entries.pop(self.key(bvid, mac), None)
+
+    def remove_key(self, key):
+        return self.entries.pop(self.parse_key(key), None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def flush(self, attrs=None):
+        '''
+        Emulates FDB flush with the same semantics as SaiNpu.flush_fdb_entries():
+        the entries matching all the specified attributes are removed.
+        When the entry type is not specified, only the dynamic entries are flushed.
+
+        Returns the list of the flushed keys.
+        '''
+        if attrs is None:
+            attrs = []
+        elif type(attrs) == str:
+            attrs = json.loads(attrs)
+        attrs = dict(zip(attrs[0::2], attrs[1::2]))
+
+        entry_type = attrs.get("SAI_FDB_FLUSH_ATTR_ENTRY_TYPE", "SAI_FDB_FLUSH_ENTRY_TYPE_DYNAMIC")
+        entry_type = None if entry_type == "SAI_FDB_FLUSH_ENTRY_TYPE_ALL" else \
+            entry_type.replace("SAI_FDB_FLUSH_ENTRY_TYPE_", "SAI_FDB_ENTRY_TYPE_")
+        bp_oid = attrs.get("SAI_FDB_FLUSH_ATTR_BRIDGE_PORT_ID")
+        bvid = attrs.get("SAI_FDB_FLUSH_ATTR_BV_ID")
+
+        flushed = []
+        for key, entry in self.entries.items():
+            if entry_type is not None and entry[1] != entry_type:
+                continue
+            if bp_oid is not None and entry[0] != bp_oid:
+                continue
+            if bvid is not None and key[0] != bvid:
+                continue
+            flushed.append(key)
+
+        for key in flushed:
+            del self.entries[key]
+        return flushed
+
+    def compare(self, keys):
+        '''
+        Compares the shadow FDB with FDB entry keys in SAI Redis format.
+
+        Returns the tuple with the sets of the missing and unexpected (bvid, MAC) keys.
+        '''
+        actual = {self.parse_key(key) for key in keys}
+        expected = set(self.entries)
+        return expected - actual, actual - expected
+
+
+class SaiRouteTrie:
+    '''
+    The binary trie of IP prefixes with the longest prefix match lookup.
+
+    The nodes are numbered and their children are stored in the arrays
+    indexed by the node number. The node 0 is the root (zero length prefix).
+    '''
+
+    def __init__(self, width):
+        self.width = width
+        self.children = (array('I', [0]), array('I', [0]))
+        self.values = [None]
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __node(self, prefix, length, create=False):
+        node = 0
+        for shift in range(self.width - 1, self.width - 1 - length, -1):
+            branch = self.children[(prefix >> shift) & 1]
+            child = branch[node]
+            if child == 0:
+                if not create:
+                    return None
+                child = len(self.values)
+                self.children[0].append(0)
+                self.children[1].append(0)
+                self.values.append(None)
+                branch[node] = child
+            node = child
+        return node
+
+    def insert(self, prefix, length, value):
+        node = self.__node(prefix, length, True)
+        if self.values[node] is None:
+            self.count += 1
+        self.values[node] = value
+
+    def remove(self, prefix, length):
+        node = self.__node(prefix, length)
+        if node is None or self.values[node] is None:
+            return None
+        value = self.values[node]
+        self.values[node] = None
+        self.count -= 1
+        return value
+
+    def get(self, prefix, length):
+        node = self.__node(prefix, length)
+        return None if node is None else self.values[node]
+
+    def lookup(self, addr):
+        '''
+        Returns the value of the longest prefix matching the address or None
+        '''
+        node = 0
+        value = self.values[0]
+        for shift in range(self.width - 1, -1, -1):
+            node = self.children[(addr >> shift) & 1][node]
+            if node == 0:
+                break
+            if self.values[node] is not None:
+                value = self.values[node]
+        return value
+
+
+class SaiShadowRoutes:
+    '''
+    The in-memory copy of the routes created through SAI Challenger.
+
+    The routes are stored in IPv4 and IPv6 tries per virtual router.
+    The trie value is the tuple with the route destination and
+    the dictionary of the route attributes.
+    '''
+
+    def __init__(self):
+        self.tries = {}
+
+    @staticmethod
+    def __parse_key(key):
+        if type(key) == str:
+            key = json.loads(key)
+        return key["vr"], key["dest"]
+
+    def __trie(self, vrf, version, create=False):
+        trie = self.tries.get((vrf, version))
+        if trie is None and create:
+            trie = SaiRouteTrie(32 if version == 4 else 128)
+            self.tries[(vrf, version)] = trie
+        return trie
+
+    def __len__(self):
+        return sum(len(trie) for trie in self.tries.values())
+
+    def clear(self):
+        self.tries.clear()
+
+    def add(self, vrf, dest, attrs=None):
+        net = ipaddress.ip_network(dest, strict=False)
+        trie = self.__trie(vrf, net.version, True)
+        trie.insert(int(net.network_address), net.prefixlen, (str(net), dict(attrs or {})))
+
+    def add_attrs(self, key, attrs):
+        '''
+        Adds the route by the key and the attributes in SAI Redis format
+        '''
+        if type(attrs) == str:
+            attrs = json.loads(attrs)
+        self.add(*self.__parse_key(key), dict(zip(attrs[0::2], attrs[1::2])))
+
+    def set_attr(self, key, attr):
+        if type(attr) == str:
+            attr = json.loads(attr)
+        route = self.get(*self.__parse_key(key))
+        if route is not None:
+            route[attr[0]] = attr[1]
+
+    def remove(self, vrf, dest):
+        net = ipaddress.ip_network(dest, strict=False)
+        trie = self.__trie(vrf, net.version)
+        return None if trie is None else trie.remove(int(net.network_address), net.prefixlen)
+
+    def remove_key(self, key):
+        return self.remove(*self.__parse_key(key))
+
+    def get(self, vrf, dest):
+        '''
+        Returns the attributes of the route with exactly the same destination or None
+        '''
+        net = ipaddress.ip_network(dest, strict=False)
+        trie = self.__trie(vrf, net.version)
+        value = None if trie is None else trie.get(int(net.network_address), net.prefixlen)
+        return None if value is None else value[1]
+
+    def lookup(self, vrf, addr):
+        '''
+        Returns the tuple with the destination and the attributes of the route
+        the address is forwarded by as per the longest prefix match or None
+        '''
+        addr = ipaddress.ip_address(addr)
+        trie = self.__trie(vrf, addr.version)
+        return None if trie is None else trie.lookup(int(addr))
+
+    def next_hop(self, vrf, addr):
+        '''
+        Returns the next hop OID the address is forwarded to or None
+        when there is no route or the route drops the packets
+        '''
+        route = self.lookup(vrf, addr)
+        if route is None:
+            return None
+        attrs = route[1]
+        if attrs.get("SAI_ROUTE_ENTRY_ATTR_PACKET_ACTION", "SAI_PACKET_ACTION_FORWARD") in \
+           ("SAI_PACKET_ACTION_DROP", "SAI_PACKET_ACTION_TRAP"):
+            return None
+        return attrs.get("SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID")
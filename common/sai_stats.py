@@ -0,0 +1,215 @@
+from collections import deque
+import logging
+import threading
+import time
+
+
+# SAI counters are 64-bit and wrap around to zero on overflow
+COUNTER_MASK = 2**64 - 1
+
+
+def counter_delta(before, after, wrap=False, mask=COUNTER_MASK):
+    '''
+    Returns the counter increment.
+
+    The counter that decreased is treated as cleared in between, so its
+    increment is the value counted since the clear. When wrap is set,
+    it's treated as wrapped around (at most once) at the mask instead.
+    '''
+    if after >= before:
+        return after - before
+    if wrap:
+        return (after - before) & mask
+    return after
+
+
+class SaiStatsTable(dict):
+    '''
+    The counters of multiple objects collected at the same time.
+
+    The dictionary maps the objects to their {counter: value} dictionaries
+    (or to None if the counters failed to be retrieved) as returned by
+    SaiNpu.get_stats_many(). The timestamp is time.monotonic() time.
+
+    Usage example:
+        before = npu.get_stats_many(port_oids, cntrs)
+        send_traffic()
+        after = npu.get_stats_many(port_oids, cntrs)
+        rates = SaiStatsTable.rate(before, after)
+        assert all(r["SAI_PORT_STAT_IF_OUT_UCAST_PKTS"] > 1000 for r in rates.values())
+    '''
+
+    def __init__(self, timestamp, counters=()):
+        super().__init__(counters)
+        self.timestamp = timestamp
+
+    @staticmethod
+    def delta(before, after, wrap=False, mask=COUNTER_MASK):
+        '''
+        Returns the counters increments of all the objects present in both tables
+        as {object: {counter: delta}}. See counter_delta() for the cleared
+        and wrapped around counters handling.
+        '''
+        deltas = {}
+        for obj, cntrs in after.items():
+            prev = before.get(obj)
+            if cntrs is None or prev is None:
+                continue
+            deltas[obj] = {cntr: counter_delta(prev[cntr], value, wrap, mask) for cntr, value in cntrs.items() if cntr in prev}
+        return deltas
+
+    @staticmethod
+    def rate(before, after, wrap=False, mask=COUNTER_MASK):
+        '''
+        Returns the counters increments per second of all the objects
+        present in both tables as {object: {counter: rate}}
+        '''
+        interval = after.timestamp - before.timestamp
+        assert interval > 0, "The tables must be collected at different times"
+        deltas = SaiStatsTable.delta(before, after, wrap, mask)
+        return {obj: {cntr: delta / interval for cntr, delta in cntrs.items()} for obj, cntrs in deltas.items()}
+
+
+class SaiStatsPoller:
+    '''
+    Polls SAI objects' counters in the background thread.
+
+    The samples of every object are kept in the ring buffer of the fixed size,
+    so the poller can run for the whole traffic test without growing memory.
+
+    Usage example:
+        poller = SaiStatsPoller(npu, {
+            port_oid: ["SAI_PORT_STAT_IF_IN_UCAST_PKTS", "SAI_PORT_STAT_IF_OUT_UCAST_PKTS"],
+            queue_oid: ["SAI_QUEUE_STAT_PACKETS"]
+        }, interval=0.5)
+        with poller:
+            send_traffic()
+        rate = poller.rate(port_oid, "SAI_PORT_STAT_IF_IN_UCAST_PKTS")
+    '''
+
+    def __init__(self, npu, objects, interval=1.0, history=600):
+        '''
+        Parameters:
+            npu (SaiNpu): The NPU to poll the counters of
+            objects (dict): The object OID to the list of counters mapping.
+                    Ports, queues, priority groups and any other objects
+                    supported by get_stats() can be polled.
+            interval (float): The polling interval in seconds
+            history (int): The number of samples to keep per object
+        '''
+        self.npu = npu
+        self.objects = {oid: list(cntrs) for oid, cntrs in objects.items()}
+        self.interval = interval
+        self.samples = {oid: deque(maxlen=history) for oid in self.objects}
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def poll(self):
+        '''
+        Collects a single sample of all the counters
+        '''
+        # The objects with the same counters are polled in a single round trip
+        groups = {}
+        for oid, cntrs in self.objects.items():
+            groups.setdefault(tuple(cntrs), []).append(oid)
+
+        for cntrs, oids in groups.items():
+            attrs = []
+            for cntr in cntrs:
+                attrs.append(cntr)
+                attrs.append('')
+            table = self.npu.get_stats_many(oids, attrs, False)
+            with self.lock:
+                for oid in oids:
+                    if table[oid] is None:
+                        self.errors += 1
+                        continue
+                    self.samples[oid].append((table.timestamp, table[oid]))
+
+    def __run(self):
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                self.errors += 1
+                logging.warning("Stats polling failed: {}".format(e))
+            self.stopped.wait(max(0, self.interval - (time.monotonic() - start)))
+
+    def start(self):
+        assert self.thread is None, "The poller is already started"
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.__run, name="SaiStatsPoller", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stops the polling and collects the final sample
+        '''
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.poll()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def history(self, oid):
+        '''
+        Returns the list of (timestamp, counters) samples of the object
+        '''
+        with self.lock:
+            return list(self.samples[oid])
+
+    def last(self, oid):
+        with self.lock:
+            return self.samples[oid][-1] if self.samples[oid] else None
+
+    def __window(self, oid, window):
+        with self.lock:
+            samples = list(self.samples[oid])
+        if len(samples) < 2:
+            return None
+        if window is not None:
+            last = samples[-1][0]
+            for idx, sample in enumerate(samples):
+                if sample[0] >= last - window:
+                    samples = samples[idx:]
+                    break
+        return samples
+
+    def __delta(self, samples, cntr, wrap):
+        # The increments are summed sample by sample, so the counter
+        # cleared within the window doesn't lose the preceding increments
+        return sum(counter_delta(prev[1][cntr], curr[1][cntr], wrap)
+                   for prev, curr in zip(samples, samples[1:]))
+
+    def delta(self, oid, cntr, window=None, wrap=False):
+        '''
+        Returns the counter increment over the last window seconds
+        or over the whole history when the window is not specified.
+        See counter_delta() for the wrap parameter.
+        '''
+        samples = self.__window(oid, window)
+        if samples is None:
+            return 0
+        return self.__delta(samples, cntr, wrap)
+
+    def rate(self, oid, cntr, window=None, wrap=False):
+        '''
+        Returns the counter increment per second over the last window seconds
+        or over the whole history when the window is not specified
+        '''
+        samples = self.__window(oid, window)
+        if samples is None or samples[-1][0] == samples[0][0]:
+            return 0.0
+        return self.__delta(samples, cntr, wrap) / (samples[-1][0] - samples[0][0])
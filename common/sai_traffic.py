@@ -0,0 +1,242 @@
+import ipaddress
+import itertools
+import logging
+import threading
+import time
+
+
+class SaiTrafficStream:
+    '''
+    The stream of packets sent to the port at the constant rate.
+
+    The packet template fields can be swept through the ranges of values,
+    e.g., to spread the traffic across ECMP/LAG members or FDB entries.
+    The packet variants are serialized once before the stream is started.
+    '''
+
+    # The maximum number of packets sent in a row without checking the rate and stop conditions
+    batch = 64
+
+    def __init__(self, dataplane, port_id, pkt, pps=None, duration=None, count=None, increments=None):
+        '''
+        Parameters:
+            dataplane (SaiDataPlane): The dataplane to send the packets to
+            port_id (int or tuple): The port number on device 0 or (device, port) tuple
+            pkt (Packet): The packet template
+            pps (int): The packets per second rate. If not specified,
+                    the packets are sent as fast as possible.
+            duration (float): The time in seconds to send the packets for
+            count (int): The number of packets to send. The failed sends
+                    are counted in errors rather than sent.
+            increments (dict): The template fields to sweep in "<layer>.<field>" format
+                    to the number of values or to the (number of values, step) tuple.
+                    Every combination of the fields values is sent.
+                    MAC addresses, IP addresses and integer fields are supported.
+                    E.g., {"Ether.src": 4, "IP.dst": 16, "TCP.sport": (8, 2)} for 512 variants
+
+        When neither duration nor count is specified,
+        the stream is sent until the generator is stopped.
+        '''
+        self.device, self.port, self.__send = dataplane.port_sender(port_id)
+        self.pps = pps
+        self.duration = duration
+        self.count = count
+        self.bufs = self.variants(pkt, increments or {})
+        for buf in self.bufs:
+            dataplane.before_send(buf, device_number=self.device, port_number=self.port)
+        self.sent = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    @staticmethod
+    def __incr(value, n):
+        if type(value) == int:
+            return value + n
+        if type(value) == str and value.count(":") == 5 and "." not in value:
+            mac = "{:012X}".format((int(value.replace(":", ""), 16) + n) & 0xFFFFFFFFFFFF)
+            return ":".join(mac[i:i + 2] for i in range(0, 12, 2))
+        return str(ipaddress.ip_address(value) + n)
+
+    @staticmethod
+    def variants(pkt, increments):
+        '''
+        Returns the list of serialized packet variants, one per combination
+        of the swept fields values. The field's i-th value is its template
+        value + i * step.
+        '''
+        if len(increments) == 0:
+            return [bytes(pkt)]
+
+        fields = []
+        for name, incr in increments.items():
+            layer, field = name.split(".")
+            num, step = incr if type(incr) == tuple else (incr, 1)
+            assert num > 0
+            fields.append((layer, field, num, step, getattr(pkt[layer], field)))
+
+        bufs = []
+        for idxs in itertools.product(*(range(field[2]) for field in fields)):
+            variant = pkt.copy()
+            for (layer, field, num, step, value), i in zip(fields, idxs):
+                setattr(variant[layer], field, SaiTrafficStream.__incr(value, i * step))
+            # Recalculate the checksums of the modified packet
+            layer = variant
+            while layer:
+                if "chksum" in layer.fields:
+                    layer.chksum = None
+                layer = layer.payload
+            bufs.append(bytes(variant))
+        return bufs
+
+    def run(self, stopped):
+        '''
+        Sends the stream until it is completed or the stopped event is set
+        '''
+        send = self.__send
+        bufs = self.bufs
+        idx = 0
+        # The packets attempted to send, both sent and failed ones, drive the rate and count
+        attempted = 0
+        self.sent = 0
+        self.errors = 0
+        start = time.perf_counter()
+        deadline = start + self.duration if self.duration is not None else None
+
+        while not stopped.is_set():
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                break
+            due = self.batch
+            if self.count is not None:
+                due = min(due, self.count - attempted)
+                if due <= 0:
+                    break
+            if self.pps is not None:
+                due = min(due, int((now - start) * self.pps) + 1 - attempted)
+                if due <= 0:
+                    # Sleep until the next packet is due
+                    stopped.wait(start + attempted / self.pps - now)
+                    continue
+
+            for _ in range(due):
+                buf = bufs[idx]
+                try:
+                    # The short write is the failure to send the packet as well
+                    if send(buf) == len(buf):
+                        self.sent += 1
+                    else:
+                        self.errors += 1
+                except OSError:
+                    self.errors += 1
+                idx += 1
+                if idx == len(bufs):
+                    idx = 0
+            attempted += due
+
+        self.elapsed = time.perf_counter() - start
+
+    @property
+    def rate(self):
+        '''
+        The achieved packets per second rate
+        '''
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class SaiTrafficGenerator:
+    '''
+    Sends multiple packet streams concurrently, each in its own background thread.
+
+    Usage example:
+        gen = dataplane.traffic_generator()
+        gen.add_stream(0, simple_tcp_packet(), pps=1000, duration=5, increments={"TCP.sport": 64})
+        gen.add_stream(1, simple_udp_packet(), pps=500, duration=5)
+        gen.run()
+        assert gen.sent[(0, 0)] == get_stats(...)
+    '''
+
+    def __init__(self, dataplane):
+        self.dataplane = dataplane
+        self.streams = []
+        self.threads = []
+        self.stopped = threading.Event()
+
+    def add_stream(self, port_id, pkt, pps=None, duration=None, count=None, increments=None):
+        '''
+        Adds the stream to be sent. See SaiTrafficStream for the parameters.
+
+        Returns:
+            SaiTrafficStream
+        '''
+        assert len(self.threads) == 0, "The generator is already started"
+        stream = SaiTrafficStream(self.dataplane, port_id, pkt, pps, duration, count, increments)
+        self.streams.append(stream)
+        return stream
+
+    def start(self):
+        assert len(self.threads) == 0, "The generator is already started"
+        self.stopped.clear()
+        for stream in self.streams:
+            thread = threading.Thread(target=stream.run, args=(self.stopped,),
+                                      name="SaiTrafficStream", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def wait(self, timeout=None):
+        '''
+        Waits for all the streams to complete
+
+        Returns:
+            True if all the streams completed within the timeout
+        '''
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                return False
+        self.__finish()
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        self.__finish()
+
+    def run(self, timeout=None):
+        '''
+        Sends all the streams and waits for them to complete
+        '''
+        self.start()
+        if not self.wait(timeout):
+            self.stop()
+
+    def __finish(self):
+        if len(self.threads) == 0:
+            return
+        self.threads = []
+        with self.dataplane.dataplane.cvar:
+            for stream in self.streams:
+                self.dataplane.dataplane.tx_counters[(stream.device, stream.port)] += stream.sent
+        for stream in self.streams:
+            logging.info("Sent {} packets to device {}, port {} at {:.0f} pps".format(
+                         stream.sent, stream.device, stream.port, stream.rate))
+
+    @property
+    def sent(self):
+        '''
+        The number of packets sent per (device, port)
+        '''
+        result = {}
+        for stream in self.streams:
+            port_id = (stream.device, stream.port)
+            result[port_id] = result.get(port_id, 0) + stream.sent
+        return result
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
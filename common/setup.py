@@ -11,5 +11,9 @@ setup(
     install_requires=[
         'ptf',
     ],
-    py_modules=['sai', 'sai_npu', 'sai_dataplane'],
+    extras_require={
+        # SaiHashBenchmark distribution scores
+        'hash': ['numpy'],
+    },
+    py_modules=['sai', 'sai_npu', 'sai_dataplane', 'sai_rec', 'sai_shadow', 'sai_stats', 'sai_traffic', 'sai_hash'],
 )
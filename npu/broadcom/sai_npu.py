@@ -8,6 +8,8 @@ class SaiNpuImpl(SaiNpu):
         super().__init__(exec_params)
 
     def reset(self):
+        if self.restore():
+            return
         self.cleanup()
         attr = [
             "SAI_SWITCH_ATTR_SRC_MAC_ADDRESS",      "52:54:00:EE:BB:70",
@@ -22,6 +22,7 @@ sys.path.append(commondir)
 
 from sai_npu import SaiNpu
 from sai_dataplane import SaiDataPlane
+from sai_stats import SaiStatsTable
 
 
 ##@var DEBUG_LEVELS
@@ -78,6 +79,15 @@ config_default = {
     # Logging options
     "log_file"           : "ptf.log",
     "log_dir"            : None,
+    # The captured packets are written into pcap by SaiPcapWriter
+    "pcap_queue_size"    : 10000,
+    "pcap_max_bytes"     : None,
+    "pcap_max_seconds"   : None,
+    "pcap_max_files"     : None,
+    # The packets to drop before they are queued and captured, see SaiRxFilter.
+    # Disabled by default, "noise" drops the packets sent by the kernel.
+    # The tests can use their own rules with rx_filter(rules) marker.
+    "rx_filter"          : None,
     "debug"              : "verbose",
     "profile"            : False,
     "profile_file"       : "profile.out",
@@ -118,6 +128,8 @@ def pytest_addoption(parser):
     parser.addoption("--asic", action="store", default=os.getenv('SC_ASIC'), help="ASIC type")
     parser.addoption("--target", action="store", default=os.getenv('SC_TARGET'), help="The target device with this NPU")
     parser.addoption("--sku", action="store", default=None, help="SKU mode")
+    parser.addoption("--counters", action="store_true", default=False,
+                     help="report port and queue counters deltas of every test")
 
 
 @pytest.fixture(scope="session")
@@ -196,6 +208,120 @@ def npu(exec_params):
     return npu
 
 
+# The counters to be snapshotted before and after each test when --counters option is set
+PORT_COUNTERS = [
+    "SAI_PORT_STAT_IF_IN_UCAST_PKTS",
+    "SAI_PORT_STAT_IF_IN_NON_UCAST_PKTS",
+    "SAI_PORT_STAT_IF_IN_DISCARDS",
+    "SAI_PORT_STAT_IF_IN_ERRORS",
+    "SAI_PORT_STAT_IF_OUT_UCAST_PKTS",
+    "SAI_PORT_STAT_IF_OUT_NON_UCAST_PKTS",
+    "SAI_PORT_STAT_IF_OUT_DISCARDS",
+    "SAI_PORT_STAT_IF_OUT_ERRORS",
+]
+
+QUEUE_COUNTERS = [
+    "SAI_QUEUE_STAT_PACKETS",
+    "SAI_QUEUE_STAT_DROPPED_PACKETS",
+]
+
+
+# The ports list to the queues list mapping of counters_objects()
+counters_queues = {}
+
+
+def counters_objects(npu):
+    """
+    Returns the ports and queues to snapshot the counters of.
+    The queues are discovered once per ports list in two pipelined round trips.
+    """
+    port_oids = tuple(npu.port_oids)
+    if port_oids not in counters_queues:
+        data = npu.get_many([(oid, ["SAI_PORT_ATTR_QOS_NUMBER_OF_QUEUES", ""]) for oid in port_oids], False)
+        requests = []
+        for oid, (status, value) in zip(port_oids, data):
+            if status == "SAI_STATUS_SUCCESS" and value.uint32() > 0:
+                requests.append((oid, ["SAI_PORT_ATTR_QOS_QUEUE_LIST", npu.make_list(value.uint32(), "oid:0x0")]))
+        queue_oids = []
+        for status, value in npu.get_many(requests, False):
+            if status == "SAI_STATUS_SUCCESS":
+                queue_oids += value.to_list()
+        counters_queues[port_oids] = queue_oids
+    return port_oids, counters_queues[port_oids]
+
+
+def counters_snapshot(npu):
+    port_oids, queue_oids = counters_objects(npu)
+    snapshot = {}
+    for oids, cntrs in ((port_oids, PORT_COUNTERS), (queue_oids, QUEUE_COUNTERS)):
+        if len(oids) == 0:
+            continue
+        attrs = []
+        for cntr in cntrs:
+            attrs += [cntr, ""]
+        snapshot.update(npu.get_stats_many(oids, attrs, False))
+    return snapshot
+
+
+def counters_deltas(before, after):
+    """
+    Returns the non-zero counters deltas as {oid: {counter: delta}}.
+    The counters cleared during the test report the value counted since the clear.
+    """
+    deltas = {}
+    for oid, cntrs in SaiStatsTable.delta(before, after).items():
+        changed = {cntr: delta for cntr, delta in cntrs.items() if delta != 0}
+        if changed:
+            deltas[oid] = changed
+    return deltas
+
+
+@pytest.fixture(autouse=True)
+def counters_report(request):
+    """
+    Snapshots the port and queue counters before the test when --counters option is set.
+    The deltas are attached to the test report by pytest_runtest_makereport().
+    """
+    if not request.config.getoption("--counters") or "npu" not in request.fixturenames:
+        yield
+        return
+
+    npu = request.getfixturevalue("npu")
+    try:
+        request.node.counters_before = (npu, counters_snapshot(npu))
+    except Exception as e:
+        logging.warning("Unable to collect the counters of {}: {}".format(request.node.nodeid, repr(e)))
+        yield
+        return
+    yield
+    del request.node.counters_before
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    if call.when != "call" or not hasattr(item, "counters_before"):
+        return
+
+    npu, before = item.counters_before
+    try:
+        deltas = counters_deltas(before, counters_snapshot(npu))
+    except Exception as e:
+        # The report must not abort the session, e.g., when syncd crashed during the test
+        logging.warning("Unable to collect the counters of {}: {}".format(item.nodeid, repr(e)))
+        return
+    if not deltas:
+        return
+
+    report = outcome.get_result()
+    lines = []
+    for oid, cntrs in deltas.items():
+        for cntr, delta in sorted(cntrs.items()):
+            lines.append("{} {} {:+d}".format(oid, cntr, delta))
+    report.sections.append(("Counters deltas", "\n".join(lines)))
+    report.user_properties.append(("counters", deltas))
+
+
 # NOTE: Obsoleted. The `npu` fixture should be used instead.
 @pytest.fixture(scope="session")
 def sai(npu):
@@ -278,11 +404,12 @@ def dataplane_init():
     dataplane_instance = ptf.dataplane.DataPlane(config)
     if config["log_dir"] == None:
         filename = os.path.splitext(config["log_file"])[0] + '.pcap'
-        dataplane_instance.start_pcap(filename)
+        SaiDataPlane.start_pcap(dataplane_instance, filename)
 
     for port_id, ifname in config["port_map"].items():
         device, port = port_id
         dataplane_instance.port_add(ifname, device, port)
+    SaiDataPlane.set_rx_filter(dataplane_instance, config["rx_filter"])
 
     logging.info("++++++++ " + time.asctime() + " ++++++++")
 
@@ -294,8 +421,13 @@ def dataplane_init():
 
 
 @pytest.fixture(scope="function")
-def dataplane(dataplane_init):
-    dataplane = SaiDataPlane(dataplane_init)
+def dataplane(dataplane_init, request):
+    # The tests marked with no_pcap are not captured, e.g., not to limit the traffic rate
+    capture = request.node.get_closest_marker("no_pcap") is None
+    # The tests marked with rx_filter(rules) use their own RX filter instead of the default one
+    marker = request.node.get_closest_marker("rx_filter")
+    rx_filter = marker.args[0] if marker is not None else False
+    dataplane = SaiDataPlane(dataplane_init, capture, rx_filter)
     dataplane.setUp()
 
     yield dataplane
@@ -0,0 +1,58 @@
+import os
+import pytest
+from ptf import config
+from ptf.testutils import simple_tcp_packet
+from sai_hash import SaiHashBenchmark
+
+
+# The flows to be distributed: 64 source IPs x 16 TCP source ports
+sweep = {"IP.src": 64, "TCP.sport": 16}
+
+
+def artifact(name):
+    log_dir = config["log_dir"] if config["log_dir"] is not None else "."
+    return os.path.join(log_dir, name)
+
+
+@pytest.mark.no_pcap
+def test_lag_hash(npu, dataplane):
+    """
+    Description:
+    Check the traffic distribution across LAG members
+
+    Test scenario:
+    1. Create a LAG of ports 1-3 in the default VLAN and FDB entry pointing to it
+    2. Send 1024 flows on port 0
+    3. Verify that all the flows are forwarded and the distribution is close to uniform
+    4. Store the distribution into lag_hash.json artifact
+    5. Clean up configuration
+    """
+    bench = SaiHashBenchmark(npu, dataplane, 0, [1, 2, 3], build=os.getenv("SC_SAI_BUILD"))
+    with bench.lag():
+        if npu.run_traffic:
+            result = bench.run(simple_tcp_packet(ip_dst="10.0.0.1"), sweep)
+            bench.save(artifact("lag_hash.json"))
+            assert result["missing"] == 0
+            assert result["scores"]["max_deviation"] < 0.2
+
+
+@pytest.mark.no_pcap
+def test_ecmp_hash(npu, dataplane):
+    """
+    Description:
+    Check the traffic distribution across ECMP group members
+
+    Test scenario:
+    1. Create RIFs on ports 0-3 and the route to ECMP group of the next hops on ports 1-3
+    2. Send 1024 flows on port 0
+    3. Verify that all the flows are routed and the distribution is close to uniform
+    4. Store the distribution into ecmp_hash.json artifact
+    5. Clean up configuration
+    """
+    bench = SaiHashBenchmark(npu, dataplane, 0, [1, 2, 3], build=os.getenv("SC_SAI_BUILD"))
+    with bench.ecmp("10.10.0.0/16"):
+        if npu.run_traffic:
+            result = bench.run(simple_tcp_packet(ip_dst="10.10.0.1"), sweep)
+            bench.save(artifact("ecmp_hash.json"))
+            assert result["missing"] == 0
+            assert result["scores"]["max_deviation"] < 0.2
@@ -1,5 +1,7 @@
 import pytest
 import time
+from collections import Counter
+from sai_rec import oid_pattern
 
 @pytest.fixture(scope="module")
 def bcm56850_teardown(npu):
@@ -15,6 +17,20 @@ def tofino_teardown(npu):
         npu.reset()
 
 
+def asic_state(npu):
+    """
+    Returns ASIC_STATE objects with the VIDs replaced by their object types,
+    so the states reached by the different replays can be compared
+    """
+    objects = []
+    for key, attrs in npu.snapshot()["objects"].items():
+        obj = [oid_pattern.sub(lambda m: npu.vid_to_type(m.group(0)), key)]
+        obj += sorted(attr + "=" + oid_pattern.sub(lambda m: npu.vid_to_type(m.group(0)), value)
+                      for attr, value in attrs.items())
+        objects.append("|".join(obj))
+    return Counter(objects)
+
+
 @pytest.mark.parametrize(
     "fname",
     [
@@ -39,6 +55,56 @@ def test_apply_sairec(npu, exec_params, dataplane, fname, bcm56850_teardown):
     npu.apply_rec("/sai/sonic-sairedis/tests/" + fname)
 
 
+@pytest.mark.parametrize(
+    "fname",
+    [
+        "BCM56850/bridge_create_1.rec",
+        "BCM56850/acl_tables.rec",
+        "BCM56850/bulk_fdb.rec",
+        "BCM56850/bulk_route.rec",
+        "BCM56850/remove_create_port.rec"
+    ],
+)
+def test_apply_sairec_bulk(npu, exec_params, dataplane, fname, bcm56850_teardown):
+    if npu.name != "BCM56850":
+        pytest.skip("VS specific scenario")
+
+    if exec_params["server"] != 'localhost':
+        pytest.skip("Currently not supported in client-server mode")
+
+    npu.apply_rec("/sai/sonic-sairedis/tests/" + fname, bulk=True)
+
+
+def test_apply_sairec_delta(npu, exec_params, dataplane, bcm56850_teardown):
+    if npu.name != "BCM56850":
+        pytest.skip("VS specific scenario")
+
+    if exec_params["server"] != 'localhost':
+        pytest.skip("Currently not supported in client-server mode")
+
+    path = "/sai/sonic-sairedis/tests/"
+    npu.apply_rec(path + "BCM56850/empty_sw.rec", delta=True)
+    for fname in ["BCM56850/bulk_fdb.rec", "BCM56850/bulk_route.rec"]:
+        assert npu.apply_rec(path + fname, delta=True), "{} is not applied incrementally".format(fname)
+    delta_state = asic_state(npu)
+
+    # The incremental replay must end up in the same ASIC state as the full one
+    assert not npu.apply_rec(path + "BCM56850/bulk_route.rec")
+    assert delta_state == asic_state(npu)
+
+    assert npu.apply_rec(path + "BCM56850/empty_sw.rec", delta=True)
+
+
+def test_bisect_sairec(npu, exec_params, dataplane, bcm56850_teardown):
+    if npu.name != "BCM56850":
+        pytest.skip("VS specific scenario")
+
+    if exec_params["server"] != 'localhost':
+        pytest.skip("Currently not supported in client-server mode")
+
+    assert npu.bisect_rec("/sai/sonic-sairedis/tests/BCM56850/bulk_route.rec") is None
+
+
 @pytest.mark.parametrize(
     "fname",
     [
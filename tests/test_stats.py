@@ -1,4 +1,8 @@
 import pytest
+import time
+from ptf.testutils import simple_tcp_packet
+from sai_stats import SaiStatsPoller
+from sai_stats import SaiStatsTable
 
 
 def test_stats(npu, dataplane):
@@ -30,12 +34,83 @@ def test_stats(npu, dataplane):
     assert len(queue_oids) > 0
 
     # Get queues stats
+    table = npu.get_stats_many(queue_oids,
+                               [
+                                   'SAI_QUEUE_STAT_PACKETS', '',
+                                   'SAI_QUEUE_STAT_BYTES', ''
+                               ])
     for queue_oid in queue_oids:
-        cntrs = npu.get_stats(queue_oid,
-                              [
-                                  'SAI_QUEUE_STAT_PACKETS', '',
-                                  'SAI_QUEUE_STAT_BYTES', ''
-                              ]).counters()
+        cntrs = table[queue_oid]
         for cntr_id in cntrs:
             assert cntrs[cntr_id] == 0, "{} is not 0".format(cntr_id)
 
+
+def test_stats_many(npu, dataplane):
+
+    port_oids = npu.get_list(npu.oid, "SAI_SWITCH_ATTR_PORT_LIST", "oid:0x0")
+    assert len(port_oids) > 0
+
+    cntrs = [
+        'SAI_PORT_STAT_IF_IN_OCTETS', '',
+        'SAI_PORT_STAT_IF_IN_UCAST_PKTS', '',
+        'SAI_PORT_STAT_IF_OUT_OCTETS', ''
+    ]
+
+    # Clear and get the counters of all the ports at once
+    npu.clear_stats_many(port_oids, cntrs)
+    table = npu.get_stats_many(port_oids, cntrs)
+    assert list(table) == port_oids
+
+    for port_oid in port_oids:
+        for cntr_id, value in table[port_oid].items():
+            assert value == 0, "{} {} is not 0".format(port_oid, cntr_id)
+
+    # No traffic is sent, so the counters rates must be 0
+    rates = SaiStatsTable.rate(table, npu.get_stats_many(port_oids, cntrs))
+    assert len(rates) == len(port_oids)
+    for port_oid in port_oids:
+        for cntr_id, rate in rates[port_oid].items():
+            assert rate == 0, "{} {} rate is not 0".format(port_oid, cntr_id)
+
+
+def test_stats_poller(npu, dataplane):
+    """
+    Description:
+    Check the background counters polling around the traffic
+
+    Test scenario:
+    1. Create FDB entry pointing to port 1 in the default VLAN
+    2. Start polling port 0 ingress and port 1 egress counters
+    3. Send 1000 packets on port 0 to port 1
+    4. Stop polling and verify the counters increments as per polled samples
+    5. Clean up configuration
+    """
+    mac = "00:22:22:22:22:22"
+    count = 1000
+    in_cntr = "SAI_PORT_STAT_IF_IN_UCAST_PKTS"
+    out_cntr = "SAI_PORT_STAT_IF_OUT_UCAST_PKTS"
+
+    npu.create_fdb(npu.default_vlan_oid, mac, npu.dot1q_bp_oids[1])
+    poller = SaiStatsPoller(npu, {
+        npu.port_oids[0]: [in_cntr],
+        npu.port_oids[1]: [out_cntr]
+    }, interval=0.2)
+
+    try:
+        with poller:
+            if npu.run_traffic:
+                time.sleep(0.5)
+                dataplane.send_burst(0, simple_tcp_packet(eth_dst=mac, eth_src="00:11:11:11:11:11"), count)
+                # Let the counters settle before the final sample is collected
+                time.sleep(1)
+    finally:
+        npu.remove_fdb(npu.default_vlan_oid, mac)
+
+    assert poller.errors == 0
+    assert len(poller.history(npu.port_oids[0])) >= 2
+    assert len(poller.history(npu.port_oids[1])) >= 2
+
+    if npu.run_traffic:
+        assert poller.delta(npu.port_oids[0], in_cntr) >= count
+        assert poller.delta(npu.port_oids[1], out_cntr) >= count
+        assert poller.rate(npu.port_oids[0], in_cntr) > 0
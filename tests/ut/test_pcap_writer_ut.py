@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from sai_dataplane import SaiPcapWriter
+
+PKT = bytes(range(100))
+
+
+def wait_for(cond, tout=5):
+    deadline = time.monotonic() + tout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+
+def test_pcap_writer_rotation(tmp_path):
+    writer = SaiPcapWriter(str(tmp_path / "cap.pcap"), max_bytes=1000, max_files=3)
+    for _ in range(100):
+        writer.write(PKT, device=0, port=1)
+    writer.close()
+
+    assert writer.written == 100
+    assert writer.dropped == 0
+    assert writer.error is None
+    assert writer.rotations > 3
+
+    # Only the last 3 files are kept
+    assert len(writer.files) == 3
+    assert writer.files[-1] == str(tmp_path / "cap.{}.pcap".format(writer.rotations))
+    assert sorted(os.listdir(str(tmp_path))) == sorted(os.path.basename(f) for f in writer.files)
+    for fname in writer.files[:-1]:
+        assert os.path.getsize(fname) >= 1000
+
+
+def test_pcap_writer_no_rotation(tmp_path):
+    writer = SaiPcapWriter(str(tmp_path / "cap.pcap"))
+    for _ in range(100):
+        writer.write(PKT, device=0, port=0)
+    writer.close()
+    # Closing twice is no-op
+    writer.close()
+
+    assert writer.written == 100
+    assert writer.rotations == 0
+    assert os.listdir(str(tmp_path)) == ["cap.pcap"]
+
+
+def test_pcap_writer_drops(tmp_path):
+    writer = SaiPcapWriter(str(tmp_path / "cap.pcap"), queue_size=2)
+    resume = threading.Event()
+    write = writer.writer.write
+
+    def blocked_write(*args):
+        resume.wait()
+        write(*args)
+    writer.writer.write = blocked_write
+
+    # The writer thread is blocked on the 1st packet, so 2 more packets are queued
+    writer.write(PKT, device=0, port=0)
+    assert wait_for(lambda: writer.queue.empty())
+    for _ in range(5):
+        writer.write(PKT, device=0, port=0)
+    assert writer.dropped == 3
+
+    resume.set()
+    writer.close()
+    assert writer.written == 3
+    assert writer.dropped == 3
+
+
+def test_pcap_writer_error(tmp_path):
+    writer = SaiPcapWriter(str(tmp_path / "cap.pcap"))
+    writer.close_timeout = 1
+
+    def failed_write(*args):
+        raise OSError(28, "No space left on device")
+    writer.writer.write = failed_write
+
+    writer.write(PKT, device=0, port=0)
+    assert wait_for(lambda: not writer.thread.is_alive())
+    assert isinstance(writer.error, OSError)
+
+    # The packets are dropped rather than queued for the failed writer
+    for _ in range(5):
+        writer.write(PKT, device=0, port=0)
+    start = time.monotonic()
+    writer.close()
+    assert time.monotonic() - start < 1
+    assert writer.written == 0
+    assert writer.dropped == 5
@@ -0,0 +1,120 @@
+import random
+import pytest
+from sai_dataplane import SaiRxFilter
+
+
+def run_bpf(insns, pkt):
+    '''
+    Runs the classic BPF program the way the kernel does.
+    Returns the program's return value or None when the program is aborted
+    by the out of the packet bounds load (the kernel drops the packet then).
+    '''
+    acc = 0
+    pc = 0
+    while True:
+        assert 0 <= pc < len(insns), "Jump out of the program"
+        code, jt, jf, k = insns[pc]
+        pc += 1
+        if code == 0x80:                            # ld len
+            acc = len(pkt)
+        elif code in (0x20, 0x28, 0x30):            # ld/ldh/ldb [k]
+            size = {0x20: 4, 0x28: 2, 0x30: 1}[code]
+            if k + size > len(pkt):
+                return None
+            acc = int.from_bytes(pkt[k:k + size], "big")
+        elif code == 0x35:                          # jge #k
+            pc += jt if acc >= k else jf
+        elif code == 0x15:                          # jeq #k
+            pc += jt if acc == k else jf
+        elif code == 0x06:                          # ret #k
+            return k
+        else:
+            assert False, "Unexpected instruction {:#x}".format(code)
+
+
+def check(rx_filter, pkt):
+    ret = run_bpf(rx_filter.bpf(), pkt)
+    assert ret is not None, "BPF program is aborted on {}".format(pkt.hex())
+    assert (ret == 0) == rx_filter.match(pkt), pkt.hex()
+    return ret == 0
+
+
+LLDP = bytes.fromhex("0180c200000e" "001122334455" "88cc") + bytes(50)
+ND = bytes.fromhex("3333ff000001" "001122334455" "86dd" "6000000000203aff") + bytes(70)
+MLD = bytes.fromhex("333300000016" "001122334455" "86dd" "6000000000240001") + bytes(70)
+IPV6_UDP = bytes.fromhex("333300000001" "001122334455" "86dd" "6000000000201101") + bytes(70)
+IPV6_UCAST = bytes.fromhex("001122334466" "001122334455" "86dd" "6000000000203aff") + bytes(70)
+IPV4 = bytes.fromhex("001122334466" "001122334455" "0800" "4500002e00004000") + bytes(70)
+
+
+@pytest.mark.parametrize(
+    "pkt,dropped",
+    [
+        (LLDP, True),
+        (ND, True),
+        (MLD, True),
+        (IPV6_UDP, False),
+        (IPV6_UCAST, False),
+        (IPV4, False),
+    ],
+)
+def test_rx_filter_noise(pkt, dropped):
+    assert check(SaiRxFilter("noise"), pkt) == dropped
+
+
+@pytest.mark.parametrize("pkt", [LLDP, ND, MLD, IPV6_UDP, IPV4])
+def test_rx_filter_short_frames(pkt):
+    # The truncated frames must neither abort the program nor be dropped
+    # by the rule that needs the bytes beyond the frame end
+    rx_filter = SaiRxFilter("noise")
+    for size in range(len(pkt)):
+        check(rx_filter, pkt[:size])
+
+
+def test_rx_filter_multi_load():
+    # 6 bytes are loaded by 4 and 2 byte loads, 3 bytes by 2 and 1 byte loads
+    rx_filter = SaiRxFilter([
+        [(0, b"\x01\x02\x03\x04\x05\x06"), (30, b"\xaa\xbb\xcc")],
+        [(12, b"\x08\x00")],
+    ])
+    insns = rx_filter.bpf()
+    assert len(insns) == (2 + 2 * 4 + 1) + (2 + 2 * 1 + 1) + 1
+
+    pkt = bytearray(64)
+    pkt[0:6] = b"\x01\x02\x03\x04\x05\x06"
+    pkt[30:33] = b"\xaa\xbb\xcc"
+    assert check(rx_filter, bytes(pkt))
+
+    # The mismatch of any byte of the first rule falls through to the second rule
+    for offset in list(range(6)) + [30, 31, 32]:
+        mismatch = bytearray(pkt)
+        mismatch[offset] ^= 0xff
+        assert not check(rx_filter, bytes(mismatch))
+        mismatch[12:14] = b"\x08\x00"
+        assert check(rx_filter, bytes(mismatch))
+
+    # The first rule needs 33 bytes, while the second one is still checked for the shorter frames
+    for size in range(len(pkt)):
+        check(rx_filter, bytes(pkt[:size]))
+        ipv4 = bytearray(pkt[:size])
+        ipv4[12:14] = b"\x08\x00"
+        check(rx_filter, bytes(ipv4[:size]))
+
+
+def test_rx_filter_random():
+    rnd = random.Random(0xaba)
+    rx_filter = SaiRxFilter(SaiRxFilter.NOISE + [[(0, b"\x01\x02\x03\x04\x05\x06"), (30, b"\xaa\xbb\xcc")]])
+    templates = [LLDP, ND, MLD, IPV6_UDP, IPV4]
+    for _ in range(1000):
+        pkt = bytearray(rnd.choice(templates)[:rnd.randrange(80)])
+        # Flip a few bytes of the matching packets
+        for _ in range(rnd.randrange(3)):
+            if len(pkt) > 0:
+                pkt[rnd.randrange(min(len(pkt), 34))] = rnd.randrange(256)
+        check(rx_filter, bytes(pkt))
+
+
+def test_rx_filter_empty():
+    rx_filter = SaiRxFilter([])
+    assert rx_filter.bpf() == [(0x06, 0, 0, 0x40000)]
+    assert not check(rx_filter, LLDP)
@@ -0,0 +1,389 @@
+import re
+import pytest
+from sai import Sai
+from sai_rec import SaiRecIndex
+from sai_rec import SaiRecMinimizer
+from sai_rec import SaiRecState
+from sai_rec import parse_rec_line
+
+SW = "oid:0x21000000000000"
+VR = "oid:0x3000000000022"
+
+
+@pytest.fixture
+def sai():
+    # The records are processed locally, so no connection to Redis is made
+    return Sai({"server": "localhost", "loglevel": "NOTICE", "saivs": True, "traffic": False,
+                "asic": "generic", "target": None, "sku": None, "asic_dir": None})
+
+
+def records(lines):
+    return {cnt: parse_rec_line(line) for cnt, line in enumerate(lines, 1)}
+
+
+def route(dest, attr="SAI_ROUTE_ENTRY_ATTR_PACKET_ACTION=SAI_PACKET_ACTION_DROP"):
+    key = '{{"dest":"{}","switch_id":"{}","vr":"{}"}}'.format(dest, SW, VR)
+    return "x|c|SAI_OBJECT_TYPE_ROUTE_ENTRY:" + key + "|" + attr
+
+
+def nh(oid, rif="oid:0x6000000000010"):
+    return "x|c|SAI_OBJECT_TYPE_NEXT_HOP:{}|SAI_NEXT_HOP_ATTR_TYPE=SAI_NEXT_HOP_TYPE_IP|" \
+           "SAI_NEXT_HOP_ATTR_ROUTER_INTERFACE_ID={}".format(oid, rif)
+
+
+def bulk_rec(sai, lines):
+    return sai._Sai__bulk_rec(records(lines))
+
+
+def test_bulk_rec_merge(sai):
+    merged, saved = bulk_rec(sai, [route("10.0.0.0/24"), route("10.0.1.0/24"), route("10.0.2.0/24")])
+    assert saved == 2
+    assert list(merged) == [1]
+    assert merged[1][0] == ["C", "SAI_OBJECT_TYPE_ROUTE_ENTRY"]
+    assert [entry[0] for entry in merged[1][1:]] == [
+        '{{"dest":"10.0.{}.0/24","switch_id":"{}","vr":"{}"}}'.format(i, SW, VR) for i in range(3)
+    ]
+    assert merged[1][1][1:] == ["SAI_ROUTE_ENTRY_ATTR_PACKET_ACTION=SAI_PACKET_ACTION_DROP"]
+
+
+def test_bulk_rec_type_change(sai):
+    merged, saved = bulk_rec(sai, [route("10.0.0.0/24"), route("10.0.1.0/24"),
+                                   nh("oid:0x400000000001"), nh("oid:0x400000000002")])
+    assert saved == 2
+    assert list(merged) == [1, 3]
+    assert merged[1][0] == ["C", "SAI_OBJECT_TYPE_ROUTE_ENTRY"]
+    assert merged[3][0] == ["C", "SAI_OBJECT_TYPE_NEXT_HOP"]
+    assert [entry[0] for entry in merged[3][1:]] == ["oid:0x400000000001", "oid:0x400000000002"]
+
+
+def test_bulk_rec_get_between_creates(sai):
+    lines = [
+        nh("oid:0x400000000001"),
+        "x|g|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_CPU_PORT=oid:0x0".format(SW),
+        "x|G|SAI_STATUS_SUCCESS|SAI_SWITCH_ATTR_CPU_PORT=oid:0x1000000000001",
+        nh("oid:0x400000000002"),
+    ]
+    merged, saved = bulk_rec(sai, lines)
+    # The get/response records interrupt the run, so nothing is merged
+    assert saved == 0
+    assert merged == records(lines)
+
+
+def test_bulk_rec_set_remove_interleaved(sai):
+    lines = [
+        nh("oid:0x400000000001"),
+        nh("oid:0x400000000002"),
+        "x|s|SAI_OBJECT_TYPE_NEXT_HOP:oid:0x400000000001|SAI_NEXT_HOP_ATTR_IP=10.0.0.1",
+        nh("oid:0x400000000003"),
+        "x|r|SAI_OBJECT_TYPE_NEXT_HOP:oid:0x400000000001",
+        "x|r|SAI_OBJECT_TYPE_NEXT_HOP:oid:0x400000000002",
+        nh("oid:0x400000000004"),
+    ]
+    merged, saved = bulk_rec(sai, lines)
+    assert saved == 2
+    assert list(merged) == [1, 3, 4, 5, 7]
+    assert merged[1][0] == ["C", "SAI_OBJECT_TYPE_NEXT_HOP"]
+    assert len(merged[1]) == 3
+    assert merged[3][0][0] == "s"
+    assert merged[4][0][0] == "c"
+    assert merged[5] == [["R", "SAI_OBJECT_TYPE_NEXT_HOP"], ["oid:0x400000000001"], ["oid:0x400000000002"]]
+    assert merged[7][0][0] == "c"
+
+
+def test_bulk_rec_same_batch_reference(sai):
+    group = "oid:0x5000000000001"
+    lines = [
+        "x|c|SAI_OBJECT_TYPE_NEXT_HOP_GROUP:{}|SAI_NEXT_HOP_GROUP_ATTR_TYPE=SAI_NEXT_HOP_GROUP_TYPE_ECMP".format(group),
+        "x|c|SAI_OBJECT_TYPE_NEXT_HOP_GROUP:oid:0x5000000000002|SAI_NEXT_HOP_GROUP_ATTR_TYPE=SAI_NEXT_HOP_GROUP_TYPE_ECMP",
+        # Refers to the group created in the current run, so it starts the new one
+        "x|c|SAI_OBJECT_TYPE_NEXT_HOP_GROUP:oid:0x5000000000003|SAI_NEXT_HOP_GROUP_ATTR_TYPE=SAI_NEXT_HOP_GROUP_TYPE_ECMP|"
+        "SAI_NEXT_HOP_GROUP_ATTR_SET_SWITCHOVER=false|SAI_NEXT_HOP_GROUP_ATTR_CONFIGURED_SIZE=" + group,
+        "x|c|SAI_OBJECT_TYPE_NEXT_HOP_GROUP:oid:0x5000000000004|SAI_NEXT_HOP_GROUP_ATTR_TYPE=SAI_NEXT_HOP_GROUP_TYPE_ECMP",
+        route("10.0.0.0/24", "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x5000000000004"),
+    ]
+    merged, saved = bulk_rec(sai, lines)
+    assert saved == 2
+    assert list(merged) == [1, 3, 5]
+    assert [entry[0] for entry in merged[1][1:]] == [group, "oid:0x5000000000002"]
+    assert [entry[0] for entry in merged[3][1:]] == ["oid:0x5000000000003", "oid:0x5000000000004"]
+    assert merged[5][0][0] == "c"
+
+
+def test_bulk_rec_switch_not_merged(sai):
+    lines = ["x|c|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_INIT_SWITCH=true".format(SW)] * 2
+    merged, saved = bulk_rec(sai, lines)
+    assert saved == 0
+    assert list(merged) == [1, 2]
+
+
+@pytest.fixture
+def rec2vid(sai):
+    sai.rec2vid = {
+        "oid:0x1": "oid:0x4000000000a01",
+        "oid:0x2": "oid:0x4000000000a02",
+        "oid:0x21000000000000": "oid:0x21000000000a00",
+        "oid:0x3000000000022": "oid:0x3000000000a22",
+    }
+    return sai
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("oid:0x1", "oid:0x4000000000a01"),
+        ("2:oid:0x1,oid:0x2", "2:oid:0x4000000000a01,oid:0x4000000000a02"),
+        ("3:oid:0x2,oid:0x0,oid:0x1", "3:oid:0x4000000000a02,oid:0x0,oid:0x4000000000a01"),
+        ("oid:0x0", "oid:0x0"),
+        ("0:null", "0:null"),
+        # The values that are not OIDs are left untouched
+        ("0x1", "0x1"),
+        ("0x1234", "0x1234"),
+        ("00:11:22:33:44:55", "00:11:22:33:44:55"),
+        ("2:0x1,0x2", "2:0x1,0x2"),
+        ("10.0.0.1", "10.0.0.1"),
+    ],
+)
+def test_update_oids(rec2vid, value, expected):
+    assert rec2vid._Sai__update_oids(value) == expected
+
+
+def test_update_oids_json_key(rec2vid):
+    key = '{"dest":"10.0.0.0/24","switch_id":"oid:0x21000000000000","vr":"oid:0x3000000000022"}'
+    assert rec2vid._Sai__update_oids(key) == \
+        '{"dest":"10.0.0.0/24","switch_id":"oid:0x21000000000a00","vr":"oid:0x3000000000a22"}'
+
+    key = '{"bvid":"oid:0x0","mac":"00:11:22:33:44:55","switch_id":"oid:0x21000000000000"}'
+    assert rec2vid._Sai__update_oids(key) == \
+        '{"bvid":"oid:0x0","mac":"00:11:22:33:44:55","switch_id":"oid:0x21000000000a00"}'
+
+
+def test_update_oids_unknown(rec2vid):
+    with pytest.raises(KeyError):
+        rec2vid._Sai__update_oids("2:oid:0x1,oid:0x3")
+
+
+def test_update_attrs(rec2vid):
+    tokens = [
+        "SAI_NEXT_HOP_GROUP_MEMBER_ATTR_NEXT_HOP_ID=oid:0x1",
+        "SAI_PORT_ATTR_INGRESS_ACL=oid:0x0",
+        "SAI_LAG_ATTR_PORT_LIST=2:oid:0x1,oid:0x2",
+        "SAI_SWITCH_ATTR_SRC_MAC_ADDRESS=00:11:22:33:44:55",
+        "SAI_ACL_ENTRY_ATTR_FIELD_DST_IP=10.0.0.1&mask:255.255.255.0",
+        "SAI_HOSTIF_ATTR_NAME=a=b",
+    ]
+    assert rec2vid._Sai__update_attrs(tokens) == [
+        "SAI_NEXT_HOP_GROUP_MEMBER_ATTR_NEXT_HOP_ID", "oid:0x4000000000a01",
+        "SAI_PORT_ATTR_INGRESS_ACL", "oid:0x0",
+        "SAI_LAG_ATTR_PORT_LIST", "2:oid:0x4000000000a01,oid:0x4000000000a02",
+        "SAI_SWITCH_ATTR_SRC_MAC_ADDRESS", "00:11:22:33:44:55",
+        "SAI_ACL_ENTRY_ATTR_FIELD_DST_IP", "10.0.0.1&mask:255.255.255.0",
+        "SAI_HOSTIF_ATTR_NAME", "a=b",
+    ]
+
+
+def test_rec_minimizer():
+    lines = [
+        "x|c|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_INIT_SWITCH=true".format(SW),
+        "x|g|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_CPU_PORT=oid:0x0".format(SW),
+        "x|G|SAI_STATUS_SUCCESS|SAI_SWITCH_ATTR_CPU_PORT=oid:0x1000000000001",
+        nh("oid:0x400000000001"),
+        "x|c|SAI_OBJECT_TYPE_ROUTER_INTERFACE:oid:0x6000000000002|SAI_ROUTER_INTERFACE_ATTR_VIRTUAL_ROUTER_ID=" + VR,
+        "x|s|SAI_OBJECT_TYPE_NEXT_HOP:oid:0x400000000001|SAI_NEXT_HOP_ATTR_IP=10.0.0.1",
+        "x|c|SAI_OBJECT_TYPE_NEXT_HOP_GROUP:oid:0x5000000000001|SAI_NEXT_HOP_GROUP_ATTR_TYPE=SAI_NEXT_HOP_GROUP_TYPE_ECMP",
+        route("10.0.0.0/24", "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x400000000001"),
+        "x|c|SAI_OBJECT_TYPE_HOSTIF:oid:0xd000000000001|SAI_HOSTIF_ATTR_OBJ_ID=oid:0x1000000000001",
+        route("10.0.1.0/24", "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x5000000000001"),
+    ]
+    recs = records(lines)
+    # Every candidate must be closed over the OID dependencies
+    deps = {2: {1, 3}, 3: {2}, 6: {4}, 8: {1, 4}, 9: {3}, 10: {1, 7}}
+    candidates = []
+
+    def test(candidate):
+        assert list(candidate) == sorted(candidate)
+        for cnt in candidate:
+            assert deps.get(cnt, set()) <= set(candidate), "#{} misses its dependencies".format(cnt)
+            assert candidate[cnt] == recs[cnt]
+        candidates.append(set(candidate))
+        # The failure at #10 is caused by #9
+        return 9 in candidate
+
+    minimizer = SaiRecMinimizer(recs, test)
+    assert minimizer.run() == [1, 2, 3, 7, 9, 10]
+
+    assert all(10 in candidate for candidate in candidates)
+    # The results are cached, so no candidate is replayed twice
+    assert len(candidates) == len(set(map(frozenset, candidates)))
+    assert sum(stat["tests"] for stat in minimizer.stats) == len(candidates)
+    assert minimizer.stats[-1]["records"] == 6
+
+
+def test_rec_minimizer_no_reduction():
+    recs = records([nh("oid:0x400000000001"), nh("oid:0x400000000002"), nh("oid:0x400000000003")])
+    # The failure needs all the records
+    minimizer = SaiRecMinimizer(recs, lambda candidate: len(candidate) == 3)
+    assert minimizer.run() == [1, 2, 3]
+
+
+def rec_a():
+    return records([
+        "x|c|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_INIT_SWITCH=true".format(SW),
+        "x|g|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_DEFAULT_VIRTUAL_ROUTER_ID=oid:0x0".format(SW),
+        "x|G|SAI_STATUS_SUCCESS|SAI_SWITCH_ATTR_DEFAULT_VIRTUAL_ROUTER_ID=" + VR,
+        "x|c|SAI_OBJECT_TYPE_ROUTER_INTERFACE:oid:0x6000000000001|SAI_ROUTER_INTERFACE_ATTR_VIRTUAL_ROUTER_ID=" + VR,
+        nh("oid:0x400000000001", "oid:0x6000000000001") + "|SAI_NEXT_HOP_ATTR_IP=10.0.0.1",
+        nh("oid:0x400000000002", "oid:0x6000000000001") + "|SAI_NEXT_HOP_ATTR_IP=10.0.0.2",
+        route("10.0.0.0/24", "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x400000000001"),
+        route("10.0.1.0/24", "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x400000000002"),
+        route("10.0.9.0/24"),
+    ])
+
+
+def rec_b():
+    # The same objects are created with the different OIDs
+    vr = "oid:0x3000000000033"
+    return records([
+        "x|c|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_INIT_SWITCH=true".format(SW),
+        "x|g|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_DEFAULT_VIRTUAL_ROUTER_ID=oid:0x0".format(SW),
+        "x|G|SAI_STATUS_SUCCESS|SAI_SWITCH_ATTR_DEFAULT_VIRTUAL_ROUTER_ID=" + vr,
+        "x|c|SAI_OBJECT_TYPE_ROUTER_INTERFACE:oid:0x6000000000005|SAI_ROUTER_INTERFACE_ATTR_VIRTUAL_ROUTER_ID=" + vr,
+        nh("oid:0x400000000007", "oid:0x6000000000005") + "|SAI_NEXT_HOP_ATTR_IP=10.0.0.2",
+        nh("oid:0x400000000008", "oid:0x6000000000005") + "|SAI_NEXT_HOP_ATTR_IP=10.0.0.3",
+        route("10.0.0.0/24", "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x400000000007").replace(VR, vr),
+        route("10.0.1.0/24", "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x400000000008").replace(VR, vr),
+        route("10.0.2.0/24").replace(VR, vr),
+        "x|s|SAI_OBJECT_TYPE_ROUTER_INTERFACE:oid:0x6000000000005|SAI_ROUTER_INTERFACE_ATTR_MTU=9000",
+    ])
+
+
+def test_rec_state_canon():
+    state_a = SaiRecState(rec_a())
+    state_b = SaiRecState(rec_b())
+    assert state_a.complete and state_b.complete
+
+    # The OID objects are named by the type and the creation attributes digest
+    nh1 = state_a.rec2canon["oid:0x400000000001"]
+    nh2 = state_a.rec2canon["oid:0x400000000002"]
+    assert re.match(r"^SAI_OBJECT_TYPE_NEXT_HOP:[0-9a-f]{16}#0$", nh1)
+    assert nh1 != nh2
+    assert state_b.rec2canon["oid:0x400000000007"] == nh2
+    assert state_b.rec2canon["oid:0x6000000000005"] == state_a.rec2canon["oid:0x6000000000001"]
+
+    # The discovered objects are named by the parent and the attribute
+    vr = state_a.rec2canon[SW] + "/SAI_SWITCH_ATTR_DEFAULT_VIRTUAL_ROUTER_ID"
+    assert state_a.rec2canon[VR] == vr
+    assert state_b.rec2canon["oid:0x3000000000033"] == vr
+
+    # The entries are named by the key with the normalized OIDs
+    route = 'SAI_OBJECT_TYPE_ROUTE_ENTRY:{{"dest":"10.0.0.0/24","switch_id":"{}","vr":"{}"}}'.format(
+        state_a.rec2canon[SW], vr)
+    assert route in state_a.objects
+    assert route in state_b.objects
+
+    # The objects with the same creation attributes are numbered
+    state = SaiRecState(records([nh("oid:0x400000000001"), nh("oid:0x400000000002")]))
+    names = [state.rec2canon["oid:0x400000000001"], state.rec2canon["oid:0x400000000002"]]
+    assert [name[-2:] for name in names] == ["#0", "#1"]
+    assert names[0][:-2] == names[1][:-2]
+
+
+def test_rec_state_diff():
+    state_a = SaiRecState(rec_a())
+    state_b = SaiRecState(rec_b())
+    canon_a = state_a.rec2canon
+    canon_b = state_b.rec2canon
+
+    def route(dest):
+        return 'SAI_OBJECT_TYPE_ROUTE_ENTRY:{{"dest":"{}","switch_id":"{}","vr":"{}"}}'.format(
+            dest, canon_a[SW], canon_a[VR])
+
+    removes, early_sets, creates, late_sets = state_a.diff(state_b)
+    # The objects are removed in the reverse order of creation
+    assert removes == [route("10.0.9.0/24"), canon_a["oid:0x400000000001"]]
+    assert creates == [canon_b["oid:0x400000000008"], route("10.0.2.0/24")]
+    # The attributes referring to the existing objects are set before the removal,
+    # so the removed next hop is not referred to anymore. The attributes referring
+    # to the created objects are set once they are created.
+    assert early_sets == [
+        (canon_b["oid:0x6000000000005"], "SAI_ROUTER_INTERFACE_ATTR_MTU"),
+        (route("10.0.0.0/24"), "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID"),
+    ]
+    assert late_sets == [(route("10.0.1.0/24"), "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID")]
+
+    # The records are built from the target recording
+    assert state_b.create_record(creates[0])[:2] == ["c", "SAI_OBJECT_TYPE_NEXT_HOP:oid:0x400000000008"]
+    assert state_b.set_record(*late_sets[0])[2] == "SAI_ROUTE_ENTRY_ATTR_NEXT_HOP_ID=oid:0x400000000008"
+
+    # Nothing to do for the same recording
+    assert SaiRecState(rec_a()).diff(state_a) == ([], [], [], [])
+
+
+def test_rec_state_diff_full_replay():
+    state_a = SaiRecState(rec_a())
+
+    # The attribute can not be reset to its default value
+    state_b = SaiRecState(rec_b())
+    assert state_b.diff(state_a) is None
+
+    # The object unknown to the recording is referred to
+    recs = rec_a()
+    recs[10] = parse_rec_line("x|s|SAI_OBJECT_TYPE_NEXT_HOP:oid:0x400000000009|SAI_NEXT_HOP_ATTR_IP=10.0.0.9")
+    state = SaiRecState(recs)
+    assert not state.complete
+    assert state_a.diff(state) is None
+
+    # The switch must be re-created
+    other_sw = records([
+        "x|c|SAI_OBJECT_TYPE_SWITCH:{}|SAI_SWITCH_ATTR_INIT_SWITCH=true|SAI_SWITCH_ATTR_TYPE=SAI_SWITCH_TYPE_NPU".format(SW),
+    ])
+    assert state_a.diff(SaiRecState(other_sw)) is None
+
+
+def test_rec_state_bind():
+    rec2vid = {
+        SW: "oid:0x21000000000a00",
+        VR: "oid:0x3000000000a22",
+        "oid:0x6000000000001": "oid:0x6000000000a01",
+        "oid:0x400000000001": "oid:0x4000000000a01",
+        "oid:0x400000000002": "oid:0x4000000000a02",
+    }
+    state = SaiRecState(rec_a()).bind(rec2vid)
+    # The state keeps its own copy of the mapping
+    rec2vid.clear()
+
+    assert state.dut_key(state.rec2canon["oid:0x400000000001"]) == "oid:0x4000000000a01"
+    assert state.dut_key(state.rec2canon[VR]) == "oid:0x3000000000a22"
+    route = [canon for canon in state.objects if "10.0.9.0" in canon][0]
+    assert state.dut_key(route) == 'SAI_OBJECT_TYPE_ROUTE_ENTRY:' \
+        '{"dest":"10.0.9.0/24","switch_id":"oid:0x21000000000a00","vr":"oid:0x3000000000a22"}'
+
+
+def test_rec_index(tmp_path):
+    fname = str(tmp_path / "sairedis.rec")
+    lines = [nh("oid:0x40000000000{}".format(i)) for i in range(1, 6)]
+    with open(fname, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    index = SaiRecIndex(fname)
+    assert len(index) == 5
+    assert index.line(1) == lines[0]
+    assert index.line(5) == lines[4]
+    assert index.record(3) == parse_rec_line(lines[2])
+
+    expected = records(lines)
+    assert index.records() == expected
+    assert index.records(1, 2) == {1: expected[1]}
+    assert index.records(5) == {5: expected[5]}
+    assert index.records(4, 100) == {4: expected[4], 5: expected[5]}
+    assert index.records(2, 4) == {2: expected[2], 3: expected[3]}
+    assert index.records(3, 3) == {}
+    assert index.records(6) == {}
+    assert index.records(10, 20) == {}
+
+    # The stored index is reused until the recording changes
+    assert SaiRecIndex(fname).offsets == index.offsets
+    with open(fname, "a") as f:
+        f.write(lines[0] + "\n")
+    index = SaiRecIndex(fname)
+    assert len(index) == 6
+    assert index.records(6) == {6: expected[1]}
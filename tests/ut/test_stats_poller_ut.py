@@ -0,0 +1,144 @@
+import time
+import pytest
+from sai_stats import COUNTER_MASK
+from sai_stats import SaiStatsPoller
+from sai_stats import SaiStatsTable
+
+CNTRS = ["SAI_PORT_STAT_IF_IN_UCAST_PKTS", "SAI_PORT_STAT_IF_OUT_UCAST_PKTS"]
+
+
+class FakeStatsNpu:
+    '''
+    Serves get_stats_many() from the counters set by the test.
+    Every call advances the clock by 1 second unless the real time is used.
+    '''
+
+    def __init__(self, oids, real_time=False):
+        self.counters = {oid: {cntr: 0 for cntr in CNTRS} for oid in oids}
+        self.failed = set()
+        self.real_time = real_time
+        self.now = 0.0
+        self.calls = 0
+
+    def get_stats_many(self, objs, attrs, do_assert=True):
+        self.calls += 1
+        self.now += 1.0
+        table = SaiStatsTable(time.monotonic() if self.real_time else self.now)
+        for obj in objs:
+            table[obj] = None if obj in self.failed else dict(self.counters[obj])
+        return table
+
+    def add(self, oid, cntr, value):
+        self.counters[oid][cntr] += value
+
+
+@pytest.fixture
+def fake_npu():
+    return FakeStatsNpu(["oid:0x1", "oid:0x2"])
+
+
+def test_poller_lifecycle():
+    npu = FakeStatsNpu(["oid:0x1"], real_time=True)
+    poller = SaiStatsPoller(npu, {"oid:0x1": CNTRS}, interval=0.01)
+
+    poller.start()
+    with pytest.raises(AssertionError):
+        poller.start()
+    deadline = time.monotonic() + 5
+    while len(poller.history("oid:0x1")) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    poller.stop()
+
+    assert poller.thread is None
+    samples = len(poller.history("oid:0x1"))
+    assert samples >= 3
+    # The polling thread is stopped, so no samples are collected anymore
+    time.sleep(0.05)
+    assert len(poller.history("oid:0x1")) == samples
+    # Stopping the stopped poller is no-op
+    poller.stop()
+    assert len(poller.history("oid:0x1")) == samples
+
+    # The poller can be restarted, and stop() collects the final sample
+    npu.add("oid:0x1", CNTRS[0], 10)
+    with poller:
+        assert poller.thread.is_alive()
+    assert poller.thread is None
+    assert poller.last("oid:0x1")[1][CNTRS[0]] == 10
+    assert poller.errors == 0
+
+
+def test_poller_single_round_trip(fake_npu):
+    poller = SaiStatsPoller(fake_npu, {"oid:0x1": CNTRS, "oid:0x2": CNTRS})
+    poller.poll()
+    assert fake_npu.calls == 1
+    assert poller.last("oid:0x1") == (1.0, {CNTRS[0]: 0, CNTRS[1]: 0})
+    assert poller.last("oid:0x2") == (1.0, {CNTRS[0]: 0, CNTRS[1]: 0})
+
+
+def test_poller_history_wrap(fake_npu):
+    poller = SaiStatsPoller(fake_npu, {"oid:0x1": CNTRS}, history=5)
+    for _ in range(12):
+        fake_npu.add("oid:0x1", CNTRS[0], 1)
+        poller.poll()
+
+    samples = poller.history("oid:0x1")
+    assert len(samples) == 5
+    # Only the last 5 samples are kept
+    assert [ts for ts, _ in samples] == [8.0, 9.0, 10.0, 11.0, 12.0]
+    assert [cntrs[CNTRS[0]] for _, cntrs in samples] == [8, 9, 10, 11, 12]
+    assert poller.delta("oid:0x1", CNTRS[0]) == 4
+
+
+def test_poller_delta_rate(fake_npu):
+    poller = SaiStatsPoller(fake_npu, {"oid:0x1": CNTRS})
+    assert poller.last("oid:0x1") is None
+    assert poller.delta("oid:0x1", CNTRS[0]) == 0
+    assert poller.rate("oid:0x1", CNTRS[0]) == 0.0
+
+    # 100 packets per second for 4 seconds, then 400 packets per second for 2 seconds
+    for incr in [0, 100, 100, 100, 100, 400, 400]:
+        fake_npu.add("oid:0x1", CNTRS[0], incr)
+        poller.poll()
+
+    assert poller.delta("oid:0x1", CNTRS[0]) == 1200
+    assert poller.rate("oid:0x1", CNTRS[0]) == 200.0
+    assert poller.delta("oid:0x1", CNTRS[0], window=2) == 800
+    assert poller.rate("oid:0x1", CNTRS[0], window=2) == 400.0
+    assert poller.delta("oid:0x1", CNTRS[1]) == 0
+    assert poller.rate("oid:0x1", CNTRS[1]) == 0.0
+
+
+def test_poller_counter_reset(fake_npu):
+    poller = SaiStatsPoller(fake_npu, {"oid:0x1": CNTRS})
+    for incr in [0, 100, 100]:
+        fake_npu.add("oid:0x1", CNTRS[0], incr)
+        poller.poll()
+    # The counter is cleared and counts 50 more packets
+    fake_npu.counters["oid:0x1"][CNTRS[0]] = 50
+    poller.poll()
+
+    assert poller.delta("oid:0x1", CNTRS[0]) == 250
+    assert poller.delta("oid:0x1", CNTRS[0], window=1) == 50
+    assert poller.rate("oid:0x1", CNTRS[0]) == 250 / 3
+
+
+def test_stats_table_delta():
+    before = SaiStatsTable(1.0, {"oid:0x1": {CNTRS[0]: 100, CNTRS[1]: COUNTER_MASK - 9}, "oid:0x2": None})
+    after = SaiStatsTable(3.0, {"oid:0x1": {CNTRS[0]: 40, CNTRS[1]: 10}, "oid:0x2": {CNTRS[0]: 1}})
+
+    # The decreased counters are cleared by default
+    assert SaiStatsTable.delta(before, after) == {"oid:0x1": {CNTRS[0]: 40, CNTRS[1]: 10}}
+    # or wrapped around at 64 bits on request
+    assert SaiStatsTable.delta(before, after, wrap=True) == {"oid:0x1": {CNTRS[0]: 2**64 - 60, CNTRS[1]: 20}}
+    assert SaiStatsTable.rate(before, after) == {"oid:0x1": {CNTRS[0]: 20.0, CNTRS[1]: 5.0}}
+
+
+def test_poller_errors(fake_npu):
+    poller = SaiStatsPoller(fake_npu, {"oid:0x1": CNTRS, "oid:0x2": CNTRS})
+    fake_npu.failed.add("oid:0x2")
+    poller.poll()
+    poller.poll()
+    assert poller.errors == 2
+    assert len(poller.history("oid:0x1")) == 2
+    assert len(poller.history("oid:0x2")) == 0
@@ -8,6 +8,7 @@ def config(npu):
     topo_cfg = {
         "lo_rif_oid": None,
         "cpu_port_oid": None,
+        "port_lanes": None,
     }
 
     # Create Loopback RIF
@@ -24,8 +25,7 @@ def config(npu):
     topo_cfg["cpu_port_oid"] = cpu_port_oid
 
     # Get port HW lanes
-    for oid in npu.port_oids:
-        port_lanes = npu.get(oid, ["SAI_PORT_ATTR_HW_LANE_LIST", "8:0,0,0,0,0,0,0,0"]).to_list()
+    topo_cfg["port_lanes"] = list(npu.ports.lanes)
 
     # Remove default VLAN members
     vlan_mbr_oids = npu.get_list(npu.default_vlan_oid, "SAI_VLAN_ATTR_MEMBER_LIST", "oid:0x0")
@@ -38,6 +38,9 @@ def config(npu):
         bp_type = npu.get(oid, ["SAI_BRIDGE_PORT_ATTR_TYPE", "SAI_BRIDGE_PORT_TYPE_PORT"]).value()
         if bp_type == "SAI_BRIDGE_PORT_TYPE_PORT":
             npu.remove(oid)
+            idx = npu.ports.by_bp_oid(oid)
+            if idx is not None:
+                npu.ports.set_bp_oid(idx, None)
     npu.dot1q_bp_oids.clear()
 
     # Create default routes
@@ -63,7 +66,7 @@ def config(npu):
     npu.remove_route("0.0.0.0/0", npu.default_vrf_oid)
 
     # Create default 1Q bridge members
-    for oid in npu.port_oids:
+    for idx, oid in enumerate(npu.port_oids):
         bp_oid = npu.create(SaiObjType.BRIDGE_PORT,
                             [
                                 "SAI_BRIDGE_PORT_ATTR_TYPE", "SAI_BRIDGE_PORT_TYPE_PORT",
@@ -72,6 +75,7 @@ def config(npu):
                                 "SAI_BRIDGE_PORT_ATTR_ADMIN_STATE", "true"
                             ])
         npu.dot1q_bp_oids.append(bp_oid)
+        npu.ports.set_bp_oid(idx, bp_oid)
 
     # Create default VLAN members and set PVID
     for idx, oid in enumerate(npu.port_oids):